@@ -1,66 +1,51 @@
-from flask import Flask, request, jsonify, render_template_string
-import anthropic
+from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context
 import os
 import json
+import time
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 from database import (
     save_message,
+    save_tool_exchange,
     get_conversation_history,
     get_all_conversations,
     get_setting,
     set_setting
 )
 
-try:
-    from google.oauth2 import service_account
-    from googleapiclient.discovery import build
-
-    GOOGLE_AVAILABLE = True
-except ImportError:
-    GOOGLE_AVAILABLE = False
-
+# Тяжелые библиотеки (anthropic, googleapiclient) и модули инструментов импортируются при первом использовании
 from mcp_tools.registry import mcp_registry
-from mcp_tools.gdrive_tools import register_gdrive_tools
-from mcp_tools.pipeline import register_pipeline_tools
-from mcp_tools.local_files import register_local_files_tools
-from mcp_tools.web_api import register_web_api_tools
-from mcp_tools.database_server import register_database_tools
-from mcp_tools.code_executor import register_code_executor_tools
-from mcp_tools.telegram_integration import register_telegram_tools
+from mcp_tools.metrics import metrics, time_anthropic
+from mcp_tools.drive_client import LazyDriveService, google_libraries_available
+from mcp_tools.circuit_breaker import breakers_status
 from mcp_tools.notifications import send_telegram_file, send_telegram_alert
-from mcp_tools.orchestrator import create_orchestrator, ExecutionContext
-from scheduler import set_gdrive_service, get_scheduler, update_scheduler_interval
+from mcp_tools.drive_watch import drive_watch
+from scheduler import set_gdrive_service, get_scheduler, update_scheduler_interval, trigger_monitor_now
+from jobs import job_manager, is_terminal
 
 load_dotenv()
 
-# ============ DEBUG: проверить загрузку переменных окружения ============
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 ANTHROPIC_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-print("\n" + "=" * 80)
-print("[STARTUP] 🔍 ENVIRONMENT VARIABLES CHECK")
-print("=" * 80)
-print(f"[STARTUP] TELEGRAM_TOKEN: {'✅ LOADED' if TELEGRAM_TOKEN else '❌ NOT FOUND'}")
-if TELEGRAM_TOKEN:
-    print(f"           Token starts with: {TELEGRAM_TOKEN[:20]}...")
-print(f"[STARTUP] TELEGRAM_CHAT_ID: {'✅ LOADED' if TELEGRAM_CHAT_ID else '❌ NOT FOUND'}")
-if TELEGRAM_CHAT_ID:
-    print(f"           Chat ID: {TELEGRAM_CHAT_ID}")
-print(f"[STARTUP] ANTHROPIC_API_KEY: {'✅ LOADED' if ANTHROPIC_KEY else '❌ NOT FOUND'}")
-print("=" * 80 + "\n")
 
-if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
-    print("[WARNING] ⚠️  Telegram credentials not fully configured!")
-    print("[WARNING]     Some features may not work properly")
+def _env_status(value):
+    return '✅' if value else '❌'
 
-# ========================================================================
+
+print(f"[STARTUP] 🔍 TELEGRAM_TOKEN {_env_status(TELEGRAM_TOKEN)} • TELEGRAM_CHAT_ID {_env_status(TELEGRAM_CHAT_ID)} "
+      f"• ANTHROPIC_API_KEY {_env_status(ANTHROPIC_KEY)}")
+if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
+    print("[WARNING] ⚠️  Telegram credentials not fully configured, some features may not work properly")
 
 app = Flask(__name__)
 
 CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
-anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_KEY)
+JOB_PIPELINE_TIMEOUT = int(os.getenv("JOB_PIPELINE_TIMEOUT", "3600"))
+anthropic_client = None
 gdrive_service = None
+gdrive_ready = False
 scheduler = None
 orchestrator = None
 mcp_router = None
@@ -82,10 +67,13 @@ User: "Find olympiad 1980 info and send to Telegram"
 
 Available servers and tools:
 
-📁 GOOGLE DRIVE SERVER (3 tools):
-- search_files_in_folder(folder_id, query, file_types): Search files
+📁 GOOGLE DRIVE SERVER (6 tools):
+- search_files_in_folder(folder_id, query, file_types, max_depth): Search files in a folder and its subfolders
 - read_and_summarize(file_id): Read and summarize file
-- run_pipeline(source_folder_id, query, max_files): Full pipeline
+- run_pipeline(source_folder_id, query, max_files): Full pipeline (returns run_id)
+- resume_pipeline(run_id): Continue a failed/interrupted run without redoing finished files
+- get_pipeline_run(run_id): Stored results of a run
+- list_pipeline_runs(limit): Recent runs
 
 📄 LOCAL FILES SERVER (5 tools):
 - list_files(directory, pattern, max_files)
@@ -122,49 +110,102 @@ Available servers and tools:
 - send_file_to_telegram(filename, content, caption): Send file
 - send_alert_to_telegram(title, message): Send alert
 
+⏳ BACKGROUND JOBS (3 tools):
+- submit_pipeline_job(source_folder_id, query, max_files): Run pipeline in background, returns job_id
+- get_job_status(job_id): Check job progress/result
+- cancel_job(job_id): Cancel a job
+
 IMPORTANT:
 1. Always use Telegram tools when user asks to send something
 2. Chain tools efficiently
 3. Report when task is complete"""
 
 
+def http_backend(arguments):
+    """Отдельный circuit breaker на каждый HTTP-хост"""
+    host = urlparse(arguments.get("url", "")).netloc
+    return f"http:{host}" if host else None
+
+
+def configure_tool_policies():
+    """Политики выполнения для инструментов, зарегистрированных внешними модулями"""
+    # Пользовательский код - в отдельном процессе с жестким завершением
+    for name in ("execute_python", "transform_data"):
+        mcp_registry.configure(name, execution="process", timeout=60, timeout_arg="timeout")
+    mcp_registry.configure("calculate_expression", execution="process", timeout=10)
+    # Сетевые запросы и БД - в пуле потоков с таймаутом
+    for name in ("http_get", "http_post", "get_request_info"):
+        mcp_registry.configure(name, execution="thread", timeout=60, backend=http_backend)
+    for name in ("db_select", "db_insert", "db_update", "db_delete", "db_get_data"):
+        mcp_registry.configure(name, execution="thread", timeout=30)
+
+    # Кэш результатов: читающие инструменты и инструменты записи, которые его сбрасывают
+    db_readers = ("db_select", "db_list_tables", "db_get_schema", "db_get_data")
+    for name in db_readers:
+        mcp_registry.configure(name, idempotent=True, ttl=60)
+    for name in ("db_insert", "db_update", "db_delete", "db_create_table"):
+        mcp_registry.configure(name, invalidates=db_readers)
+    file_readers = ("list_files", "read_file", "search_files_by_content", "get_file_stats")
+    for name in file_readers:
+        mcp_registry.configure(name, idempotent=True, ttl=30)
+    mcp_registry.configure("write_file", invalidates=file_readers)
+
+
+def get_anthropic_client():
+    global anthropic_client
+    if anthropic_client is None:
+        import anthropic
+        anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_KEY)
+    return anthropic_client
+
+
+def get_orchestrator():
+    """Оркестратор создается при первом workflow-запросе"""
+    global orchestrator, mcp_router
+    if orchestrator is None and gdrive_ready:
+        from mcp_tools.orchestrator import create_orchestrator
+        orchestrator, mcp_router = create_orchestrator(
+            llm_client=get_anthropic_client(),
+            gdrive_registry=mcp_registry,
+            telegram_registry=mcp_registry
+        )
+        print(f"[Orchestrator] ✅ Created with 7 MCP servers")
+    return orchestrator
+
+
 def init_gdrive():
-    global gdrive_service, scheduler, orchestrator, mcp_router
+    global gdrive_service, gdrive_ready, scheduler
 
-    if not GOOGLE_AVAILABLE:
+    if not google_libraries_available():
         print("[Google Drive] ⚠️  Libraries not available")
         return False
 
     try:
-        creds = service_account.Credentials.from_service_account_file(
-            'credentials.json',
-            scopes=['https://www.googleapis.com/auth/drive']
-        )
-        gdrive_service = build('drive', 'v3', credentials=creds)
-        print("[Google Drive] ✅ Initialized")
-
-        # Регистрировать все MCP серверы (7 серверов)
-        register_gdrive_tools(mcp_registry, gdrive_service)
-        register_pipeline_tools(mcp_registry, gdrive_service)
-        register_local_files_tools(mcp_registry)
-        register_web_api_tools(mcp_registry)
-        register_database_tools(mcp_registry)
-        register_code_executor_tools(mcp_registry)
-        register_telegram_tools(mcp_registry)
-
-        print(f"[MCP] ✅ Registered {len(mcp_registry.tools)} tools from 7 servers")
-
-        # Создать оркестратор
-        orchestrator, mcp_router = create_orchestrator(
-            llm_client=anthropic_client,
-            gdrive_registry=mcp_registry,
-            telegram_registry=mcp_registry
-        )
-        print(f"[Orchestrator] ✅ Created with 7 MCP servers")
+        # Клиент Google строится при первом вызове Drive-инструмента
+        gdrive_service = LazyDriveService('credentials.json')
+
+        # Регистрировать все MCP серверы (7 серверов) - модули загружаются при первом обращении к реестру
+        mcp_registry.add_provider("mcp_tools.gdrive_tools:register_gdrive_tools", gdrive_service)
+        mcp_registry.add_provider("mcp_tools.pipeline:register_pipeline_tools", gdrive_service)
+        mcp_registry.add_provider("mcp_tools.local_files:register_local_files_tools")
+        mcp_registry.add_provider("mcp_tools.web_api:register_web_api_tools")
+        mcp_registry.add_provider("mcp_tools.database_server:register_database_tools")
+        mcp_registry.add_provider("mcp_tools.code_executor:register_code_executor_tools")
+        mcp_registry.add_provider("mcp_tools.telegram_integration:register_telegram_tools")
+        mcp_registry.add_provider("jobs:register_job_tools", job_manager)
+        mcp_registry.add_provider("mcp_tools.mcp_client:register_external_mcp_tools")
+        configure_tool_policies()
+
+        print(f"[MCP] ✅ Declared {len(mcp_registry.pending_providers())} tool providers (lazy)")
 
         set_gdrive_service(gdrive_service)
         scheduler = get_scheduler()
 
+        job_manager.recover()
+        job_manager.register_runner("workflow", run_workflow_job)
+        job_manager.register_runner("pipeline", run_pipeline_job)
+
+        gdrive_ready = True
         return True
     except Exception as e:
         print(f"[Google Drive] ❌ Error: {e}")
@@ -173,6 +214,32 @@ def init_gdrive():
         return False
 
 
+def run_workflow_job(params, job):
+    """Фоновая задача: оркестратор (отмена возможна только до старта)"""
+    job.progress("Executing workflow")
+    context = get_orchestrator().execute_workflow(params["request"])
+    return {
+        'session_id': context.session_id,
+        'steps': len(context.history),
+        'state': context.state
+    }
+
+
+def run_pipeline_job(params, job):
+    """Фоновая задача: run_pipeline с прогрессом и кооперативной отменой"""
+    arguments = dict(params)
+    arguments["on_progress"] = job.progress
+    arguments["should_stop"] = job.is_cancelled
+    return mcp_registry.execute_tool("run_pipeline", arguments, timeout=JOB_PIPELINE_TIMEOUT)
+
+
+def serialize_content_block(block):
+    """Преобразовать блок ответа Claude в dict для хранения и повторной отправки в API"""
+    if block.type == "tool_use":
+        return {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}
+    return {"type": "text", "text": block.text}
+
+
 @app.route('/')
 def index():
     return render_template_string('''<!DOCTYPE html>
@@ -421,9 +488,9 @@ def chat():
         print(f"[CHAT] 🟦 USER: {msg}")
         if not msg:
             return jsonify({'success': False, 'error': 'Empty message'})
-        history = get_conversation_history(sid)
+        history = get_conversation_history(sid, for_api=True)
         history.append({"role": "user", "content": msg})
-        save_message(sid, "user", msg)
+        user_message_id = save_message(sid, "user", msg)
         tools = mcp_registry.get_tool_definitions()
         all_tool_calls = []
         final_text = ""
@@ -431,24 +498,25 @@ def chat():
         while True:
             iteration += 1
             print(f"[CHAT] 🔄 ITERATION {iteration}")
-            response = anthropic_client.messages.create(
-                model=CLAUDE_MODEL,
-                max_tokens=4096,
-                system=SYSTEM_PROMPT,
-                tools=tools,
-                messages=history
-            )
+            with time_anthropic("chat"):
+                response = get_anthropic_client().messages.create(
+                    model=CLAUDE_MODEL,
+                    max_tokens=4096,
+                    system=SYSTEM_PROMPT,
+                    tools=tools,
+                    messages=history
+                )
             tool_calls_this_round = []
             tool_results = []
             assistant_content = []
             for block in response.content:
                 if block.type == "tool_use":
                     tool_name = block.name
+                    assistant_content.append(serialize_content_block(block))
                     try:
                         result = mcp_registry.execute_tool(tool_name, block.input)
                         tool_calls_this_round.append({"name": tool_name})
                         all_tool_calls.append({"name": tool_name})
-                        assistant_content.append(block)
                         tool_results.append(
                             {"type": "tool_result", "tool_use_id": block.id, "content": json.dumps(result)})
                         print(f"[CHAT] ✅ Tool executed: {tool_name}")
@@ -458,11 +526,12 @@ def chat():
                             {"type": "tool_result", "tool_use_id": block.id, "content": json.dumps({"error": str(e)})})
                 elif block.type == "text":
                     final_text = block.text
-                    assistant_content.append(block)
+                    assistant_content.append(serialize_content_block(block))
             if not tool_results:
                 break
             history.append({"role": "assistant", "content": assistant_content})
             history.append({"role": "user", "content": tool_results})
+            save_tool_exchange(sid, user_message_id, iteration, assistant_content, tool_results)
         save_message(sid, "assistant", final_text, all_tool_calls if all_tool_calls else None)
         print(f"[CHAT] ✅ COMPLETE - {iteration} iterations, {len(all_tool_calls)} tools used")
         print(f"{'=' * 100}\n")
@@ -484,9 +553,12 @@ def workflow():
     try:
         data = request.json
         request_text = data.get('request', '')
-        if not request_text or not orchestrator:
+        if not request_text or not get_orchestrator():
             return jsonify({'error': 'Invalid request'})
-        context = orchestrator.execute_workflow(request_text)
+        if data.get('background'):
+            job_id = job_manager.submit("workflow", {"request": request_text})
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
+        context = get_orchestrator().execute_workflow(request_text)
         return jsonify({
             'success': True,
             'session_id': context.session_id,
@@ -497,6 +569,81 @@ def workflow():
         return jsonify({'error': str(e)})
 
 
+# ============ BACKGROUND JOBS ============
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    try:
+        data = request.json or {}
+        kind = data.get('kind')
+        params = data.get('params', {})
+        if kind == 'workflow' and not get_orchestrator():
+            return jsonify({'success': False, 'error': 'Orchestrator not ready'}), 400
+        job_id = job_manager.submit(kind, params)
+        return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'jobs': job_manager.list(limit)})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    ok = job_manager.cancel(job_id)
+    if not ok:
+        return jsonify({'success': False, 'error': 'Job not found or already finished'}), 409
+    return jsonify({'success': True})
+
+
+@app.route('/api/jobs/<job_id>/stream')
+def stream_job(job_id):
+    """Server-Sent Events: статус задачи при каждом изменении до завершения"""
+    if not job_manager.get(job_id):
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    def events():
+        last_state = None
+        while True:
+            job = job_manager.get(job_id)
+            state = (job['status'], job['updated_at'], json.dumps(job.get('progress'), default=str))
+            if state != last_state:
+                last_state = state
+                yield f"data: {json.dumps(job, ensure_ascii=False, default=str)}\n\n"
+            if is_terminal(job):
+                break
+            time.sleep(1)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
+
+
+# ============ DRIVE PUSH NOTIFICATIONS ============
+@app.route('/api/drive/webhook', methods=['POST'])
+def drive_webhook():
+    """Уведомление Drive по каналу changes.watch: проверка канала и внеочередной запуск монитора"""
+    status, result = drive_watch.handle_notification(request.headers)
+    if result.get('trigger'):
+        result['scheduled'] = trigger_monitor_now()
+    return jsonify(result), status
+
+
+@app.route('/api/drive/watch', methods=['GET'])
+def drive_watch_status():
+    return jsonify(drive_watch.status())
+
+
 # ============ TELEGRAM ENDPOINTS ============
 @app.route('/api/send-to-telegram', methods=['POST'])
 def send_to_telegram():
@@ -547,15 +694,26 @@ def send_alert_endpoint():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/health', methods=['GET'])
 def health():
+    breakers = breakers_status()
+    degraded = any(b['state'] != 'closed' for b in breakers.values())
     return jsonify({
-        'status': 'healthy',
+        'status': 'degraded' if degraded else 'healthy',
         'telegram_configured': bool(TELEGRAM_TOKEN and TELEGRAM_CHAT_ID),
         'anthropic_configured': bool(ANTHROPIC_KEY),
         'gdrive_initialized': gdrive_service is not None,
-        'orchestrator_ready': orchestrator is not None,
-        'tools_count': len(mcp_registry.tools)
+        'gdrive_client_built': bool(gdrive_service is not None and gdrive_service.built),
+        'gdrive_transports': gdrive_service.status()['transports'] if gdrive_service is not None else 0,
+        'orchestrator_ready': gdrive_ready,
+        'tools_count': len(mcp_registry.loaded_tools()),
+        'tool_providers_pending': len(mcp_registry.pending_providers()),
+        'circuit_breakers': breakers
     })
 
 
@@ -566,9 +724,11 @@ if __name__ == '__main__':
     print(f"[INFO] 📊 7 MCP Servers • 29+ Tools • Telegram Integrated")
     print(f"[INFO] 📡 Endpoints available:")
     print(f"       • /api/chat - Chat with auto-Telegram sending")
-    print(f"       • /api/workflow - Multi-step orchestrator")
+    print(f"       • /api/workflow - Multi-step orchestrator (background=true -> job)")
+    print(f"       • /api/jobs - Background jobs (submit, status, stream, cancel)")
     print(f"       • /api/send-to-telegram - Direct file send")
     print(f"       • /api/send-telegram-alert - Direct alert send")
     print(f"       • /api/health - System health")
+    print(f"       • /api/metrics - Prometheus metrics")
     print(f"{'=' * 80}\n")
     app.run(host='0.0.0.0', port=8000, debug=False, use_reloader=False)
\ No newline at end of file
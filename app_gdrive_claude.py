@@ -3,16 +3,10 @@ import anthropic
 import os
 import json
 from dotenv import load_dotenv
-import io
+from mcp_tools.extractors import read_text, UnsupportedFormat
+from mcp_tools.drive_client import LazyDriveService, google_libraries_available
 
-try:
-    from google.oauth2 import service_account
-    from googleapiclient.discovery import build
-    from googleapiclient.http import MediaIoBaseDownload
-
-    GOOGLE_AVAILABLE = True
-except ImportError:
-    GOOGLE_AVAILABLE = False
+GOOGLE_AVAILABLE = google_libraries_available()
 
 load_dotenv()
 app = Flask(__name__)
@@ -27,12 +21,9 @@ def init_gdrive():
     if not GOOGLE_AVAILABLE:
         return False
     try:
-        creds = service_account.Credentials.from_service_account_file(
-            'credentials.json',
-            scopes=['https://www.googleapis.com/auth/drive']
-        )
-        gdrive_service = build('drive', 'v3', credentials=creds)
-        print("[Google Drive] ✅ Initialized")
+        # Пул: у каждого потока Flask свой HTTP-транспорт, учетные данные общие
+        gdrive_service = LazyDriveService('credentials.json')
+        gdrive_service.get()
         return True
     except Exception as e:
         print(f"[Google Drive] ❌ Error: {e}")
@@ -145,75 +136,27 @@ def read_file_content(file_id):
         # Получить информацию о файле
         file_info = gdrive_service.files().get(
             fileId=file_id,
-            fields='name, mimeType, size'
+            fields='name, mimeType, size, md5Checksum, modifiedTime'
         ).execute()
 
         file_name = file_info.get('name', 'unknown')
         mime_type = file_info.get('mimeType', '')
         file_size = int(file_info.get('size', 0))
 
-        # Ограничение на размер файла (5MB)
-        if file_size > 5 * 1024 * 1024:
-            return {
-                "error": "File too large",
-                "size_mb": round(file_size / (1024 ** 2), 2),
-                "message": "File size exceeds 5MB limit. Please download manually."
-            }
-
-        # Текстовые форматы которые можно читать
-        readable_types = [
-            'text/plain',
-            'text/csv',
-            'text/html',
-            'text/xml',
-            'application/json',
-            'application/x-python',
-            'application/javascript',
-            'application/sql',
-            'text/markdown',
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # .docx
-            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',  # .xlsx
-        ]
-
-        # Для Google Docs/Sheets/Slides - экспортируем
-        if mime_type == 'application/vnd.google-apps.document':
-            # Экспортируем как текст
-            request_obj = gdrive_service.files().export(
-                fileId=file_id,
-                mimeType='text/plain'
-            )
-        elif mime_type == 'application/vnd.google-apps.spreadsheet':
-            # Экспортируем как CSV
-            request_obj = gdrive_service.files().export(
-                fileId=file_id,
-                mimeType='text/csv'
-            )
-        elif any(mime_type.startswith(t.split('/')[0]) for t in readable_types):
-            # Прямая загрузка текстовых файлов
-            request_obj = gdrive_service.files().get_media(fileId=file_id)
-        else:
+        # Текст, docx/xlsx/pptx/pdf и экспорт Google Docs/Sheets/Slides - через общие экстракторы
+        max_chars = 10000
+        try:
+            content, truncated = read_text(gdrive_service, file_id, file_info, max_chars)
+        except UnsupportedFormat as e:
             return {
                 "error": "Unsupported file type",
                 "file_name": file_name,
                 "mime_type": mime_type,
-                "message": f"Cannot read files of type: {mime_type}"
+                "message": str(e)
             }
 
-        # Загружаем содержимое
-        file_stream = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_stream, request_obj)
-        done = False
-
-        while not done:
-            status, done = downloader.next_chunk()
-
-        file_stream.seek(0)
-        content = file_stream.read().decode('utf-8', errors='ignore')
-
-        # Ограничиваем длину контента
-        max_chars = 10000
-        if len(content) > max_chars:
-            content = content[:max_chars] + f"\n\n... (файл обрезан, показано первых {max_chars} символов)"
+        if truncated:
+            content = content + f"\n\n... (файл обрезан, показано первых {max_chars} символов)"
 
         return {
             "file_name": file_name,
@@ -0,0 +1,582 @@
+import subprocess
+import json
+import io
+import time
+import sys
+import os
+
+# Код, выполняемый в чистом интерпретаторе: время импорта app и время до первого ответа /api/health
+STARTUP_PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+resp = client.get('/api/health')
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_health_ms": (t2 - t0) * 1000, "status": resp.status_code}))
+"""
+
+
+def bench_startup(runs=5, budget_ms=None):
+    """Холодный старт: import app + первый /api/health, медиана по нескольким запускам"""
+    budget_ms = budget_ms or float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+    print(f"🚀 Startup benchmark ({runs} runs, budget {budget_ms:.0f} ms)\n")
+
+    samples = []
+    for i in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if result.returncode != 0:
+            print(f"❌ Run {i + 1} failed:\n{result.stderr}")
+            return False
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        samples.append(sample)
+        print(f"   {i + 1}: import {sample['import_ms']:.0f} ms, first /api/health {sample['first_health_ms']:.0f} ms")
+
+    import_ms = sorted(s["import_ms"] for s in samples)[len(samples) // 2]
+    health_ms = sorted(s["first_health_ms"] for s in samples)[len(samples) // 2]
+    print(f"\n📊 Median: import {import_ms:.0f} ms, first /api/health {health_ms:.0f} ms")
+
+    if health_ms > budget_ms:
+        print(f"❌ REGRESSION: {health_ms:.0f} ms > budget {budget_ms:.0f} ms")
+        return False
+    print(f"✅ Within budget")
+    return True
+
+
+class _FakeRequest:
+    def __init__(self, result=None, delay=0.0, data=b""):
+        self.result = result
+        self.delay = delay
+        self.data = data
+
+    def execute(self):
+        time.sleep(self.delay)
+        return self.result
+
+
+class _FakeDrive:
+    """Стенд Drive: листинг папки, метаданные и скачивание с заданной задержкой"""
+
+    def __init__(self, files, download_delay):
+        self.files_list = files
+        self.download_delay = download_delay
+
+    def files(self):
+        return self
+
+    def list(self, **kwargs):
+        return _FakeRequest({"files": self.files_list})
+
+    def get(self, fileId, **kwargs):
+        f = next(f for f in self.files_list if f["id"] == fileId)
+        return _FakeRequest({**f, "md5Checksum": fileId})
+
+    def get_media(self, fileId, **kwargs):
+        return _FakeRequest(delay=self.download_delay, data=f"content of {fileId}\n".encode() * 50)
+
+
+class _FakeAnthropic:
+    """Стенд Claude API: фиксированная задержка ответа"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.messages = self
+
+    def create(self, **kwargs):
+        time.sleep(self.delay)
+        block = type("Block", (), {"text": "summary"})()
+        usage = type("Usage", (), {"input_tokens": 100, "output_tokens": 10})()
+        return type("Response", (), {"content": [block], "usage": usage})()
+
+
+class _Collector:
+    def __init__(self):
+        self.tools = {}
+
+    def register(self, name, func, *args, **kwargs):
+        self.tools[name] = func
+
+
+def bench_pipeline(files=12, download_ms=150, llm_ms=300, levels=(1, 2, 4, 8)):
+    """run_pipeline на стендах Drive и Claude: время в зависимости от числа потоков"""
+    import tempfile
+    import database
+    from mcp_tools import pipeline, content_cache as content_cache_module
+    from mcp_tools.rate_limit import ConcurrencyLimiter
+
+    print(f"🚀 Pipeline benchmark ({files} files, download {download_ms} ms, Claude {llm_ms} ms)\n")
+
+    tmp = tempfile.mkdtemp(prefix="bench_pipeline_")
+    database.DB_PATH = os.path.join(tmp, "bench.db")
+    database._initialized = False
+    content_cache_module.content_cache.directory = os.path.join(tmp, "cache")
+    content_cache_module.download_bytes = lambda request: request.execute() or request.data
+    content_cache_module.download_prefix = lambda request, max_chars: (request.execute() or request.data, True)
+    pipeline.get_anthropic_client = lambda: _FakeAnthropic(llm_ms / 1000)
+    pipeline.send_telegram_file = lambda filename, content: True
+
+    timings = {}
+    for level in levels:
+        # уникальные id на каждый прогон: кэши содержимого и резюме не должны срабатывать
+        fake_files = [
+            {"id": f"c{level}_f{i}", "name": f"file_{i}.txt", "mimeType": "text/plain", "size": "1000",
+             "modifiedTime": "2024-01-01T00:00:00Z", "createdTime": f"2024-01-{28 - i:02d}T00:00:00Z"}
+            for i in range(files)
+        ]
+        collector = _Collector()
+        pipeline.PIPELINE_WORKERS = level
+        pipeline.anthropic_limiter = ConcurrencyLimiter(level)
+        pipeline.register_pipeline_tools(collector, _FakeDrive(fake_files, download_ms / 1000))
+
+        start = time.perf_counter()
+        result = collector.tools["run_pipeline"]("folder", max_files=files)
+        timings[level] = time.perf_counter() - start
+
+        names = [s["file_name"] for s in result.get("summaries", [])]
+        if not result.get("success") or names != [f["name"] for f in fake_files]:
+            print(f"❌ concurrency {level}: unexpected result {result}")
+            return False
+        print(f"   concurrency {level}: {timings[level] * 1000:.0f} ms "
+              f"(x{timings[levels[0]] / timings[level]:.1f})")
+
+    best = min(levels[1:], key=lambda level: timings[level]) if len(levels) > 1 else levels[0]
+    speedup = timings[levels[0]] / timings[best]
+    print(f"\n📊 Best: concurrency {best}, x{speedup:.1f} vs sequential, order preserved")
+    if len(levels) > 1 and speedup < 1.5:
+        print("❌ REGRESSION: concurrent run is not faster than sequential")
+        return False
+    print("✅ Speedup confirmed")
+    return True
+
+
+SAMPLE_TEXT = "Квартальный отчет: выручка выросла на 12%, расходы на логистику снизились. "
+
+
+def _sample_docx(paragraphs):
+    import zipfile
+    ns = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    body = "".join(f"<w:p><w:r><w:t>{i}. {SAMPLE_TEXT}</w:t></w:r></w:p>" for i in range(paragraphs))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("word/document.xml", f"<w:document {ns}><w:body>{body}</w:body></w:document>")
+    return buffer.getvalue()
+
+
+def _sample_xlsx(rows):
+    import zipfile
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    data = "".join(f'<row r="{i + 1}"><c t="s"><v>0</v></c><c><v>{i * 1.5}</v></c></row>' for i in range(rows))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("xl/workbook.xml", f'<workbook {ns}><sheets><sheet name="Данные"/></sheets></workbook>')
+        archive.writestr("xl/sharedStrings.xml", f"<sst {ns}><si><t>{SAMPLE_TEXT}</t></si></sst>")
+        archive.writestr("xl/worksheets/sheet1.xml", f"<worksheet {ns}><sheetData>{data}</sheetData></worksheet>")
+    return buffer.getvalue()
+
+
+def _sample_pptx(slides):
+    import zipfile
+    ns = 'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"'
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for i in range(1, slides + 1):
+            paragraphs = "".join(f"<a:p><a:r><a:t>{SAMPLE_TEXT}</a:t></a:r></a:p>" for _ in range(10))
+            archive.writestr(f"ppt/slides/slide{i}.xml", f"<sld {ns}><txBody>{paragraphs}</txBody></sld>")
+    return buffer.getvalue()
+
+
+def _sample_pdf(pages):
+    """Минимальный PDF с текстом на каждой странице (ASCII: стандартный шрифт Helvetica)"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for i in range(pages):
+        lines = "".join(f"(Page {i} line {j}: quarterly revenue grew by 12 percent) Tj 0 -14 Td " for j in range(40))
+        stream = f"BT /F1 10 Tf 40 800 Td {lines}ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), pages)
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def bench_extract(budget=10000):
+    """Извлечение текста из больших docx/xlsx/pptx/pdf: время и пик памяти (tracemalloc),
+    чтение по бюджету символов против полного извлечения"""
+    import tracemalloc
+    import importlib.util
+    from mcp_tools.extractors import extract_text
+
+    print(f"🚀 Extract benchmark (budget {budget} chars)\n")
+    samples = [("docx", _sample_docx(60000)), ("xlsx", _sample_xlsx(100000)), ("pptx", _sample_pptx(1500))]
+    if importlib.util.find_spec("pypdf") is not None:
+        samples.append(("pdf", _sample_pdf(300)))
+    else:
+        print("   pdf: skipped (pypdf not installed)")
+    ok = True
+    for kind, data in samples:
+        measured = {}
+        for label, max_chars in (("budget", budget), ("full", None)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            text, truncated = extract_text(data, kind, max_chars)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            measured[label] = (elapsed, peak, len(text))
+        (budget_s, budget_peak, budget_chars), (full_s, full_peak, full_chars) = measured["budget"], measured["full"]
+        print(f"   {kind}: {len(data) / 1024 ** 2:.1f} MB, {full_chars} chars | "
+              f"budget {budget_s * 1000:.0f} ms / peak {budget_peak / 1024:.0f} KB | "
+              f"full {full_s * 1000:.0f} ms / peak {full_peak / 1024 ** 2:.1f} MB")
+        if budget_chars != budget or (kind != "pdf" and "Квартальный" not in text):
+            print(f"❌ {kind}: unexpected text ({budget_chars} chars)")
+            ok = False
+        elif budget_s > full_s:
+            print(f"❌ REGRESSION: {kind} budgeted extraction is not faster than full")
+            ok = False
+
+    if ok:
+        print("\n✅ Budgeted extraction stops early")
+    return ok
+
+
+def bench_drive_pool(threads=16, requests_per_thread=25, rounds=5):
+    """Стресс-тест пула Drive-сервисов на локальном фейковом сервере Drive:
+    параллельные files.get из многих потоков без ошибок и с правильными ответами.
+    Каждый раунд - новые короткие потоки (как запросы Flask): транспорты переиспользуются"""
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse
+    from mcp_tools.drive_client import LazyDriveService, google_libraries_available
+
+    print(f"🚀 Drive pool stress test ({rounds} rounds x {threads} threads x {requests_per_thread} requests)\n")
+    if not google_libraries_available():
+        print("   skipped (googleapiclient not installed)")
+        return True
+    from google.auth.credentials import AnonymousCredentials
+
+    class FakeDriveHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            file_id = urlparse(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+            time.sleep(0.002)
+            body = json.dumps({"id": file_id, "name": f"{file_id}.txt"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDriveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service = LazyDriveService(
+        credentials=AnonymousCredentials(),
+        client_options={"api_endpoint": f"http://127.0.0.1:{server.server_address[1]}/"}
+    )
+
+    errors = []
+
+    def worker(number):
+        for i in range(requests_per_thread):
+            file_id = f"t{number}_{i}"
+            try:
+                response = service.files().get(fileId=file_id).execute()
+                if response.get("id") != file_id:
+                    errors.append(f"{file_id}: got response for {response.get('id')}")
+            except Exception as e:
+                errors.append(f"{file_id}: {e}")
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    total = rounds * threads * requests_per_thread
+    transports = service.status()['transports']
+    print(f"   {total} requests from {rounds * threads} threads in {elapsed * 1000:.0f} ms, {transports} transports")
+    if errors:
+        print(f"❌ {len(errors)} error(s), first: {errors[0]}")
+        return False
+    if transports > threads:
+        print(f"❌ Transports not reused: {transports} for {threads} concurrent threads")
+        return False
+    print("✅ No errors under concurrency, transports reused across threads")
+    return True
+
+
+class _FakeWatchDrive:
+    """Стенд Drive для push-каналов: changes.watch, channels.stop, getStartPageToken"""
+
+    def __init__(self, max_ttl):
+        self.max_ttl = max_ttl
+        self.watched = []
+        self.stopped = []
+
+    def changes(self):
+        return self
+
+    def channels(self):
+        return self
+
+    def getStartPageToken(self, **kwargs):
+        return _FakeRequest({"startPageToken": "1"})
+
+    def watch(self, pageToken, body, **kwargs):
+        self.watched.append(body)
+        # как и Drive, стенд сокращает запрошенный срок канала
+        expiration = min(body["expiration"], int((time.time() + self.max_ttl) * 1000))
+        return _FakeRequest({"id": body["id"], "resourceId": f"res-{len(self.watched)}", "expiration": str(expiration)})
+
+    def stop(self, body):
+        self.stopped.append(body["id"])
+        return _FakeRequest({})
+
+
+def bench_webhook(poll_interval=30):
+    """Push-уведомления Drive: локальный стенд отправителя Google шлет уведомления на webhook
+    (через Flask-маршрут app.py, если app импортируется, иначе напрямую в обработчик);
+    проверяются создание и продление канала, фильтрация и задержка до запуска монитора"""
+    import tempfile
+    import database
+    from mcp_tools.drive_watch import DriveWatchManager
+
+    print(f"🚀 Webhook benchmark (polling interval {poll_interval}s)\n")
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_webhook_"), "bench.db")
+    # схема создается при первом соединении - для новой БД заново
+    database._initialized = False
+    manager = DriveWatchManager(address="https://example.test/api/drive/webhook", ttl=3600,
+                                renew_before=600, fallback_interval=600)
+    drive = _FakeWatchDrive(max_ttl=300)
+    triggered = []
+
+    try:
+        import app as app_module
+        app_module.drive_watch = manager
+        app_module.trigger_monitor_now = lambda: triggered.append(time.perf_counter()) or True
+        client = app_module.app.test_client()
+
+        def notify(headers):
+            response = client.post("/api/drive/webhook", headers=headers)
+            return response.status_code, response.get_json()
+        print("   via Flask route /api/drive/webhook")
+    except Exception as e:
+        def notify(headers):
+            status, result = manager.handle_notification(headers)
+            if result.get("trigger"):
+                triggered.append(time.perf_counter())
+            return status, result
+        print(f"   via handle_notification (app not importable: {e.__class__.__name__})")
+
+    channel = manager.ensure_channel(drive)
+    if not channel or not manager.is_active():
+        print("❌ Channel was not created")
+        return False
+
+    def headers(channel, state, number, token=None):
+        return {"X-Goog-Channel-ID": channel["id"], "X-Goog-Channel-Token": token or channel["token"],
+                "X-Goog-Resource-State": state, "X-Goog-Message-Number": str(number)}
+
+    checks = []
+    checks.append(("sync ignored", notify(headers(channel, "sync", 1)) == (200, {"state": "sync", "trigger": False})))
+    checks.append(("forged token rejected", notify(headers(channel, "change", 2, token="forged"))[0] == 403))
+
+    latencies = []
+    for number in range(3, 23):
+        start = time.perf_counter()
+        status, _ = notify(headers(channel, "change", number))
+        latencies.append((triggered[-1] - start) * 1000 if status == 200 and triggered else None)
+    checks.append(("changes trigger monitor", all(latency is not None for latency in latencies)))
+
+    # срок канала урезан стендом до 5 минут - меньше renew_before, поэтому канал продлевается
+    renewed = manager.ensure_channel(drive)
+    checks.append(("channel renewed", renewed and renewed["id"] != channel["id"] and drive.stopped == [channel["id"]]))
+    triggers_before = len(triggered)
+    status, result = notify(headers(channel, "change", 99))
+    checks.append(("old channel ignored", status == 200 and len(triggered) == triggers_before))
+
+    for name, ok in checks:
+        print(f"   {'✅' if ok else '❌'} {name}")
+    if not all(ok for _, ok in checks):
+        return False
+
+    latency = sorted(latencies)[len(latencies) // 2]
+    print(f"\n📊 Notification -> monitor trigger: median {latency:.1f} ms "
+          f"(polling: up to {poll_interval}s, avg {poll_interval / 2:.0f}s; fallback poll every "
+          f"{manager.fallback_interval}s)")
+    print("✅ Push notifications work")
+    return True
+
+
+class _FakeChangesDrive:
+    """Стенд Drive для монитора папки: files.list по родителю, постраничный changes.list
+    (токен - позиция в журнале изменений) и счетчики запросов"""
+
+    def __init__(self, changes_page_size=3):
+        self.store = {}
+        self.journal = []
+        self.changes_page_size = changes_page_size
+        self.calls = {"getStartPageToken": 0, "files.list": 0, "changes.list": 0}
+        self.changes_tokens = []
+
+    def put(self, file_id, record=True, **fields):
+        f = {"id": file_id, "mimeType": "text/plain", "modifiedTime": "2024-01-01T00:00:00Z",
+             "md5Checksum": f"md5-{file_id}", "trashed": False, **self.store.get(file_id, {}), **fields}
+        f["name"] = f.get("name") or f"{file_id}.txt"
+        self.store[file_id] = f
+        if record:
+            self.journal.append({"fileId": file_id, "removed": False, "file": dict(f)})
+
+    def remove(self, file_id):
+        del self.store[file_id]
+        self.journal.append({"fileId": file_id, "removed": True})
+
+    def reset_calls(self):
+        for name in self.calls:
+            self.calls[name] = 0
+        self.changes_tokens = []
+
+    def files_list(self, q="", pageToken=None, **kwargs):
+        self.calls["files.list"] += 1
+        parent_id = q.split("'")[1]
+        return _FakeRequest({"files": [dict(f) for f in self.store.values()
+                                       if parent_id in f.get("parents", []) and not f["trashed"]]})
+
+    def files(self):
+        fake = self
+
+        class Files:
+            def list(self, **kwargs):
+                return fake.files_list(**kwargs)
+        return Files()
+
+    def changes(self):
+        return self
+
+    def getStartPageToken(self, **kwargs):
+        self.calls["getStartPageToken"] += 1
+        return _FakeRequest({"startPageToken": str(len(self.journal))})
+
+    def list(self, pageToken, **kwargs):
+        self.calls["changes.list"] += 1
+        self.changes_tokens.append(pageToken)
+        start = int(pageToken)
+        end = start + self.changes_page_size
+        response = {"changes": self.journal[start:end]}
+        if end < len(self.journal):
+            response["nextPageToken"] = str(end)
+        else:
+            response["newStartPageToken"] = str(len(self.journal))
+        return _FakeRequest(response)
+
+
+def bench_monitor_sync():
+    """Монитор папки на Changes API (sync_folder): первый тик - токен и один листинг дерева,
+    дальше только changes.list (по запросу на страницу) и правильная классификация изменений"""
+    import tempfile
+    import database
+    import sheduler
+
+    print("🚀 Monitor sync check (fake Drive with request counters)\n")
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_monitor_"), "bench.db")
+    database._initialized = False
+    drive = _FakeChangesDrive(changes_page_size=3)
+    sheduler.gdrive_service = drive
+
+    folder = "root"
+    drive.put("sub", record=False, mimeType="application/vnd.google-apps.folder", parents=[folder])
+    drive.put("outside", record=False, mimeType="application/vnd.google-apps.folder", parents=["elsewhere"])
+    for file_id, parent in (("a", folder), ("b", folder), ("c", "sub"), ("d", "sub"), ("e", "sub")):
+        drive.put(file_id, record=False, parents=[parent])
+
+    checks = []
+    baseline = sheduler.sync_folder(folder)
+    checks.append(("first tick: start token, one listing per folder, no changes.list",
+                   drive.calls == {"getStartPageToken": 1, "files.list": 2, "changes.list": 0}))
+    checks.append(("first tick: baseline reports nothing", baseline == ([], [], [])))
+
+    drive.reset_calls()
+    idle = sheduler.sync_folder(folder)
+    checks.append(("idle tick: one changes.list, no files.list",
+                   drive.calls == {"getStartPageToken": 0, "files.list": 0, "changes.list": 1}
+                   and idle == ([], [], [])))
+
+    drive.reset_calls()
+    journal_start = len(drive.journal)
+    drive.put("f", parents=["sub"])                                    # новый
+    drive.put("a", modifiedTime="2024-02-01T00:00:00Z")                # изменен modifiedTime
+    drive.put("b", md5Checksum="md5-b-2")                              # изменен только md5
+    drive.remove("c")                                                  # удален
+    drive.put("d", trashed=True)                                       # в корзине
+    drive.put("e", parents=["outside"])                                # перемещен из дерева
+    drive.put("g", parents=["outside"])                                # вне дерева
+    pages = -(-(len(drive.journal) - journal_start) // drive.changes_page_size)
+    new_files, modified_files, deleted_files = sheduler.sync_folder(folder)
+    checks.append((f"changes tick: {pages} changes.list (one per page), no files.list",
+                   drive.calls == {"getStartPageToken": 0, "files.list": 0, "changes.list": pages}
+                   and len(set(drive.changes_tokens)) == pages))
+    checks.append(("new: f", sorted(f["id"] for f in new_files) == ["f"]))
+    checks.append(("modified: a (modifiedTime), b (md5)", sorted(f["id"] for f in modified_files) == ["a", "b"]))
+    checks.append(("deleted: c (removed), d (trashed), e (moved out)",
+                   sorted(f["id"] for f in deleted_files) == ["c", "d", "e"]))
+
+    drive.reset_calls()
+    checks.append(("next tick: no changes", sheduler.sync_folder(folder) == ([], [], [])
+                   and drive.calls["changes.list"] == 1 and drive.calls["files.list"] == 0))
+
+    for name, ok in checks:
+        print(f"   {'✅' if ok else '❌'} {name}")
+    if not all(ok for _, ok in checks):
+        print(f"   calls: {drive.calls}")
+        return False
+    print("✅ Monitor reads only the changes delta")
+    return True
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "pipeline": bench_pipeline,
+    "extract": bench_extract,
+    "drive_pool": bench_drive_pool,
+    "webhook": bench_webhook,
+    "monitor_sync": bench_monitor_sync,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    print("=" * 60)
+    print("BENCHMARKS: " + ", ".join(names))
+    print("=" * 60 + "\n")
+
+    ok = True
+    for name in names:
+        ok = BENCHMARKS[name]() and ok
+        print()
+    sys.exit(0 if ok else 1)
@@ -1,10 +1,17 @@
 """Database module for conversations, settings, and users"""
 import sqlite3
+import threading
 from datetime import datetime
 import json
+import zlib
+
+from mcp_tools.metrics import timed_db
 
 DB_PATH = "agent.db"
 
+_initialized = False
+_init_lock = threading.Lock()
+
 
 def init_db():
     """Инициализация базы данных"""
@@ -141,6 +148,115 @@ def init_db():
                  )
         )''')
 
+    # Таблица обменов с инструментами (tool_use + tool_result) для воспроизведения истории
+    c.execute('''CREATE TABLE IF NOT EXISTS tool_exchanges
+    (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        assistant_content BLOB NOT NULL,
+        tool_results BLOB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id),
+        FOREIGN KEY (message_id) REFERENCES messages (id)
+    )''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_tool_exchanges_message
+                 ON tool_exchanges (conversation_id, message_id, seq)''')
+
+    # Таблица фоновых задач (workflow, pipeline)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs
+    (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params TEXT,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress TEXT,
+        result TEXT,
+        error TEXT,
+        cancel_requested INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+
+    # Снимок папок Drive для монитора (переживает перезапуск)
+    c.execute('''CREATE TABLE IF NOT EXISTS drive_snapshot
+    (
+        folder_id TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        name TEXT,
+        mime_type TEXT,
+        size_mb REAL,
+        modified_time TEXT,
+        created_time TEXT,
+        md5 TEXT,
+        depth INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (folder_id, file_id)
+    ) WITHOUT ROWID''')
+    # depth (глубина в дереве папки) добавлена позже - для баз, созданных раньше
+    if 'depth' not in [row[1] for row in c.execute("PRAGMA table_info(drive_snapshot)")]:
+        c.execute("ALTER TABLE drive_snapshot ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+
+    _init_drive_mirror(c)
+
+    # Запуски pipeline и состояние каждого файла - для возобновления после сбоя
+    c.execute('''CREATE TABLE IF NOT EXISTS pipeline_runs
+    (
+        id TEXT PRIMARY KEY,
+        source_folder_id TEXT,
+        query TEXT,
+        files TEXT,
+        status TEXT NOT NULL DEFAULT 'running',
+        deliveries TEXT,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS pipeline_run_files
+    (
+        run_id TEXT NOT NULL,
+        file_index INTEGER NOT NULL,
+        file_id TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        result TEXT,
+        delivered INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (run_id, file_index),
+        FOREIGN KEY (run_id) REFERENCES pipeline_runs (id)
+    ) WITHOUT ROWID''')
+
+    # Кэш резюме Claude: повторный запуск платит только за файлы с измененным содержимым
+    c.execute('''CREATE TABLE IF NOT EXISTS summary_cache
+    (
+        content_hash TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        input_tokens INTEGER DEFAULT 0,
+        output_tokens INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (content_hash, model, prompt_version)
+    ) WITHOUT ROWID''')
+
+    # Каналы push-уведомлений Drive (changes.watch) - переживают перезапуск до истечения
+    c.execute('''CREATE TABLE IF NOT EXISTS watch_channels
+    (
+        id TEXT PRIMARY KEY,
+        resource_id TEXT,
+        token TEXT NOT NULL,
+        address TEXT NOT NULL,
+        expiration REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'active',
+        messages INTEGER DEFAULT 0,
+        last_message_at REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_watch_channels_status ON watch_channels (status, expiration)")
+
     # Создать дефолтного пользователя
     c.execute("INSERT OR IGNORE INTO users (id, username) VALUES (1, 'default')")
 
@@ -149,12 +265,72 @@ def init_db():
     print("[DB] ✅ Database initialized")
 
 
-def save_message(session_id, role, content, tool_calls=None):
-    """Сохранить сообщение"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+def _init_drive_mirror(c):
+    """Локальное зеркало метаданных Drive: файлы, связи с родителями и полнотекстовый индекс имен"""
+    c.execute('''CREATE TABLE IF NOT EXISTS drive_files
+    (
+        id TEXT NOT NULL UNIQUE,
+        name TEXT,
+        mime_type TEXT,
+        size INTEGER,
+        modified_time TEXT,
+        created_time TEXT,
+        md5 TEXT
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_drive_files_modified ON drive_files (modified_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_drive_files_mime ON drive_files (mime_type, modified_time)")
+    c.execute('''CREATE TABLE IF NOT EXISTS drive_file_parents
+    (
+        parent_id TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        PRIMARY KEY (parent_id, file_id)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_drive_file_parents_file ON drive_file_parents (file_id)")
+
+    # trigram дает поиск по подстроке; без него - обычный fts5, без fts5 - LIKE
+    for tokenize in ("trigram", "unicode61"):
+        try:
+            c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS drive_files_fts
+                         USING fts5(name, content='drive_files', tokenize='{tokenize}')''')
+            break
+        except sqlite3.OperationalError:
+            continue
+    else:
+        return
 
-    # Получить или создать conversation
+    c.execute('''CREATE TRIGGER IF NOT EXISTS drive_files_ai AFTER INSERT ON drive_files BEGIN
+        INSERT INTO drive_files_fts (rowid, name) VALUES (new.rowid, new.name);
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS drive_files_ad AFTER DELETE ON drive_files BEGIN
+        INSERT INTO drive_files_fts (drive_files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS drive_files_au AFTER UPDATE OF name ON drive_files BEGIN
+        INSERT INTO drive_files_fts (drive_files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+        INSERT INTO drive_files_fts (rowid, name) VALUES (new.rowid, new.name);
+    END''')
+
+
+def get_connection():
+    """Соединение с БД; схема создается при первом обращении, а не при импорте"""
+    global _initialized
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_db()
+                _initialized = True
+    return sqlite3.connect(DB_PATH)
+
+
+def _pack(obj):
+    """Компактная сериализация JSON + zlib"""
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def _get_or_create_conversation(c, session_id):
     c.execute("SELECT id FROM conversations WHERE session_id = ?", (session_id,))
     result = c.fetchone()
 
@@ -163,15 +339,25 @@ def save_message(session_id, role, content, tool_calls=None):
             "INSERT INTO conversations (user_id, session_id) VALUES (1, ?)",
             (session_id,)
         )
-        conv_id = c.lastrowid
-    else:
-        conv_id = result[0]
+        return c.lastrowid
+    return result[0]
+
+
+@timed_db
+def save_message(session_id, role, content, tool_calls=None):
+    """Сохранить сообщение, вернуть его id"""
+    conn = get_connection()
+    c = conn.cursor()
+
+    # Получить или создать conversation
+    conv_id = _get_or_create_conversation(c, session_id)
 
     # Сохранить сообщение
     c.execute(
         "INSERT INTO messages (conversation_id, role, content, tool_calls) VALUES (?, ?, ?, ?)",
         (conv_id, role, content, json.dumps(tool_calls) if tool_calls else None)
     )
+    message_id = c.lastrowid
 
     # Обновить updated_at
     c.execute(
@@ -181,35 +367,78 @@ def save_message(session_id, role, content, tool_calls=None):
 
     conn.commit()
     conn.close()
+    return message_id
 
 
-def get_conversation_history(session_id):
-    """Получить историю диалога"""
-    conn = sqlite3.connect(DB_PATH)
+@timed_db
+def save_tool_exchange(session_id, message_id, seq, assistant_content, tool_results):
+    """Сохранить один раунд tool_use/tool_result, относящийся к сообщению пользователя message_id"""
+    conn = get_connection()
+    c = conn.cursor()
+    conv_id = _get_or_create_conversation(c, session_id)
+    c.execute(
+        """INSERT INTO tool_exchanges (conversation_id, message_id, seq, assistant_content, tool_results)
+           VALUES (?, ?, ?, ?, ?)""",
+        (conv_id, message_id, seq, _pack(assistant_content), _pack(tool_results))
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def get_conversation_history(session_id, for_api=False):
+    """Получить историю диалога.
+
+    for_api=True - история в формате Claude API: только role/content, с воспроизведением
+    сохраненных tool_use/tool_result блоков после соответствующих сообщений пользователя.
+    """
+    conn = get_connection()
     c = conn.cursor()
 
     c.execute("""
-              SELECT m.role, m.content, m.tool_calls
+              SELECT m.id, m.role, m.content, m.tool_calls
               FROM messages m
                        JOIN conversations c ON m.conversation_id = c.id
               WHERE c.session_id = ?
-              ORDER BY m.created_at
+              ORDER BY m.created_at, m.id
               """, (session_id,))
+    rows = c.fetchall()
+
+    exchanges = {}
+    if for_api:
+        c.execute("""
+                  SELECT t.message_id, t.assistant_content, t.tool_results
+                  FROM tool_exchanges t
+                           JOIN conversations c ON t.conversation_id = c.id
+                  WHERE c.session_id = ?
+                  ORDER BY t.message_id, t.seq
+                  """, (session_id,))
+        for message_id, assistant_content, tool_results in c.fetchall():
+            exchanges.setdefault(message_id, []).append((_unpack(assistant_content), _unpack(tool_results)))
+
+    conn.close()
 
     messages = []
-    for role, content, tool_calls in c.fetchall():
+    for message_id, role, content, tool_calls in rows:
+        if for_api:
+            if content:
+                messages.append({"role": role, "content": content})
+            for assistant_content, tool_results in exchanges.get(message_id, []):
+                messages.append({"role": "assistant", "content": assistant_content})
+                messages.append({"role": "user", "content": tool_results})
+            continue
         msg = {"role": role, "content": content}
         if tool_calls:
             msg["tool_calls"] = json.loads(tool_calls)
         messages.append(msg)
 
-    conn.close()
     return messages
 
 
+@timed_db
 def get_all_conversations(user_id=1):
     """Получить все диалоги пользователя"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
 
     c.execute("""
@@ -239,9 +468,10 @@ def get_all_conversations(user_id=1):
     return conversations
 
 
+@timed_db
 def update_conversation_title(session_id, title):
     """Обновить заголовок диалога"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute(
         "UPDATE conversations SET title = ? WHERE session_id = ?",
@@ -251,18 +481,24 @@ def update_conversation_title(session_id, title):
     conn.close()
 
 
+@timed_db
 def delete_conversation(session_id):
     """Удалить диалог"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
+    c.execute(
+        "DELETE FROM tool_exchanges WHERE conversation_id IN (SELECT id FROM conversations WHERE session_id = ?)",
+        (session_id,)
+    )
     c.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
     conn.commit()
     conn.close()
 
 
+@timed_db
 def get_setting(user_id, key, default=None):
     """Получить настройку"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute("SELECT value FROM settings WHERE user_id = ? AND key = ?", (user_id, key))
     result = c.fetchone()
@@ -270,9 +506,10 @@ def get_setting(user_id, key, default=None):
     return result[0] if result else default
 
 
+@timed_db
 def set_setting(user_id, key, value):
     """Установить настройку"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute(
         "INSERT OR REPLACE INTO settings (user_id, key, value) VALUES (?, ?, ?)",
@@ -282,5 +519,446 @@ def set_setting(user_id, key, value):
     conn.close()
 
 
-# Инициализация при импорте
-init_db()
+JOB_JSON_FIELDS = ('params', 'progress', 'result')
+JOB_TERMINAL_STATUSES = ('succeeded', 'failed', 'cancelled', 'interrupted')
+
+
+def _job_from_row(row):
+    job = dict(row)
+    for field in JOB_JSON_FIELDS:
+        if job.get(field):
+            job[field] = json.loads(job[field])
+    job["cancel_requested"] = bool(job.get("cancel_requested"))
+    return job
+
+
+@timed_db
+def create_job(job_id, kind, params):
+    """Создать фоновую задачу в статусе queued"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO jobs (id, kind, params) VALUES (?, ?, ?)",
+        (job_id, kind, json.dumps(params, ensure_ascii=False))
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def update_job(job_id, **fields):
+    """Обновить поля задачи (status, progress, result, error, started_at, finished_at)"""
+    if not fields:
+        return
+    assignments = []
+    values = []
+    for key, value in fields.items():
+        if key in JOB_JSON_FIELDS and value is not None:
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        assignments.append(f"{key} = ?")
+        values.append(value)
+    assignments.append("updated_at = CURRENT_TIMESTAMP")
+    values.append(job_id)
+
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"UPDATE jobs SET {', '.join(assignments)} WHERE id = ?", values)
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def get_job(job_id):
+    """Получить задачу по id"""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    row = c.fetchone()
+    conn.close()
+    return _job_from_row(row) if row else None
+
+
+@timed_db
+def list_jobs(limit=50):
+    """Последние задачи (без результатов)"""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("""
+              SELECT id, kind, params, status, progress, error, cancel_requested,
+                     created_at, started_at, finished_at, updated_at
+              FROM jobs
+              ORDER BY created_at DESC LIMIT ?
+              """, (limit,))
+    jobs = [_job_from_row(row) for row in c.fetchall()]
+    conn.close()
+    return jobs
+
+
+@timed_db
+def request_job_cancel(job_id):
+    """Пометить задачу на отмену. Возвращает False, если задача уже завершена или не найдена"""
+    conn = get_connection()
+    c = conn.cursor()
+    placeholders = ", ".join("?" for _ in JOB_TERMINAL_STATUSES)
+    c.execute(
+        f"""UPDATE jobs SET cancel_requested = 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status NOT IN ({placeholders})""",
+        (job_id, *JOB_TERMINAL_STATUSES)
+    )
+    updated = c.rowcount > 0
+    conn.commit()
+    conn.close()
+    return updated
+
+
+@timed_db
+def mark_interrupted_jobs():
+    """Задачи, оставшиеся queued/running после перезапуска процесса, помечаются interrupted"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+              UPDATE jobs
+              SET status = 'interrupted', finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+              WHERE status IN ('queued', 'running')
+              """)
+    count = c.rowcount
+    conn.commit()
+    conn.close()
+    return count
+
+
+
+
+SNAPSHOT_BATCH = 500
+
+
+def _snapshot_row(folder_id, f):
+    return (folder_id, f['id'], f.get('name'), f.get('type'), f.get('size_mb', 0),
+            f.get('modified'), f.get('created'), f.get('md5'), f.get('depth', 0))
+
+
+def _snapshot_entry(row):
+    return {"id": row[0], "name": row[1], "type": row[2], "size_mb": row[3],
+            "modified": row[4], "created": row[5], "md5": row[6], "depth": row[7]}
+
+
+SNAPSHOT_SELECT = """SELECT file_id, name, mime_type, size_mb, modified_time, created_time, md5, depth
+                     FROM drive_snapshot"""
+
+
+@timed_db
+def get_snapshot_files(folder_id, file_ids):
+    """Записи снимка только для указанных файлов: {file_id: entry}"""
+    file_ids = list(file_ids)
+    conn = get_connection()
+    c = conn.cursor()
+    entries = {}
+    for i in range(0, len(file_ids), SNAPSHOT_BATCH):
+        batch = file_ids[i:i + SNAPSHOT_BATCH]
+        placeholders = ", ".join("?" for _ in batch)
+        c.execute(f"{SNAPSHOT_SELECT} WHERE folder_id = ? AND file_id IN ({placeholders})", (folder_id, *batch))
+        for row in c.fetchall():
+            entries[row[0]] = _snapshot_entry(row)
+    conn.close()
+    return entries
+
+
+@timed_db
+def get_snapshot_stats(folder_id):
+    """(всего записей, из них папок)"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+              SELECT COUNT(*), COALESCE(SUM(mime_type LIKE '%folder%'), 0)
+              FROM drive_snapshot WHERE folder_id = ?
+              """, (folder_id,))
+    total, folders = c.fetchone()
+    conn.close()
+    return total, folders
+
+
+@timed_db
+def apply_snapshot_changes(folder_id, upserts, deleted_ids):
+    """Применить дельту Changes API к снимку"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany(
+        "INSERT OR REPLACE INTO drive_snapshot VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [_snapshot_row(folder_id, f) for f in upserts]
+    )
+    c.executemany(
+        "DELETE FROM drive_snapshot WHERE folder_id = ? AND file_id = ?",
+        [(folder_id, file_id) for file_id in deleted_ids]
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def replace_snapshot(folder_id, files):
+    """Baseline: снимок папки целиком заменяется текущим листингом"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM drive_snapshot WHERE folder_id = ?", (folder_id,))
+    c.executemany(
+        "INSERT OR REPLACE INTO drive_snapshot VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [_snapshot_row(folder_id, f) for f in files]
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def diff_snapshot(folder_id, files):
+    """Сравнить полный листинг с сохраненным снимком и заменить снимок.
+
+    Листинг загружается во временную таблицу, разница считается запросами по первичным ключам.
+    Возвращает (new_files, modified_files, deleted_files)"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+              CREATE TEMP TABLE listing
+              (
+                  folder_id TEXT, file_id TEXT PRIMARY KEY, name TEXT, mime_type TEXT, size_mb REAL,
+                  modified_time TEXT, created_time TEXT, md5 TEXT, depth INTEGER
+              )""")
+    c.executemany("INSERT OR REPLACE INTO listing VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                  [_snapshot_row(folder_id, f) for f in files])
+
+    columns = "l.file_id, l.name, l.mime_type, l.size_mb, l.modified_time, l.created_time, l.md5, l.depth"
+    c.execute(f"""
+              SELECT {columns} FROM listing l
+              LEFT JOIN drive_snapshot s ON s.folder_id = ? AND s.file_id = l.file_id
+              WHERE s.file_id IS NULL
+              """, (folder_id,))
+    new_files = [_snapshot_entry(row) for row in c.fetchall()]
+
+    c.execute(f"""
+              SELECT {columns} FROM listing l
+              JOIN drive_snapshot s ON s.folder_id = ? AND s.file_id = l.file_id
+              WHERE s.modified_time IS NOT l.modified_time OR s.md5 IS NOT l.md5
+              """, (folder_id,))
+    modified_files = [_snapshot_entry(row) for row in c.fetchall()]
+
+    c.execute(f"""
+              {SNAPSHOT_SELECT} s
+              WHERE s.folder_id = ? AND NOT EXISTS (SELECT 1 FROM listing l WHERE l.file_id = s.file_id)
+              """, (folder_id,))
+    deleted_files = [_snapshot_entry(row) for row in c.fetchall()]
+
+    c.execute("DELETE FROM drive_snapshot WHERE folder_id = ?", (folder_id,))
+    c.execute("INSERT INTO drive_snapshot SELECT * FROM listing")
+    c.execute("DROP TABLE listing")
+    conn.commit()
+    conn.close()
+    return new_files, modified_files, deleted_files
+
+
+@timed_db
+def get_cached_summary(content_hash, model, prompt_version):
+    """Сохраненное резюме или None"""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("""
+              SELECT summary, input_tokens, output_tokens FROM summary_cache
+              WHERE content_hash = ? AND model = ? AND prompt_version = ?
+              """, (content_hash, model, prompt_version))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+@timed_db
+def save_cached_summary(content_hash, model, prompt_version, summary, input_tokens=0, output_tokens=0):
+    """Сохранить резюме вместе с потраченными токенами (для подсчета экономии)"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """INSERT OR REPLACE INTO summary_cache
+           (content_hash, model, prompt_version, summary, input_tokens, output_tokens)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (content_hash, model, prompt_version, summary, input_tokens, output_tokens)
+    )
+    conn.commit()
+    conn.close()
+
+
+RUN_JSON_FIELDS = ('files', 'deliveries', 'result')
+
+
+def _run_from_row(row):
+    run = dict(row)
+    for field in RUN_JSON_FIELDS:
+        if run.get(field):
+            run[field] = json.loads(run[field])
+    return run
+
+
+@timed_db
+def create_pipeline_run(run_id, source_folder_id, query, files):
+    """Создать запуск pipeline со списком выбранных файлов (все в статусе pending)"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO pipeline_runs (id, source_folder_id, query, files, deliveries) VALUES (?, ?, ?, ?, '[]')",
+        (run_id, source_folder_id, query, json.dumps(files, ensure_ascii=False))
+    )
+    c.executemany(
+        "INSERT INTO pipeline_run_files (run_id, file_index, file_id) VALUES (?, ?, ?)",
+        [(run_id, index, f['id']) for index, f in enumerate(files)]
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def update_pipeline_run(run_id, **fields):
+    """Обновить поля запуска (status, deliveries, result, error)"""
+    if not fields:
+        return
+    assignments = []
+    values = []
+    for key, value in fields.items():
+        if key in RUN_JSON_FIELDS and value is not None:
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        assignments.append(f"{key} = ?")
+        values.append(value)
+    assignments.append("updated_at = CURRENT_TIMESTAMP")
+    values.append(run_id)
+
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"UPDATE pipeline_runs SET {', '.join(assignments)} WHERE id = ?", values)
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def save_pipeline_run_file(run_id, file_index, status, result):
+    """Чекпоинт файла: done (резюме готово) или error (будет повторен при возобновлении)"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """UPDATE pipeline_run_files SET status = ?, result = ?, updated_at = CURRENT_TIMESTAMP
+           WHERE run_id = ? AND file_index = ?""",
+        (status, json.dumps(result, ensure_ascii=False, default=str), run_id, file_index)
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def mark_pipeline_run_files_delivered(run_id, file_indexes):
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany(
+        "UPDATE pipeline_run_files SET delivered = 1 WHERE run_id = ? AND file_index = ?",
+        [(run_id, index) for index in file_indexes]
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def get_pipeline_run(run_id):
+    """Запуск pipeline вместе с состоянием файлов (file_states по file_index)"""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("SELECT * FROM pipeline_runs WHERE id = ?", (run_id,))
+    row = c.fetchone()
+    if not row:
+        conn.close()
+        return None
+    run = _run_from_row(row)
+    c.execute("""
+              SELECT file_index, file_id, status, result, delivered
+              FROM pipeline_run_files WHERE run_id = ? ORDER BY file_index
+              """, (run_id,))
+    run["file_states"] = [
+        {**dict(r), "result": json.loads(r["result"]) if r["result"] else None, "delivered": bool(r["delivered"])}
+        for r in c.fetchall()
+    ]
+    conn.close()
+    return run
+
+
+@timed_db
+def list_pipeline_runs(limit=20):
+    """Последние запуски pipeline (без результатов)"""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("""
+              SELECT r.id, r.source_folder_id, r.query, r.status, r.error, r.created_at, r.updated_at,
+                     COUNT(f.file_index) AS files_total,
+                     COALESCE(SUM(f.status = 'done'), 0) AS files_done,
+                     COALESCE(SUM(f.delivered), 0) AS files_delivered
+              FROM pipeline_runs r
+              LEFT JOIN pipeline_run_files f ON f.run_id = r.id
+              GROUP BY r.id
+              ORDER BY r.created_at DESC LIMIT ?
+              """, (limit,))
+    runs = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return runs
+
+
+WATCH_COLUMNS = "id, resource_id, token, address, expiration, status, messages, last_message_at"
+
+
+@timed_db
+def save_watch_channel(channel_id, resource_id, token, address, expiration):
+    """Новый канал changes.watch; expiration - unix-время в секундах"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO watch_channels (id, resource_id, token, address, expiration) VALUES (?, ?, ?, ?, ?)",
+        (channel_id, resource_id, token, address, expiration)
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed_db
+def get_watch_channel(channel_id):
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(f"SELECT {WATCH_COLUMNS} FROM watch_channels WHERE id = ?", (channel_id,))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+@timed_db
+def get_active_watch_channel(now):
+    """Действующий канал с самым поздним сроком или None"""
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(f"""
+              SELECT {WATCH_COLUMNS} FROM watch_channels
+              WHERE status = 'active' AND expiration > ?
+              ORDER BY expiration DESC LIMIT 1
+              """, (now,))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+@timed_db
+def update_watch_channel(channel_id, status=None, message_at=None):
+    """Сменить статус канала и/или учесть полученное уведомление"""
+    conn = get_connection()
+    c = conn.cursor()
+    if status:
+        c.execute("UPDATE watch_channels SET status = ? WHERE id = ?", (status, channel_id))
+    if message_at:
+        c.execute("UPDATE watch_channels SET messages = messages + 1, last_message_at = ? WHERE id = ?",
+                  (message_at, channel_id))
+    conn.commit()
+    conn.close()
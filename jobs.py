@@ -0,0 +1,218 @@
+"""Background Jobs - фоновое выполнение долгих workflow и pipeline"""
+import os
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database import (
+    create_job,
+    update_job,
+    get_job,
+    list_jobs,
+    request_job_cancel,
+    mark_interrupted_jobs,
+    JOB_TERMINAL_STATUSES
+)
+from mcp_tools.registry import _is_error
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Передается в обработчик задачи: прогресс и проверка отмены"""
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+
+    def progress(self, message, current=None, total=None):
+        update_job(self.job_id, progress={
+            "message": message,
+            "current": current,
+            "total": total,
+            "at": datetime.now().isoformat()
+        })
+
+    def is_cancelled(self):
+        return self.manager.is_cancel_requested(self.job_id)
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled()
+
+
+class JobManager:
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or int(os.getenv("JOB_WORKERS", "2"))
+        self.max_pending = max_pending or int(os.getenv("JOB_MAX_PENDING", "20"))
+        self.runners = {}
+        self._executor = None
+        self._futures = {}
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+
+    def register_runner(self, kind, func):
+        """Регистрация обработчика: func(params, job_context) -> result;
+        исключение или результат {"error": ...} завершают задачу статусом failed"""
+        self.runners[kind] = func
+
+    def recover(self):
+        """Вызывается при старте: незавершенные задачи прошлого процесса -> interrupted"""
+        count = mark_interrupted_jobs()
+        if count:
+            print(f"[Jobs] ⚠️  Marked {count} unfinished job(s) as interrupted")
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        return self._executor
+
+    def submit(self, kind, params):
+        """Поставить задачу в очередь, вернуть job_id"""
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        with self._lock:
+            pending = sum(1 for f in self._futures.values() if not f.done())
+            if pending >= self.max_pending:
+                raise RuntimeError(f"Too many pending jobs ({pending})")
+
+            job_id = f"job_{uuid.uuid4().hex[:12]}"
+            create_job(job_id, kind, params)
+            self._cancel_events[job_id] = threading.Event()
+            self._futures[job_id] = self._get_executor().submit(self._run, job_id, kind, params)
+
+        print(f"[Jobs] 📥 Queued {kind} job {job_id}")
+        return job_id
+
+    def is_cancel_requested(self, job_id):
+        event = self._cancel_events.get(job_id)
+        return event is not None and event.is_set()
+
+    def cancel(self, job_id):
+        """Отменить задачу: из очереди - сразу, выполняющуюся - кооперативно"""
+        if not request_job_cancel(job_id):
+            return False
+
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+            future = self._futures.get(job_id)
+        if event:
+            event.set()
+        if future and future.cancel():
+            self._finish(job_id, status='cancelled')
+        print(f"[Jobs] 🛑 Cancel requested for {job_id}")
+        return True
+
+    def get(self, job_id):
+        return get_job(job_id)
+
+    def list(self, limit=50):
+        return list_jobs(limit)
+
+    def _finish(self, job_id, **fields):
+        update_job(job_id, finished_at=datetime.now().isoformat(), **fields)
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._cancel_events.pop(job_id, None)
+
+    def _run(self, job_id, kind, params):
+        context = JobContext(self, job_id)
+        if context.is_cancelled():
+            self._finish(job_id, status='cancelled')
+            return
+
+        update_job(job_id, status='running', started_at=datetime.now().isoformat())
+        print(f"[Jobs] ▶️  Running {kind} job {job_id}")
+        try:
+            result = self.runners[kind](params, context)
+            if context.is_cancelled():
+                self._finish(job_id, status='cancelled', result=result)
+                print(f"[Jobs] 🛑 Job {job_id} cancelled")
+            elif _is_error(result):
+                # инструменты возвращают {"error": ...} вместо исключения
+                error = (result[0] if isinstance(result, list) else result)["error"]
+                print(f"[Jobs] ❌ Job {job_id} failed: {error}")
+                self._finish(job_id, status='failed', result=result, error=str(error))
+            else:
+                self._finish(job_id, status='succeeded', result=result)
+                print(f"[Jobs] ✅ Job {job_id} finished")
+        except JobCancelled:
+            self._finish(job_id, status='cancelled')
+            print(f"[Jobs] 🛑 Job {job_id} cancelled")
+        except Exception as e:
+            print(f"[Jobs] ❌ Job {job_id} failed: {e}")
+            self._finish(job_id, status='failed', error=str(e))
+
+
+def is_terminal(job):
+    return job is not None and job.get("status") in JOB_TERMINAL_STATUSES
+
+
+def register_job_tools(registry, manager):
+    """Инструменты для запуска долгого pipeline в фоне и опроса статуса"""
+
+    def submit_pipeline_job(source_folder_id, query="", max_files=5):
+        try:
+            job_id = manager.submit("pipeline", {
+                "source_folder_id": source_folder_id,
+                "query": query,
+                "max_files": max_files
+            })
+            return {"success": True, "job_id": job_id, "status": "queued"}
+        except Exception as e:
+            return {"error": str(e)}
+
+    def get_job_status(job_id):
+        job = manager.get(job_id)
+        if not job:
+            return {"error": f"Job '{job_id}' not found"}
+        return job
+
+    def cancel_job(job_id):
+        ok = manager.cancel(job_id)
+        return {"success": ok, "message": "Cancel requested" if ok else "Job not found or already finished"}
+
+    registry.register(
+        "submit_pipeline_job",
+        submit_pipeline_job,
+        "Start run_pipeline in the background and return a job_id immediately (use for long runs)",
+        {
+            "type": "object",
+            "properties": {
+                "source_folder_id": {"type": "string", "description": "Source folder ID to search files"},
+                "query": {"type": "string", "description": "Search query (optional)"},
+                "max_files": {"type": "integer", "default": 5, "description": "Max files to process"}
+            },
+            "required": ["source_folder_id"]
+        }
+    )
+    registry.register(
+        "get_job_status",
+        get_job_status,
+        "Get status, progress and result of a background job",
+        {
+            "type": "object",
+            "properties": {"job_id": {"type": "string", "description": "Job ID"}},
+            "required": ["job_id"]
+        }
+    )
+    registry.register(
+        "cancel_job",
+        cancel_job,
+        "Cancel a queued or running background job",
+        {
+            "type": "object",
+            "properties": {"job_id": {"type": "string", "description": "Job ID"}},
+            "required": ["job_id"]
+        }
+    )
+
+    print("[Jobs] ✅ Registered 3 tools")
+
+
+# Глобальный экземпляр
+job_manager = JobManager()
@@ -0,0 +1,126 @@
+"""Circuit Breaker - быстрый отказ при деградации внешних сервисов (Drive, Telegram, HTTP)"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, breaker):
+        self.breaker = breaker
+        super().__init__(f"{breaker.name} unavailable (circuit open), retry in {breaker.retry_after():.0f}s")
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+        self.reset_timeout = reset_timeout or float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.rejected = 0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        if self.state != OPEN:
+            return 0
+        return max(0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def rejecting(self, count=False):
+        """Проверка без захвата пробного вызова: True, если вызов сейчас будет отклонен.
+        count=True - учесть отказ в rejected"""
+        rejecting = self.state == OPEN and self.retry_after() > 0
+        if rejecting and count:
+            with self._lock:
+                self.rejected += 1
+        return rejecting
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._half_open_calls = 0
+                print(f"[Breaker] 🟡 {self.name}: half-open, probing")
+            if self.state == HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    self.rejected += 1
+                    return False
+                self._half_open_calls += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"[Breaker] 🟢 {self.name}: closed")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"[Breaker] 🔴 {self.name}: open after {self.failures} failure(s)")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def fast_fail_error(self):
+        """Структурированная ошибка для модели вместо ожидания таймаута (отказ уже учтен в allow/rejecting)"""
+        return {
+            "error": f"{self.name} is unavailable (circuit open)",
+            "error_type": "circuit_open",
+            "backend": self.name,
+            "retry_after": round(self.retry_after(), 1)
+        }
+
+    def status(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "retry_after": round(self.retry_after(), 1)
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def breakers_status():
+    return {name: breaker.status() for name, breaker in sorted(_breakers.items())}
+
+
+@contextmanager
+def guarded(name, is_failure=lambda e: True):
+    """with guarded("gdrive"): ... - отказ без вызова при открытом breaker, учет успеха/ошибки.
+    is_failure(e) решает, говорит ли исключение о деградации сервиса (а не об ошибке запроса)"""
+    breaker = get_breaker(name)
+    if not breaker.allow():
+        raise CircuitOpenError(breaker)
+    try:
+        yield breaker
+    except Exception as e:
+        if is_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
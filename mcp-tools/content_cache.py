@@ -0,0 +1,175 @@
+"""Content Cache - дисковый LRU-кэш содержимого файлов Drive по ревизии"""
+import os
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+
+from mcp_tools.drive_client import download_bytes, download_prefix
+from mcp_tools.metrics import content_cache_hits, content_cache_misses
+
+DEFAULT_DIR = os.path.join(".cache", "drive")
+
+
+def file_revision(file_info):
+    """Ревизия файла: md5Checksum для бинарных файлов, modifiedTime для Google Docs (у них нет md5)"""
+    return file_info.get('md5Checksum') or file_info.get('md5') or file_info.get('modifiedTime') or file_info.get('modified')
+
+
+def to_text(data, max_chars=None):
+    """Декодировать UTF-8; при max_chars читается только нужный префикс (не более 4 байт на символ)"""
+    if max_chars is None:
+        return bytes(data).decode('utf-8', errors='ignore')
+    if len(data) > max_chars * 4:
+        data = memoryview(data)[:max_chars * 4]
+    return bytes(data).decode('utf-8', errors='ignore')[:max_chars]
+
+
+class ContentCache:
+    """Записи - файлы в каталоге кэша, имя - sha256 от (file_id, revision, export_mime).
+    Новая ревизия файла дает новый ключ, старая вытесняется по LRU"""
+
+    def __init__(self, directory=None, max_bytes=None, mmap_threshold=None):
+        self.directory = directory or os.getenv("CONTENT_CACHE_DIR", DEFAULT_DIR)
+        self.max_bytes = max_bytes or int(os.getenv("CONTENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.mmap_threshold = mmap_threshold or int(os.getenv("CONTENT_CACHE_MMAP_BYTES", str(1024 * 1024)))
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        """Восстановить индекс с диска (порядок LRU - по времени последнего доступа)"""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+        self._loaded = True
+
+    def _key(self, file_id, revision, export_mime, partial=False):
+        # частичная запись (только начало файла) хранится под отдельным ключом и не выдается как полная
+        marker = "\0prefix" if partial else ""
+        return hashlib.sha256(f"{file_id}\0{revision}\0{export_mime or ''}{marker}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, file_id, revision, export_mime=None, partial=False):
+        """bytes для небольших записей, mmap (без копирования в память) для больших; None - промах"""
+        key = self._key(file_id, revision, export_mime, partial)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            size = self._entries.get(key)
+            if size is None:
+                return None
+            self._entries.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            os.utime(path)
+            with open(path, 'rb') as f:
+                if size >= self.mmap_threshold:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                return f.read()
+        except (OSError, ValueError):
+            # запись удалена извне или пустая для mmap
+            self._forget(key)
+            return None
+
+    def put(self, file_id, revision, data, export_mime=None, partial=False):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        key = self._key(file_id, revision, export_mime, partial)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self._total > self.max_bytes and self._entries:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def _forget(self, key):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total -= size
+
+    def fetch(self, service, file_id, revision=None, export_mime=None):
+        """Содержимое файла из кэша или из Drive (export_mime - для Google Docs/Sheets).
+        Без ревизии кэш не используется: нельзя проверить, что запись актуальна"""
+        if revision:
+            data = self.get(file_id, revision, export_mime)
+            if data is not None:
+                content_cache_hits.labels().inc()
+                return data
+            content_cache_misses.labels().inc()
+
+        if export_mime:
+            request = service.files().export(fileId=file_id, mimeType=export_mime)
+        else:
+            request = service.files().get_media(fileId=file_id)
+        data = download_bytes(request)
+
+        if revision:
+            try:
+                self.put(file_id, revision, data, export_mime)
+            except OSError as e:
+                print(f"[ContentCache] ⚠️  Cannot store {file_id}: {e}")
+        return data
+
+    def fetch_text(self, service, file_id, max_chars, revision=None, export_mime=None):
+        """Первые max_chars символов файла. Возвращает (text, truncated).
+
+        Полная запись кэша подходит всегда, частичная - если в ней хватает символов. При промахе
+        скачивается только префикс; он сохраняется как частичная запись (или полная, если файл
+        оказался меньше бюджета)"""
+        if revision:
+            for partial in (False, True):
+                data = self.get(file_id, revision, export_mime, partial)
+                if data is None:
+                    continue
+                text = to_text(data, max_chars + 1)
+                if not partial or len(text) > max_chars:
+                    content_cache_hits.labels().inc()
+                    return text[:max_chars], len(text) > max_chars
+            content_cache_misses.labels().inc()
+
+        if export_mime:
+            request = service.files().export(fileId=file_id, mimeType=export_mime)
+        else:
+            request = service.files().get_media(fileId=file_id)
+        data, complete = download_prefix(request, max_chars + 1)
+
+        if revision:
+            try:
+                self.put(file_id, revision, data, export_mime, partial=not complete)
+            except OSError as e:
+                print(f"[ContentCache] ⚠️  Cannot store {file_id}: {e}")
+        text = to_text(data, max_chars + 1)
+        return text[:max_chars], len(text) > max_chars
+
+    def status(self):
+        return {"entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+# Глобальный экземпляр
+content_cache = ContentCache()
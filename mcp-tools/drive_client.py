@@ -0,0 +1,380 @@
+"""Google Drive Client - общий доступ к Drive API для инструментов, pipeline и монитора"""
+import io
+import os
+import codecs
+import weakref
+import threading
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from mcp_tools.circuit_breaker import guarded
+
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive']
+
+
+def google_libraries_available():
+    """Проверка без импорта тяжелых модулей googleapiclient/google.oauth2"""
+    return (importlib.util.find_spec("googleapiclient") is not None
+            and importlib.util.find_spec("google.oauth2") is not None)
+
+
+class _Lease:
+    """Сервис, выданный потоку; живет в threading.local и освобождается вместе с потоком"""
+
+    def __init__(self, service):
+        self.service = service
+
+
+class LazyDriveService:
+    """Пул Drive-сервисов: клиент Google строится при первом обращении к API, а не при старте.
+
+    httplib2 не потокобезопасен, поэтому у каждого потока (Flask-запросы, планировщик, пулы
+    pipeline) свой AuthorizedHttp и свой объект сервиса. Потоки в основном короткие (запрос Flask,
+    пул на один вызов), поэтому после завершения потока его сервис возвращается в пул свободных
+    и достается следующему: транспортов столько, сколько потоков работало с Drive одновременно.
+    Учетные данные (и их токен) и discovery-документ Drive общие и загружаются один раз"""
+
+    def __init__(self, credentials_file='credentials.json', scopes=None, credentials=None,
+                 client_options=None, timeout=None, max_idle=None):
+        self.credentials_file = credentials_file
+        self.scopes = scopes or DRIVE_SCOPES
+        self.client_options = client_options
+        self.timeout = timeout or float(os.getenv("GDRIVE_HTTP_TIMEOUT", "60"))
+        # сколько свободных сервисов держать после пика параллельности
+        self.max_idle = max_idle or int(os.getenv("GDRIVE_MAX_IDLE_TRANSPORTS", "32"))
+        self._credentials = credentials
+        self._document = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._transports = 0
+        self._idle = []
+
+    def __bool__(self):
+        # "if not gdrive_service" в инструментах не должен строить клиент
+        return self._document is not None or self._credentials is not None or (
+            google_libraries_available() and os.path.exists(self.credentials_file)
+        )
+
+    @property
+    def built(self):
+        return self._document is not None
+
+    def _shared(self):
+        """Общие учетные данные и discovery-документ (один раз на процесс)"""
+        if self._document is None:
+            with self._lock:
+                if self._document is None:
+                    if self._credentials is None:
+                        from google.oauth2 import service_account
+                        self._credentials = service_account.Credentials.from_service_account_file(
+                            self.credentials_file,
+                            scopes=self.scopes
+                        )
+                    from googleapiclient.discovery_cache import get_static_doc
+                    document = get_static_doc('drive', 'v3')
+                    if document is None:
+                        from googleapiclient.discovery import build
+                        document = build('drive', 'v3', credentials=self._credentials)._rootDesc
+                    self._document = document
+                    print("[Google Drive] ✅ Initialized")
+        return self._credentials, self._document
+
+    def _build(self):
+        credentials, document = self._shared()
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+
+        http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=self.timeout))
+        service = build_from_document(document, http=http, client_options=self.client_options)
+        with self._lock:
+            self._transports += 1
+        return service
+
+    def get(self):
+        """Сервис текущего потока: свободный из пула или новый"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            with self._lock:
+                service = self._idle.pop() if self._idle else None
+            if service is None:
+                service = self._build()
+            lease = _Lease(service)
+            # threading.local очищается при завершении потока - сервис возвращается в пул
+            weakref.finalize(lease, self._release, service)
+            self._local.lease = lease
+        return lease.service
+
+    def _release(self, service):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(service)
+
+    def status(self):
+        return {"built": self.built, "transports": self._transports, "idle": len(self._idle)}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+def is_drive_failure(error):
+    """HttpError 4xx (кроме 429) - ошибка запроса, а не деградация Drive"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is not None:
+        status = int(status)
+        return status >= 500 or status == 429
+    return not isinstance(error, (ValueError, KeyError, TypeError))
+
+
+def drive_execute(request):
+    """request.execute() через circuit breaker "gdrive" """
+    with guarded("gdrive", is_drive_failure):
+        return request.execute()
+
+
+def download_prefix(request, max_chars, chunk_size=None):
+    """Скачать только начало файла: чанки (Range-запросы MediaIoBaseDownload) декодируются
+    инкрементальным UTF-8 декодером, загрузка прекращается, как только набрано max_chars символов.
+    Возвращает (bytes префикса, complete) - complete=True, если файл скачан целиком"""
+    from googleapiclient.http import MediaIoBaseDownload
+
+    # UTF-8: от 1 до 4 байт на символ; чанк порядка бюджета, чтобы обычно хватало одного запроса
+    chunk_size = chunk_size or min(max(max_chars * 2, 16 * 1024), 1024 * 1024)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    chunk_stream = io.BytesIO()
+    data = bytearray()
+    chars = 0
+    done = False
+    with guarded("gdrive", is_drive_failure):
+        downloader = MediaIoBaseDownload(chunk_stream, request, chunksize=chunk_size)
+        while not done:
+            status, done = downloader.next_chunk()
+            chunk = chunk_stream.getvalue()
+            chunk_stream.seek(0)
+            chunk_stream.truncate()
+            data += chunk
+            chars += len(decoder.decode(chunk, final=done))
+            if chars >= max_chars:
+                break
+    return bytes(data), done
+
+
+def download_bytes(request):
+    """Скачать media/export запрос целиком через circuit breaker "gdrive" """
+    from googleapiclient.http import MediaIoBaseDownload
+
+    file_stream = io.BytesIO()
+    with guarded("gdrive", is_drive_failure):
+        downloader = MediaIoBaseDownload(file_stream, request)
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+    return file_stream.getvalue()
+
+
+MAX_PAGE_SIZE = 1000
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+
+def escape_query(value):
+    """Экранирование строкового литерала для q-запроса Drive ('...')"""
+    return str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+
+def iter_files(service, q=None, fields="id, name, mimeType, size, modifiedTime", order_by=None,
+               limit=None, page_size=MAX_PAGE_SIZE, **params):
+    """Генератор по всем страницам files.list (nextPageToken) с остановкой на limit"""
+    page_token = None
+    yielded = 0
+    while True:
+        request_params = dict(
+            pageSize=min(page_size, limit - yielded) if limit else page_size,
+            fields=f"nextPageToken, files({fields})",
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+            **params
+        )
+        if q:
+            request_params['q'] = q
+        if order_by:
+            request_params['orderBy'] = order_by
+        if page_token:
+            request_params['pageToken'] = page_token
+
+        response = drive_execute(service.files().list(**request_params))
+        for f in response.get('files', []):
+            yield f
+            yielded += 1
+            if limit and yielded >= limit:
+                return
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+
+
+SHORTCUT_MIME = 'application/vnd.google-apps.shortcut'
+# Глубина рекурсивного обхода: 0 - только непосредственные дети папки
+DEFAULT_MAX_DEPTH = int(os.getenv("GDRIVE_MAX_DEPTH", "10"))
+WALK_WORKERS = int(os.getenv("GDRIVE_WALK_WORKERS", "4"))
+
+
+def walk_folder(service, folder_id, max_depth=DEFAULT_MAX_DEPTH, q=None,
+                fields="id, name, mimeType, size, modifiedTime", include_folders=True, exclude_ids=(),
+                workers=None, page_size=MAX_PAGE_SIZE):
+    """Рекурсивный обход папки в ширину: генератор файлов (dict Drive + "depth", у детей папки 0).
+
+    Страницы листинга нескольких папок запрашиваются параллельно (workers), результаты отдаются
+    по мере готовности, в памяти - только очередь папок и страницы в работе. Каждая папка
+    обходится один раз (папки с несколькими родителями, циклы), ярлыки не возвращаются и не
+    раскрываются. q - дополнительный фильтр файлов; на подпапки он не действует, иначе обход
+    не дошел бы до их содержимого. exclude_ids - файлы и папки, которые пропускаются вместе с содержимым"""
+    workers = max(1, workers or WALK_WORKERS)
+    if 'parents' not in fields:
+        fields = f"{fields}, parents"
+    visited = {folder_id, *exclude_ids}
+    repeated = set(exclude_ids)
+    queue = deque([(folder_id, 0, None)])
+    running = set()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-walk")
+
+    def list_page(parent_id, page_token):
+        query = f"'{escape_query(parent_id)}' in parents and trashed=false and mimeType != '{SHORTCUT_MIME}'"
+        if q:
+            query += f" and (mimeType = '{FOLDER_MIME}' or ({q}))"
+        params = dict(
+            q=query,
+            pageSize=page_size,
+            fields=f"nextPageToken, files({fields})",
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        )
+        if page_token:
+            params['pageToken'] = page_token
+        return drive_execute(service.files().list(**params))
+
+    try:
+        while queue or running:
+            while queue and len(running) < workers:
+                parent_id, depth, page_token = queue.popleft()
+                future = pool.submit(list_page, parent_id, page_token)
+                running.add(future)
+                future.task = (parent_id, depth)
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent_id, depth = future.task
+                response = future.result()
+                if response.get('nextPageToken'):
+                    # продолжение текущей папки - раньше папок следующего уровня
+                    queue.appendleft((parent_id, depth, response['nextPageToken']))
+                for f in response.get('files', []):
+                    if f.get('mimeType') == FOLDER_MIME:
+                        if f['id'] in visited:
+                            continue
+                        visited.add(f['id'])
+                        if max_depth is None or depth < max_depth:
+                            queue.append((f['id'], depth + 1, None))
+                        if not include_folders:
+                            continue
+                    elif len(f.get('parents', [])) > 1:
+                        # файл в нескольких папках дерева отдается один раз
+                        if f['id'] in repeated:
+                            continue
+                        repeated.add(f['id'])
+                    yield {**f, 'depth': depth}
+    finally:
+        for future in running:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def list_changes(service, page_token, file_fields):
+    """Все изменения Drive начиная с page_token. Возвращает (changes, new_start_page_token)"""
+    changes = []
+    while True:
+        response = drive_execute(service.changes().list(
+            pageToken=page_token,
+            pageSize=1000,
+            spaces='drive',
+            includeRemoved=True,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({file_fields}))"
+        ))
+        changes.extend(response.get('changes', []))
+        if response.get('newStartPageToken'):
+            return changes, response['newStartPageToken']
+        page_token = response.get('nextPageToken')
+
+
+def get_start_page_token(service):
+    response = drive_execute(service.changes().getStartPageToken(supportsAllDrives=True))
+    return response.get('startPageToken')
+
+
+# Поля файлов в changes.list - общие для зеркала и монитора, чтобы они читали одну дельту
+CHANGE_FIELDS = "id, name, mimeType, size, modifiedTime, createdTime, md5Checksum, parents, trashed"
+
+
+class ChangesFeed:
+    """Дельта changes.list, общая для потребителей одного тика (зеркало метаданных, монитор папки):
+    одинаковый токен читается один раз.
+
+    tokens - текущие токены потребителей. Потребитель без токена (первый запуск, сброс) начинает
+    с конца дельты действующего потребителя: токен взят до его полного листинга, поэтому изменения
+    не теряются, а повтор уже учтенных безопасен (changes.list отдает текущие метаданные файла).
+    Так токены сходятся, и со следующего тика дельта читается один раз на всех"""
+
+    def __init__(self, service, tokens=(), fields=CHANGE_FIELDS):
+        self.service = service
+        self.fields = fields
+        self.tokens = [token for token in tokens if token]
+        self._deltas = {}
+        self._start_token = None
+
+    def changes(self, page_token):
+        """(changes, new_start_page_token); ошибка чтения тоже запоминается - один запрос на токен"""
+        if page_token not in self._deltas:
+            try:
+                self._deltas[page_token] = list_changes(self.service, page_token, self.fields)
+            except Exception as e:
+                self._deltas[page_token] = e
+        delta = self._deltas[page_token]
+        if isinstance(delta, Exception):
+            raise delta
+        return delta
+
+    def start_token(self):
+        for token in self.tokens:
+            try:
+                return self.changes(token)[1]
+            except Exception:
+                continue
+        if self._start_token is None:
+            self._start_token = get_start_page_token(self.service)
+        return self._start_token
+
+
+BATCH_LIMIT = 100
+METADATA_FIELDS = "id, name, mimeType, size, md5Checksum, modifiedTime"
+
+
+def batch_get_metadata(service, file_ids, fields=METADATA_FIELDS):
+    """Метаданные многих файлов через BatchHttpRequest: один HTTP-запрос на каждые 100 id.
+    Возвращает {file_id: metadata}; для недоступных файлов - {"error": ...}"""
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = {"error": str(exception)} if exception else response
+
+    file_ids = list(dict.fromkeys(file_ids))
+    for i in range(0, len(file_ids), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=callback)
+        for file_id in file_ids[i:i + BATCH_LIMIT]:
+            batch.add(service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True),
+                      request_id=file_id)
+        drive_execute(batch)
+    return results
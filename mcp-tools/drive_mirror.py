@@ -0,0 +1,255 @@
+"""Drive Mirror - локальное зеркало метаданных Google Drive в SQLite для мгновенного поиска"""
+import os
+import time
+import threading
+
+from mcp_tools.drive_client import iter_files, ChangesFeed, CHANGE_FIELDS, FOLDER_MIME
+
+MIRROR_FIELDS = CHANGE_FIELDS
+TOKEN_KEY = "gdrive_mirror_token"
+SYNCED_AT_KEY = "gdrive_mirror_synced_at"
+INSERT_BATCH = 1000
+MAX_TREE_DEPTH = 1000
+
+SELECT_FILES = """SELECT f.id, f.name, f.mime_type, f.size, f.modified_time, f.created_time, f.md5
+                  FROM drive_files f"""
+
+
+def _row_to_file(row):
+    """Строка зеркала в формате ответа files.list, чтобы инструменты обрабатывали оба источника одинаково"""
+    f = {"id": row[0], "name": row[1], "mimeType": row[2], "modifiedTime": row[4], "createdTime": row[5]}
+    if row[3] is not None:
+        f["size"] = str(row[3])
+    if row[6]:
+        f["md5Checksum"] = row[6]
+    return f
+
+
+class DriveMirror:
+    def __init__(self, max_age=None):
+        # DRIVE_MIRROR_MAX_AGE=0 отключает зеркало: все запросы идут в живой API
+        self.max_age = max_age if max_age is not None else float(os.getenv("DRIVE_MIRROR_MAX_AGE", "300"))
+        # зеркало обновляется тиками монитора; при действующем push-канале опрос редкий, а тики
+        # идут по уведомлениям об изменениях - планировщик задает здесь интервал такого опроса
+        self.push_interval = 0
+        self._lock = threading.Lock()
+        self._fts = None
+
+    def _connect(self):
+        from database import get_connection
+        return get_connection()
+
+    def fts_mode(self):
+        """trigram, fts5 или like - в зависимости от того, что поддерживает SQLite"""
+        if self._fts is None:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'drive_files_fts'"
+                ).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                self._fts = "like"
+            else:
+                self._fts = "trigram" if "trigram" in row[0] else "fts5"
+        return self._fts
+
+    def synced_at(self):
+        from database import get_setting
+        value = get_setting(1, SYNCED_AT_KEY)
+        return float(value) if value else None
+
+    def age(self):
+        synced_at = self.synced_at()
+        return time.time() - synced_at if synced_at else None
+
+    def effective_max_age(self):
+        """max_age, а при push-канале - не меньше интервала опроса (с запасом на длительность тика)"""
+        if self.max_age <= 0:
+            return 0
+        return max(self.max_age, self.push_interval * 1.5)
+
+    def is_fresh(self):
+        if self.max_age <= 0:
+            return False
+        age = self.age()
+        return age is not None and age <= self.effective_max_age()
+
+    # --- синхронизация ---
+
+    def token(self):
+        from database import get_setting
+        return get_setting(1, TOKEN_KEY)
+
+    def refresh(self, service, feed=None):
+        """Полная загрузка при первом запуске, дальше - только дельта changes.list.
+        feed - ChangesFeed тика монитора, чтобы зеркало и монитор читали одну дельту"""
+        from database import set_setting
+
+        with self._lock:
+            token = self.token()
+            feed = feed or ChangesFeed(service, [token])
+            if not token:
+                token = feed.start_token()
+                count = self._full_sync(service)
+                print(f"[DriveMirror] 📸 Full sync: {count} files")
+            else:
+                try:
+                    changes, token = feed.changes(token)
+                except Exception as e:
+                    # следующий вызов сделает полную загрузку
+                    set_setting(1, TOKEN_KEY, '')
+                    print(f"[DriveMirror] ❌ changes.list failed, resetting: {e}")
+                    return 0
+                count = self.apply_changes(changes)
+                if count:
+                    print(f"[DriveMirror] 🔄 Applied {count} change(s)")
+            set_setting(1, TOKEN_KEY, token)
+            set_setting(1, SYNCED_AT_KEY, str(time.time()))
+            return count
+
+    def _full_sync(self, service):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM drive_files")
+            conn.execute("DELETE FROM drive_file_parents")
+            count = 0
+            batch = []
+            for f in iter_files(service, q="trashed=false", fields=MIRROR_FIELDS):
+                batch.append(f)
+                if len(batch) >= INSERT_BATCH:
+                    self._upsert(conn, batch)
+                    count += len(batch)
+                    batch = []
+            self._upsert(conn, batch)
+            count += len(batch)
+            conn.commit()
+            return count
+        finally:
+            conn.close()
+
+    def _upsert(self, conn, files):
+        if not files:
+            return
+        conn.executemany(
+            """INSERT INTO drive_files (id, name, mime_type, size, modified_time, created_time, md5)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (id) DO UPDATE SET
+                   name = excluded.name, mime_type = excluded.mime_type, size = excluded.size,
+                   modified_time = excluded.modified_time, created_time = excluded.created_time,
+                   md5 = excluded.md5""",
+            [(f['id'], f.get('name'), f.get('mimeType'), int(f['size']) if f.get('size') else None,
+              f.get('modifiedTime'), f.get('createdTime'), f.get('md5Checksum')) for f in files]
+        )
+        conn.executemany("DELETE FROM drive_file_parents WHERE file_id = ?", [(f['id'],) for f in files])
+        conn.executemany(
+            "INSERT OR IGNORE INTO drive_file_parents (parent_id, file_id) VALUES (?, ?)",
+            [(parent_id, f['id']) for f in files for parent_id in f.get('parents', [])]
+        )
+
+    def _delete(self, conn, file_ids):
+        conn.executemany("DELETE FROM drive_files WHERE id = ?", [(file_id,) for file_id in file_ids])
+        conn.executemany("DELETE FROM drive_file_parents WHERE file_id = ?", [(file_id,) for file_id in file_ids])
+
+    def apply_changes(self, changes):
+        """Применить элементы changes.list (removed/trashed удаляются, остальные обновляются)"""
+        upserts = []
+        deleted = []
+        for change in changes:
+            f = change.get('file')
+            if change.get('removed') or not f or f.get('trashed'):
+                deleted.append(change.get('fileId'))
+            else:
+                upserts.append(f)
+        conn = self._connect()
+        try:
+            self._upsert(conn, upserts)
+            self._delete(conn, deleted)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(changes)
+
+    # --- запросы ---
+
+    def _name_filter(self, query):
+        """SQL-условие и параметры для поиска по имени (аналог name contains)"""
+        mode = self.fts_mode()
+        if mode == "trigram" and len(query) >= 3:
+            phrase = '"' + query.replace('"', '""') + '"'
+            return "f.rowid IN (SELECT rowid FROM drive_files_fts WHERE drive_files_fts MATCH ?)", [phrase]
+        if mode == "fts5" and query.strip():
+            terms = " ".join('"' + term.replace('"', '""') + '"*' for term in query.split())
+            return "f.rowid IN (SELECT rowid FROM drive_files_fts WHERE drive_files_fts MATCH ?)", [terms]
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return "f.name LIKE ? ESCAPE '\\'", [f"%{escaped}%"]
+
+    def _select(self, where, order_by, limit):
+        sql = SELECT_FILES
+        values = []
+        if where:
+            sql += " WHERE " + " AND ".join(condition for condition, _ in where)
+            for _, params in where:
+                values.extend(params)
+        sql += f" ORDER BY {order_by}"
+        if limit:
+            sql += " LIMIT ?"
+            values.append(limit)
+
+        conn = self._connect()
+        try:
+            return [_row_to_file(row) for row in conn.execute(sql, values).fetchall()]
+        finally:
+            conn.close()
+
+    def search(self, query, limit=None):
+        return self._select([self._name_filter(query)], "f.modified_time DESC", limit)
+
+    def recent(self, limit=None):
+        return self._select([], "f.modified_time DESC", limit)
+
+    def folders(self, limit=None):
+        return self._select([("f.mime_type = ?", [FOLDER_MIME])], "f.modified_time DESC", limit)
+
+    def files_in_folder(self, folder_id, query="", file_types=None, limit=None, max_depth=0):
+        """Файлы папки и (при max_depth > 0) ее подпапок - рекурсивный CTE по drive_file_parents.
+        UNION и ограничение глубины защищают от циклов; max_depth=None - без ограничения"""
+        tree = """WITH RECURSIVE tree (id, depth) AS (
+                       SELECT ?, 0
+                       UNION
+                       SELECT c.file_id, tree.depth + 1 FROM tree
+                       JOIN drive_file_parents c ON c.parent_id = tree.id
+                       JOIN drive_files d ON d.id = c.file_id AND d.mime_type = ?
+                       WHERE tree.depth < ?
+                   )
+                   SELECT id FROM tree"""
+        where = [
+            (f"f.id IN (SELECT file_id FROM drive_file_parents WHERE parent_id IN ({tree}))",
+             [folder_id, FOLDER_MIME, MAX_TREE_DEPTH if max_depth is None else max_depth]),
+            ("f.mime_type != ?", [FOLDER_MIME])
+        ]
+        if query:
+            where.append(self._name_filter(query))
+        if file_types:
+            where.append((f"f.mime_type IN ({', '.join('?' for _ in file_types)})", list(file_types)))
+        return self._select(where, "f.created_time DESC", limit)
+
+    def status(self):
+        conn = self._connect()
+        try:
+            count = conn.execute("SELECT COUNT(*) FROM drive_files").fetchone()[0]
+        finally:
+            conn.close()
+        age = self.age()
+        return {
+            "files": count,
+            "search": self.fts_mode(),
+            "age_seconds": round(age, 1) if age is not None else None,
+            "max_age": self.effective_max_age(),
+            "fresh": self.is_fresh()
+        }
+
+
+# Глобальный экземпляр
+drive_mirror = DriveMirror()
@@ -0,0 +1,122 @@
+"""Drive Watch - push-уведомления Drive (changes.watch) вместо частого опроса"""
+import os
+import time
+import uuid
+import secrets
+import threading
+
+from mcp_tools.drive_client import drive_execute, get_start_page_token
+
+
+class DriveWatchManager:
+    """Канал changes.watch на весь Drive: Google присылает POST на webhook при любом изменении,
+    монитор запускается внеочередно и читает дельту обычным changes.list.
+
+    Канал продлевается заранее (новый канал, затем stop старого). Без GDRIVE_WEBHOOK_URL или
+    при ошибке создания канала монитор работает опросом с обычным интервалом"""
+
+    def __init__(self, address=None, ttl=None, renew_before=None, fallback_interval=None):
+        # публичный https-адрес /api/drive/webhook; Drive не шлет уведомления на http и localhost
+        self.address = address if address is not None else os.getenv("GDRIVE_WEBHOOK_URL", "")
+        self.ttl = ttl or int(os.getenv("GDRIVE_WATCH_TTL", str(24 * 3600)))
+        self.renew_before = renew_before or int(os.getenv("GDRIVE_WATCH_RENEW_BEFORE", "3600"))
+        # интервал опроса при действующем канале - страховка на случай потерянных уведомлений
+        self.fallback_interval = fallback_interval or int(os.getenv("GDRIVE_WATCH_FALLBACK_INTERVAL", "600"))
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.address)
+
+    def active_channel(self):
+        from database import get_active_watch_channel
+        return get_active_watch_channel(time.time())
+
+    def is_active(self):
+        return self.enabled and self.active_channel() is not None
+
+    def ensure_channel(self, service):
+        """Создать канал, если его нет или он скоро истекает. Возвращает действующий канал или None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            channel = self.active_channel()
+            if channel and channel["expiration"] - time.time() > self.renew_before:
+                return channel
+            try:
+                new_channel = self._watch(service)
+            except Exception as e:
+                print(f"[DriveWatch] ❌ changes.watch failed, polling fallback: {e}")
+                return channel
+            if channel:
+                self.stop(service, channel)
+            return new_channel
+
+    def _watch(self, service):
+        from database import save_watch_channel
+
+        channel_id = f"drive-watch-{uuid.uuid4().hex}"
+        token = secrets.token_urlsafe(24)
+        response = drive_execute(service.changes().watch(
+            pageToken=get_start_page_token(service),
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+            body={
+                "id": channel_id,
+                "type": "web_hook",
+                "address": self.address,
+                "token": token,
+                "expiration": int((time.time() + self.ttl) * 1000)
+            }
+        ))
+        # Drive может сократить срок канала - сохраняется фактический
+        expiration = int(response.get("expiration") or (time.time() + self.ttl) * 1000) / 1000
+        save_watch_channel(channel_id, response.get("resourceId"), token, self.address, expiration)
+        print(f"[DriveWatch] ✅ Channel {channel_id} active for {(expiration - time.time()) / 3600:.1f} h")
+        return self.active_channel()
+
+    def stop(self, service, channel):
+        from database import update_watch_channel
+
+        update_watch_channel(channel["id"], status="stopped")
+        try:
+            drive_execute(service.channels().stop(body={"id": channel["id"], "resourceId": channel["resource_id"]}))
+            print(f"[DriveWatch] 🛑 Channel {channel['id']} stopped")
+        except Exception as e:
+            # канал все равно истечет сам; уведомления от него отклоняются по статусу
+            print(f"[DriveWatch] ⚠️  channels.stop failed for {channel['id']}: {e}")
+
+    def handle_notification(self, headers):
+        """Разобрать уведомление Drive по заголовкам X-Goog-*. Возвращает (http_status, result);
+        result["trigger"] = True - нужно внеочередно запустить монитор"""
+        from database import get_watch_channel, update_watch_channel
+
+        channel_id = headers.get("X-Goog-Channel-ID")
+        state = headers.get("X-Goog-Resource-State")
+        channel = get_watch_channel(channel_id) if channel_id else None
+        if channel is None or not secrets.compare_digest(channel["token"], headers.get("X-Goog-Channel-Token") or ""):
+            return 403, {"error": "Unknown channel"}
+        if channel["status"] != "active" or channel["expiration"] < time.time():
+            # поздние уведомления остановленного канала - 200, чтобы Drive не повторял их
+            return 200, {"ignored": "inactive channel", "trigger": False}
+
+        update_watch_channel(channel_id, message_at=time.time())
+        if state == "sync":
+            # первое уведомление после создания канала, изменений в нем нет
+            return 200, {"state": state, "trigger": False}
+        return 200, {"state": state, "message": headers.get("X-Goog-Message-Number"), "trigger": True}
+
+    def status(self):
+        channel = self.active_channel() if self.enabled else None
+        return {
+            "enabled": self.enabled,
+            "active": channel is not None,
+            "channel_id": channel["id"] if channel else None,
+            "expires_in": round(channel["expiration"] - time.time()) if channel else None,
+            "messages": channel["messages"] if channel else 0,
+            "fallback_interval": self.fallback_interval
+        }
+
+
+# Глобальный экземпляр
+drive_watch = DriveWatchManager()
@@ -0,0 +1,202 @@
+"""Extractors - извлечение текста из файлов Drive по формату (текст, OOXML, PDF, экспорт Google Apps).
+Извлечение потоковое: XML читается из zip через iterparse, PDF - по странице, до исчерпания бюджета символов"""
+import io
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+from mcp_tools.content_cache import content_cache, file_revision
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PPTX_MIME = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+PDF_MIME = 'application/pdf'
+
+# Google Docs/Sheets/Slides не скачиваются напрямую, только через files.export.
+# Таблицы - в xlsx: экспорт text/csv отдает только первый лист
+GOOGLE_EXPORTS = {
+    'application/vnd.google-apps.document': 'text/plain',
+    'application/vnd.google-apps.spreadsheet': XLSX_MIME,
+    'application/vnd.google-apps.presentation': 'text/plain',
+}
+
+TEXT_MIMES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/x-python',
+    'application/sql', 'application/x-sh', 'application/x-yaml', 'application/csv'
+}
+
+BINARY_FORMATS = {DOCX_MIME: 'docx', XLSX_MIME: 'xlsx', PPTX_MIME: 'pptx', PDF_MIME: 'pdf'}
+
+# Бинарные форматы скачиваются целиком (zip/PDF нельзя читать с начала), поэтому размер ограничен
+EXTRACT_MAX_BYTES = int(os.getenv("EXTRACT_MAX_BYTES", str(20 * 1024 * 1024)))
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+S_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+A_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+
+class UnsupportedFormat(ValueError):
+    def __init__(self, mime_type, reason=None):
+        self.mime_type = mime_type
+        super().__init__(reason or f"Cannot read files of type: {mime_type}")
+
+
+def format_for(mime_type):
+    """Способ чтения: ('export', export_mime), ('text', None), (docx/xlsx/pptx/pdf, None) или None"""
+    if mime_type in GOOGLE_EXPORTS:
+        return 'export', GOOGLE_EXPORTS[mime_type]
+    if mime_type in BINARY_FORMATS:
+        return BINARY_FORMATS[mime_type], None
+    if mime_type.startswith('text/') or mime_type in TEXT_MIMES:
+        return 'text', None
+    return None
+
+
+# --- OOXML ---
+
+def _iter_xml(archive, name, tags):
+    """Элементы с тегами tags из XML-файла архива. Обработанный элемент удаляется из родителя
+    (clear() оставил бы пустые элементы в дереве), поэтому в памяти только текущая ветка"""
+    with archive.open(name) as stream:
+        parents = []
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag in tags:
+                yield elem
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+
+
+def _numbered(archive, pattern):
+    """Файлы частей (slide1.xml, sheet2.xml, ...) в порядке номеров"""
+    regex = re.compile(pattern)
+    found = [(int(m.group(1)), name) for name in archive.namelist() for m in [regex.match(name)] if m]
+    return [name for _, name in sorted(found)]
+
+
+def iter_docx(archive):
+    paragraph = []
+    for elem in _iter_xml(archive, 'word/document.xml', {W_NS + 't', W_NS + 'tab', W_NS + 'p'}):
+        if elem.tag == W_NS + 't':
+            paragraph.append(elem.text or '')
+        elif elem.tag == W_NS + 'tab':
+            paragraph.append('\t')
+        else:
+            yield ''.join(paragraph) + '\n'
+            paragraph = []
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    for si in _iter_xml(archive, 'xl/sharedStrings.xml', {S_NS + 'si'}):
+        strings.append(''.join(t.text or '' for t in si.iter(S_NS + 't')))
+    return strings
+
+
+def _sheet_names(archive):
+    try:
+        with archive.open('xl/workbook.xml') as stream:
+            return [elem.get('name') for _, elem in ET.iterparse(stream) if elem.tag == S_NS + 'sheet']
+    except KeyError:
+        return []
+
+
+def iter_xlsx(archive):
+    strings = _shared_strings(archive)
+    names = _sheet_names(archive)
+    for number, sheet in enumerate(_numbered(archive, r'xl/worksheets/sheet(\d+)\.xml$')):
+        yield f"# {names[number] if number < len(names) else sheet}\n"
+        for row in _iter_xml(archive, sheet, {S_NS + 'row'}):
+            cells = []
+            for cell in row.iter(S_NS + 'c'):
+                kind = cell.get('t')
+                if kind == 'inlineStr':
+                    cells.append(''.join(t.text or '' for t in cell.iter(S_NS + 't')))
+                    continue
+                value = cell.find(S_NS + 'v')
+                text = value.text if value is not None and value.text else ''
+                if kind == 's' and text.isdigit() and int(text) < len(strings):
+                    text = strings[int(text)]
+                cells.append(text)
+            if any(cells):
+                yield '\t'.join(cells) + '\n'
+
+
+def iter_pptx(archive):
+    for number, slide in enumerate(_numbered(archive, r'ppt/slides/slide(\d+)\.xml$'), 1):
+        yield f"# Слайд {number}\n"
+        for paragraph in _iter_xml(archive, slide, {A_NS + 'p'}):
+            text = ''.join(t.text or '' for t in paragraph.iter(A_NS + 't'))
+            if text:
+                yield text + '\n'
+
+
+# --- PDF ---
+
+def iter_pdf(source):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedFormat(PDF_MIME, "PDF support requires pypdf (pip install pypdf)")
+    reader = PdfReader(source)
+    for page in reader.pages:
+        yield (page.extract_text() or '') + '\n'
+
+
+ITERATORS = {'docx': iter_docx, 'xlsx': iter_xlsx, 'pptx': iter_pptx}
+
+
+def iter_text(data, kind):
+    """Куски текста файла формата kind; data - bytes или mmap из content_cache"""
+    source = data if hasattr(data, 'seek') else io.BytesIO(data)
+    if kind == 'pdf':
+        return iter_pdf(source)
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise UnsupportedFormat(kind, f"Corrupted {kind} file")
+    return ITERATORS[kind](archive)
+
+
+def extract_text(data, kind, max_chars=None):
+    """Текст из bytes файла с остановкой на max_chars. Возвращает (text, truncated)"""
+    parts = []
+    chars = 0
+    for piece in iter_text(data, kind):
+        parts.append(piece)
+        chars += len(piece)
+        if max_chars is not None and chars > max_chars:
+            return ''.join(parts)[:max_chars], True
+    return ''.join(parts), False
+
+
+def read_text(service, file_id, file_info, max_chars):
+    """Общая точка чтения для инструментов, pipeline и монитора. Возвращает (text, truncated);
+    UnsupportedFormat - если формат не читается"""
+    mime_type = file_info.get('mimeType', '')
+    route = format_for(mime_type)
+    if route is None:
+        raise UnsupportedFormat(mime_type)
+    kind, export_mime = route
+    revision = file_revision(file_info)
+
+    if kind == 'export' and export_mime in BINARY_FORMATS:
+        # бинарный экспорт (таблицы в xlsx) скачивается целиком; Drive ограничивает экспорт 10 MB
+        data = content_cache.fetch(service, file_id, revision, export_mime)
+        return extract_text(data, BINARY_FORMATS[export_mime], max_chars)
+    if kind in ('text', 'export'):
+        # текст и текстовый экспорт Google Apps скачиваются только до бюджета символов
+        return content_cache.fetch_text(service, file_id, max_chars, revision, export_mime)
+
+    size = int(file_info.get('size', 0) or 0)
+    if size > EXTRACT_MAX_BYTES:
+        raise UnsupportedFormat(mime_type, f"File too large to extract ({round(size / (1024 ** 2), 2)} MB)")
+    data = content_cache.fetch(service, file_id, revision)
+    return extract_text(data, kind, max_chars)
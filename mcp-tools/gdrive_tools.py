@@ -1,16 +1,30 @@
 """Google Drive MCP Tools"""
-import io
-from googleapiclient.http import MediaIoBaseDownload
+from mcp_tools.drive_client import drive_execute, iter_files, escape_query, FOLDER_MIME
+from mcp_tools.drive_mirror import drive_mirror
+from mcp_tools.extractors import read_text, UnsupportedFormat
 
 
 def register_gdrive_tools(registry, gdrive_service):
     """Регистрация всех Google Drive инструментов"""
 
+    def to_entries(results):
+        files = []
+        for f in results:
+            size_mb = int(f.get('size', 0)) / (1024 ** 2) if f.get('size') else 0
+            files.append({
+                "id": f.get('id'),
+                "name": f.get('name'),
+                "type": f.get('mimeType'),
+                "size_mb": round(size_mb, 2),
+                "modified": f.get('modifiedTime')
+            })
+        return files
+
     def get_drive_info():
         if not gdrive_service:
             return {"error": "Google Drive not initialized"}
         try:
-            about = gdrive_service.about().get(fields='storageQuota,user').execute()
+            about = drive_execute(gdrive_service.about().get(fields='storageQuota,user'))
             quota = about.get('storageQuota', {})
             user = about.get('user', {})
 
@@ -29,28 +43,22 @@ def register_gdrive_tools(registry, gdrive_service):
         except Exception as e:
             return {"error": str(e)}
 
-    def search_files(query):
+    def search_files(query, max_results=10):
         if not gdrive_service:
             return []
         try:
-            results = gdrive_service.files().list(
-                q=f"name contains '{query}' and trashed=false",
-                pageSize=10,
-                fields="files(id, name, mimeType, size, modifiedTime)",
-                orderBy="modifiedTime desc"
-            ).execute()
-
-            files = []
-            for f in results.get('files', []):
-                size_mb = int(f.get('size', 0)) / (1024 ** 2) if f.get('size') else 0
-                files.append({
-                    "id": f.get('id'),
-                    "name": f.get('name'),
-                    "type": f.get('mimeType'),
-                    "size_mb": round(size_mb, 2),
-                    "modified": f.get('modifiedTime')
-                })
-            return files
+            # свежее локальное зеркало отвечает за миллисекунды, иначе - живой API
+            if drive_mirror.is_fresh():
+                results = drive_mirror.search(query, max_results)
+            else:
+                results = iter_files(
+                    gdrive_service,
+                    q=f"name contains '{escape_query(query)}' and trashed=false",
+                    fields="id, name, mimeType, size, modifiedTime",
+                    order_by="modifiedTime desc",
+                    limit=max_results
+                )
+            return to_entries(results)
         except Exception as e:
             return [{"error": str(e)}]
 
@@ -58,39 +66,37 @@ def register_gdrive_tools(registry, gdrive_service):
         if not gdrive_service:
             return []
         try:
-            results = gdrive_service.files().list(
-                pageSize=limit,
-                fields="files(id, name, mimeType, size, modifiedTime)",
-                orderBy="modifiedTime desc"
-            ).execute()
-
-            files = []
-            for f in results.get('files', []):
-                size_mb = int(f.get('size', 0)) / (1024 ** 2) if f.get('size') else 0
-                files.append({
-                    "id": f.get('id'),
-                    "name": f.get('name'),
-                    "type": f.get('mimeType'),
-                    "size_mb": round(size_mb, 2),
-                    "modified": f.get('modifiedTime')
-                })
-            return files
+            if drive_mirror.is_fresh():
+                results = drive_mirror.recent(limit)
+            else:
+                results = iter_files(
+                    gdrive_service,
+                    q="trashed=false",
+                    fields="id, name, mimeType, size, modifiedTime",
+                    order_by="modifiedTime desc",
+                    limit=limit
+                )
+            return to_entries(results)
         except Exception as e:
             return [{"error": str(e)}]
 
-    def list_folders():
+    def list_folders(max_results=20):
         if not gdrive_service:
             return []
         try:
-            results = gdrive_service.files().list(
-                q="mimeType='application/vnd.google-apps.folder' and trashed=false",
-                pageSize=20,
-                fields="files(id, name, modifiedTime)",
-                orderBy="modifiedTime desc"
-            ).execute()
+            if drive_mirror.is_fresh():
+                results = drive_mirror.folders(max_results)
+            else:
+                results = iter_files(
+                    gdrive_service,
+                    q=f"mimeType='{FOLDER_MIME}' and trashed=false",
+                    fields="id, name",
+                    order_by="modifiedTime desc",
+                    limit=max_results
+                )
 
             folders = []
-            for f in results.get('files', []):
+            for f in results:
                 folders.append({
                     "id": f.get('id'),
                     "name": f.get('name')
@@ -104,42 +110,28 @@ def register_gdrive_tools(registry, gdrive_service):
             return {"error": "Google Drive not initialized"}
 
         try:
-            file_info = gdrive_service.files().get(
+            file_info = drive_execute(gdrive_service.files().get(
                 fileId=file_id,
-                fields='name, mimeType, size'
-            ).execute()
+                fields='name, mimeType, size, md5Checksum, modifiedTime'
+            ))
 
             file_name = file_info.get('name', 'unknown')
             mime_type = file_info.get('mimeType', '')
             file_size = int(file_info.get('size', 0))
 
-            if file_size > 5 * 1024 * 1024:
+            max_chars = 10000
+            try:
+                content, truncated = read_text(gdrive_service, file_id, file_info, max_chars)
+            except UnsupportedFormat as e:
                 return {
-                    "error": "File too large",
-                    "size_mb": round(file_size / (1024 ** 2), 2),
-                    "message": "File size exceeds 5MB limit."
+                    "error": "Unsupported file type",
+                    "file_name": file_name,
+                    "mime_type": mime_type,
+                    "message": str(e)
                 }
 
-            if mime_type == 'application/vnd.google-apps.document':
-                request_obj = gdrive_service.files().export(fileId=file_id, mimeType='text/plain')
-            elif mime_type == 'application/vnd.google-apps.spreadsheet':
-                request_obj = gdrive_service.files().export(fileId=file_id, mimeType='text/csv')
-            else:
-                request_obj = gdrive_service.files().get_media(fileId=file_id)
-
-            file_stream = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_stream, request_obj)
-            done = False
-
-            while not done:
-                status, done = downloader.next_chunk()
-
-            file_stream.seek(0)
-            content = file_stream.read().decode('utf-8', errors='ignore')
-
-            max_chars = 10000
-            if len(content) > max_chars:
-                content = content[:max_chars] + f"\n\n... (файл обрезан, показано первых {max_chars} символов)"
+            if truncated:
+                content = content + f"\n\n... (файл обрезан, показано первых {max_chars} символов)"
 
             return {
                 "file_name": file_name,
@@ -156,7 +148,13 @@ def register_gdrive_tools(registry, gdrive_service):
         "get_drive_info",
         get_drive_info,
         "Get Google Drive storage usage info",
-        {"type": "object", "properties": {}}
+        {"type": "object", "properties": {}},
+        execution="thread",
+        timeout=30,
+        idempotent=True,
+        ttl=300,
+        backend="gdrive",
+        backend_guarded=True
     )
 
     registry.register(
@@ -165,9 +163,18 @@ def register_gdrive_tools(registry, gdrive_service):
         "Search files in Google Drive by name",
         {
             "type": "object",
-            "properties": {"query": {"type": "string", "description": "Search query"}},
+            "properties": {
+                "query": {"type": "string", "description": "Search query"},
+                "max_results": {"type": "integer", "default": 10, "description": "Max files to return"}
+            },
             "required": ["query"]
-        }
+        },
+        execution="thread",
+        timeout=30,
+        idempotent=True,
+        ttl=60,
+        backend="gdrive",
+        backend_guarded=True
     )
 
     registry.register(
@@ -177,23 +184,46 @@ def register_gdrive_tools(registry, gdrive_service):
         {
             "type": "object",
             "properties": {"limit": {"type": "integer", "default": 10}}
-        }
+        },
+        execution="thread",
+        timeout=30,
+        idempotent=True,
+        ttl=30,
+        backend="gdrive",
+        backend_guarded=True
     )
 
     registry.register(
         "list_folders",
         list_folders,
         "List all folders in Google Drive",
-        {"type": "object", "properties": {}}
+        {
+            "type": "object",
+            "properties": {
+                "max_results": {"type": "integer", "default": 20, "description": "Max folders to return"}
+            }
+        },
+        execution="thread",
+        timeout=30,
+        idempotent=True,
+        ttl=120,
+        backend="gdrive",
+        backend_guarded=True
     )
 
     registry.register(
         "read_file_content",
         read_file_content,
-        "Read content from a text file in Google Drive (max 5MB, 10k chars)",
+        "Read text from a Google Drive file (text, Google Docs/Sheets/Slides, docx, xlsx, pptx, PDF); first 10k chars",
         {
             "type": "object",
             "properties": {"file_id": {"type": "string", "description": "File ID"}},
             "required": ["file_id"]
-        }
+        },
+        execution="thread",
+        timeout=120,
+        idempotent=True,
+        ttl=60,
+        backend="gdrive",
+        backend_guarded=True
     )
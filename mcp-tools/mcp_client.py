@@ -0,0 +1,309 @@
+"""MCP Stdio Client - пул долгоживущих внешних MCP серверов (JSON-RPC 2.0 поверх stdio)"""
+import os
+import re
+import json
+import time
+import atexit
+import itertools
+import threading
+import subprocess
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+PROTOCOL_VERSION = "2024-11-05"
+CLIENT_INFO = {"name": "ai-challenge-agent", "version": "1.0.0"}
+
+
+class MCPServerError(Exception):
+    pass
+
+
+class MCPServerProcess:
+    """Один внешний MCP сервер: процесс живет между вызовами, запросы мультиплексируются по JSON-RPC id"""
+
+    def __init__(self, name, command, env=None, request_timeout=30, base_backoff=1, max_backoff=60):
+        self.name = name
+        self.command = command
+        self.env = env or {}
+        self.request_timeout = request_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.server_info = {}
+        self.restarts = 0
+        self._process = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._failures = 0
+        self._started_at = 0
+        self._next_start_at = 0
+        self._stopped = False
+        self._ready = False
+        self._start_lock = threading.Lock()
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        # весь запуск, включая initialize, под отдельной блокировкой: запросы идут только после рукопожатия
+        with self._start_lock:
+            if self._ready and self.alive:
+                return
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._process is not None:
+                self._kill(self._process)
+            self._stopped = False
+            print(f"[MCPClient] 🔌 Starting '{self.name}': {' '.join(self.command)[:120]}")
+            process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env={**os.environ, **self.env},
+                bufsize=0
+            )
+            self._process = process
+            self._started_at = time.monotonic()
+            threading.Thread(target=self._read_loop, args=(process,), daemon=True,
+                             name=f"mcp-{self.name}-reader").start()
+            threading.Thread(target=self._drain_stderr, args=(process,), daemon=True,
+                             name=f"mcp-{self.name}-stderr").start()
+
+        try:
+            result = self._request("initialize", {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": CLIENT_INFO
+            }, self.request_timeout)
+            self.server_info = result.get("serverInfo", {})
+            self.notify("notifications/initialized")
+            self._ready = True
+            print(f"[MCPClient] ✅ '{self.name}' ready ({self.server_info.get('name', 'unknown')})")
+        except Exception:
+            self._kill(process)
+            raise
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._ready = False
+            process = self._process
+            self._process = None
+        if process:
+            self._kill(process)
+
+    def _kill(self, process):
+        try:
+            process.terminate()
+            process.wait(timeout=2)
+        except Exception:
+            process.kill()
+
+    def _ensure_running(self):
+        if self._ready and self.alive:
+            return
+        with self._lock:
+            wait = self._next_start_at - time.monotonic()
+            if wait > 0:
+                raise MCPServerError(f"MCP server '{self.name}' is restarting, retry in {wait:.1f}s")
+        self.start()
+
+    def _read_loop(self, process):
+        for line in process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line.decode('utf-8'))
+            except ValueError:
+                print(f"[MCPClient] ⚠️  '{self.name}' sent non-JSON line: {line[:200]!r}")
+                continue
+            if "id" in message and ("result" in message or "error" in message):
+                future = self._pending.pop(message["id"], None)
+                if future is None:
+                    continue
+                if "error" in message:
+                    error = message["error"]
+                    future.set_exception(MCPServerError(f"{error.get('code')}: {error.get('message')}"))
+                else:
+                    future.set_result(message["result"])
+            elif "id" in message and "method" in message:
+                # запросы сервера к клиенту (sampling, roots) не поддерживаются
+                self._send({"jsonrpc": "2.0", "id": message["id"],
+                            "error": {"code": -32601, "message": "Method not supported by client"}})
+        self._on_exit(process)
+
+    def _drain_stderr(self, process):
+        for line in process.stderr:
+            print(f"[MCPClient:{self.name}] {line.decode('utf-8', errors='ignore').rstrip()}")
+
+    def _on_exit(self, process):
+        with self._lock:
+            if process is not self._process and self._process is not None:
+                return
+            self._ready = False
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(MCPServerError(f"MCP server '{self.name}' exited"))
+            if self._stopped:
+                return
+            self._process = None
+
+            # сервер, проработавший достаточно долго, начинает отсчет backoff заново
+            if time.monotonic() - self._started_at > self.max_backoff:
+                self._failures = 0
+            self._failures += 1
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (self._failures - 1))
+            self._next_start_at = time.monotonic() + delay
+            print(f"[MCPClient] ❌ '{self.name}' exited (code {process.poll()}), restarting in {delay}s")
+
+        timer = threading.Timer(delay, self._restart)
+        timer.daemon = True
+        timer.start()
+
+    def _restart(self):
+        if self._stopped or (self._ready and self.alive):
+            return
+        try:
+            self.start()
+            self.restarts += 1
+        except Exception as e:
+            print(f"[MCPClient] ❌ Restart of '{self.name}' failed: {e}")
+
+    def _send(self, message):
+        data = (json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8')
+        process = self._process
+        if process is None:
+            raise MCPServerError(f"MCP server '{self.name}' is not running")
+        with self._write_lock:
+            process.stdin.write(data)
+            process.stdin.flush()
+
+    def _request(self, method, params, timeout):
+        request_id = next(self._ids)
+        future = Future()
+        self._pending[request_id] = future
+        try:
+            self._send({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params or {}})
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            raise MCPServerError(f"MCP server '{self.name}' did not answer '{method}' in {timeout}s")
+        except (BrokenPipeError, OSError) as e:
+            raise MCPServerError(f"MCP server '{self.name}' pipe error: {e}")
+        finally:
+            self._pending.pop(request_id, None)
+
+    def request(self, method, params=None, timeout=None):
+        self._ensure_running()
+        return self._request(method, params, timeout or self.request_timeout)
+
+    def notify(self, method, params=None):
+        message = {"jsonrpc": "2.0", "method": method}
+        if params:
+            message["params"] = params
+        self._send(message)
+
+    def list_tools(self):
+        tools = []
+        cursor = None
+        while True:
+            result = self.request("tools/list", {"cursor": cursor} if cursor else {})
+            tools.extend(result.get("tools", []))
+            cursor = result.get("nextCursor")
+            if not cursor:
+                return tools
+
+    def call_tool(self, name, arguments):
+        result = self.request("tools/call", {"name": name, "arguments": arguments})
+        texts = [block.get("text", "") for block in result.get("content", []) if block.get("type") == "text"]
+        text = "\n".join(texts)
+        if result.get("isError"):
+            return {"error": text or "Tool returned an error", "server": self.name}
+        if result.get("structuredContent") is not None:
+            return result["structuredContent"]
+        return {"success": True, "content": text}
+
+
+def _remote_tool(server, tool_name):
+    """Обертка инструмента сервера: имя связано в замыкании, а не передается именованным аргументом,
+    чтобы не конфликтовать с аргументами схемы; аргументы уходят на сервер одним dict"""
+    def call(**arguments):
+        return server.call_tool(tool_name, arguments)
+    return call
+
+
+def _tool_name(server_name, tool_name):
+    # Имена инструментов Claude: [a-zA-Z0-9_-]{1,64}
+    return re.sub(r'[^a-zA-Z0-9_-]', '_', f"{server_name}_{tool_name}")[:64]
+
+
+class MCPClientPool:
+    def __init__(self):
+        self.servers = {}
+        self._lock = threading.Lock()
+
+    def add_server(self, name, command, env=None, request_timeout=30):
+        with self._lock:
+            if name not in self.servers:
+                self.servers[name] = MCPServerProcess(name, command, env, request_timeout)
+            return self.servers[name]
+
+    def get(self, name):
+        return self.servers.get(name)
+
+    def import_tools(self, registry, server_name):
+        """Зарегистрировать инструменты сервера (tools/list) в MCPRegistry как <server>_<tool>"""
+        server = self.servers[server_name]
+        tools = server.list_tools()
+        for tool in tools:
+            registry.register(
+                _tool_name(server_name, tool["name"]),
+                _remote_tool(server, tool["name"]),
+                f"[{server_name}] {tool.get('description', '')}".strip(),
+                tool.get("inputSchema", {"type": "object", "properties": {}}),
+                timeout=server.request_timeout
+            )
+        print(f"[MCPClient] ✅ Imported {len(tools)} tools from '{server_name}'")
+        return len(tools)
+
+    def status(self):
+        return {
+            name: {"alive": server.alive, "restarts": server.restarts, "server_info": server.server_info}
+            for name, server in self.servers.items()
+        }
+
+    def stop_all(self):
+        for server in list(self.servers.values()):
+            server.stop()
+
+
+def load_servers_config():
+    """MCP_SERVERS='{"filesystem": {"command": ["npx", "-y", "@modelcontextprotocol/server-filesystem", "/tmp"]}}'"""
+    raw = os.getenv("MCP_SERVERS")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError as e:
+        print(f"[MCPClient] ❌ Invalid MCP_SERVERS: {e}")
+        return {}
+
+
+def register_external_mcp_tools(registry, pool=None):
+    """Запустить внешние MCP серверы из конфигурации и импортировать их инструменты"""
+    pool = pool or mcp_client_pool
+    for name, config in load_servers_config().items():
+        try:
+            pool.add_server(name, config["command"], config.get("env"), config.get("timeout", 30))
+            pool.import_tools(registry, name)
+        except Exception as e:
+            print(f"[MCPClient] ❌ Cannot import tools from '{name}': {e}")
+
+
+# Глобальный экземпляр
+mcp_client_pool = MCPClientPool()
+atexit.register(mcp_client_pool.stop_all)
@@ -0,0 +1,180 @@
+"""MCP Metrics - счетчики и гистограммы инструментов, Claude API и БД в формате Prometheus"""
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Counter:
+    """Счетчик без блокировок: next() у itertools.count атомарен в CPython"""
+    __slots__ = ('_count',)
+
+    def __init__(self):
+        self._count = itertools.count()
+
+    def inc(self):
+        next(self._count)
+
+    @property
+    def value(self):
+        # repr имеет вид "count(N)"
+        return int(repr(self._count)[6:-1])
+
+
+class Histogram:
+    """Гистограмма с заранее выделенными бакетами-счетчиками"""
+    __slots__ = ('bounds', '_buckets', '_sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self._buckets = [Counter() for _ in range(len(bounds) + 1)]
+        self._sum = 0.0
+
+    def observe(self, value):
+        self._buckets[bisect_left(self.bounds, value)].inc()
+        # сумма обновляется без блокировки, при гонке допускается потеря одного слагаемого
+        self._sum += value
+
+    def snapshot(self):
+        counts = [b.value for b in self._buckets]
+        cumulative = list(itertools.accumulate(counts))
+        return cumulative, cumulative[-1], self._sum
+
+
+class MetricFamily:
+    def __init__(self, name, kind, help_text, factory):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.factory = factory
+        self.children = {}
+
+    def labels(self, **labels):
+        key = tuple(sorted(labels.items()))
+        child = self.children.get(key)
+        if child is None:
+            # блокировка нужна только при первом появлении набора меток
+            with _lock:
+                child = self.children.get(key)
+                if child is None:
+                    child = self.factory()
+                    self.children[key] = child
+        return child
+
+
+_lock = threading.Lock()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = {}
+
+    def _family(self, name, kind, help_text, factory):
+        family = self.families.get(name)
+        if family is None:
+            with _lock:
+                family = self.families.get(name)
+                if family is None:
+                    family = MetricFamily(name, kind, help_text, factory)
+                    self.families[name] = family
+        return family
+
+    def counter(self, name, help_text):
+        return self._family(name, 'counter', help_text, Counter)
+
+    def histogram(self, name, help_text, bounds=LATENCY_BUCKETS):
+        return self._family(name, 'histogram', help_text, lambda: Histogram(bounds))
+
+    def render(self):
+        """Текст в формате Prometheus exposition 0.0.4"""
+        lines = []
+        for name, family in sorted(self.families.items()):
+            lines.append(f"# HELP {name} {family.help_text}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for key, child in sorted(family.children.items()):
+                if family.kind == 'counter':
+                    lines.append(f"{name}{_format_labels(key)} {child.value}")
+                    continue
+                cumulative, count, total = child.snapshot()
+                for bound, value in zip(child.bounds, cumulative):
+                    lines.append(f"{name}_bucket{_format_labels(key, le=_format_value(bound))} {value}")
+                lines.append(f"{name}_bucket{_format_labels(key, le='+Inf')} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(key, **extra):
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = []
+    for k, v in pairs:
+        v = str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+# Глобальный экземпляр
+metrics = MetricsRegistry()
+
+tool_calls = metrics.counter("mcp_tool_calls_total", "MCP tool invocations")
+tool_errors = metrics.counter("mcp_tool_errors_total", "MCP tool invocations that returned or raised an error")
+tool_duration = metrics.histogram("mcp_tool_duration_seconds", "MCP tool execution latency")
+tool_result_bytes = metrics.histogram("mcp_tool_result_bytes", "Serialized MCP tool result size", SIZE_BUCKETS)
+tool_cache_hits = metrics.counter("mcp_tool_cache_hits_total", "MCP tool results served from cache")
+tool_cache_misses = metrics.counter("mcp_tool_cache_misses_total", "Cacheable MCP tool calls that missed the cache")
+tool_coalesced = metrics.counter(
+    "mcp_tool_coalesced_total", "MCP tool calls served by a concurrent identical call (backend calls saved)"
+)
+anthropic_calls = metrics.counter("anthropic_requests_total", "Claude API requests")
+anthropic_errors = metrics.counter("anthropic_errors_total", "Claude API requests that raised")
+anthropic_duration = metrics.histogram("anthropic_request_duration_seconds", "Claude API request latency")
+content_cache_hits = metrics.counter("drive_content_cache_hits_total", "Drive downloads served from the content cache")
+content_cache_misses = metrics.counter("drive_content_cache_misses_total", "Drive downloads that missed the content cache")
+summary_cache_hits = metrics.counter("summary_cache_hits_total", "Claude summaries served from the summary cache")
+summary_cache_misses = metrics.counter("summary_cache_misses_total", "Claude summaries that had to be generated")
+db_duration = metrics.histogram("db_query_duration_seconds", "SQLite operation latency")
+db_errors = metrics.counter("db_errors_total", "SQLite operations that raised")
+
+
+@contextmanager
+def time_anthropic(caller):
+    """with time_anthropic("chat"): client.messages.create(...)"""
+    start = time.perf_counter()
+    anthropic_calls.labels(caller=caller).inc()
+    try:
+        yield
+    except Exception:
+        anthropic_errors.labels(caller=caller).inc()
+        raise
+    finally:
+        anthropic_duration.labels(caller=caller).observe(time.perf_counter() - start)
+
+
+def timed_db(func):
+    """Декоратор для функций database.py"""
+    histogram = db_duration.labels(operation=func.__name__)
+    errors = db_errors.labels(operation=func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
@@ -1,5 +1,28 @@
-import requests
 import os
+from mcp_tools.circuit_breaker import get_breaker
+
+# Короткий connect-таймаут: недоступный api.telegram.org не должен держать вызов 100 секунд
+TELEGRAM_TIMEOUT = (float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5")), float(os.getenv("TELEGRAM_TIMEOUT", "100")))
+
+
+def _post(kind, url, **kwargs):
+    """POST в Telegram через circuit breaker. 5xx/429 и сетевые ошибки считаются деградацией сервиса"""
+    breaker = get_breaker("telegram")
+    if not breaker.allow():
+        print(f"[Telegram] ⛔ {kind} skipped: circuit open, retry in {breaker.retry_after():.0f}s")
+        return None
+    try:
+        import requests
+        resp = requests.post(url, timeout=TELEGRAM_TIMEOUT, **kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+    if resp.status_code >= 500 or resp.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return resp
+
 
 def send_telegram_alert(title, text):
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -16,7 +39,9 @@ def send_telegram_alert(title, text):
         'disable_web_page_preview': True
     }
     try:
-        resp = requests.post(url, data=payload, timeout=100)
+        resp = _post("Alert", url, data=payload)
+        if resp is None:
+            return False
         if resp.status_code == 200:
             print("[Telegram] ✅ Alert sent!")
             return True
@@ -45,7 +70,9 @@ def send_telegram_file(filename, content, caption=None):
     }
 
     try:
-        resp = requests.post(url, files=files, data=data, timeout=100)
+        resp = _post("File", url, files=files, data=data)
+        if resp is None:
+            return False
         if resp.status_code == 200:
             print("[Telegram] ✅ File sent!")
             return True
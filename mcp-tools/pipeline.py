@@ -1,42 +1,165 @@
 import os
 import json
+import time
+import uuid
+import heapq
+from collections import deque
 from datetime import datetime
-import anthropic
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from mcp_tools.notifications import send_telegram_file
+from mcp_tools.metrics import time_anthropic
+from mcp_tools.drive_client import (drive_execute, walk_folder, escape_query, batch_get_metadata,
+                                    METADATA_FIELDS, DEFAULT_MAX_DEPTH)
+from mcp_tools.drive_mirror import drive_mirror
+from mcp_tools.extractors import read_text, UnsupportedFormat
+from mcp_tools.summary_cache import get_summary, save_summary, cached_tokens
+from mcp_tools.rate_limit import anthropic_limiter
+from mcp_tools.summarizer import MapReduceSummarizer, chunk_chars, SUMMARY_MAX_CHARS
+
+# Повышать при изменении промпта или параметров резюме - старые записи кэша перестанут совпадать
+SUMMARY_PROMPT_VERSION = "summary-v1"
+# Сколько символов файла идет в резюме одним вызовом Claude (без chunked)
+SINGLE_SUMMARY_CHARS = 3000
+# Файлы обрабатываются параллельно (скачивание), вызовы Claude дополнительно ограничены anthropic_limiter
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+def ordered_map(func, items, workers, should_stop=None):
+    """Потоковая стадия: func(item) выполняется в пуле потоков с ограниченным окном,
+    пары (item, result) отдаются по мере готовности, но строго в порядке items"""
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pipeline")
+    window = max(1, workers) * 2
+    pending = deque()
+    source = iter(items)
+    exhausted = False
+    try:
+        while True:
+            # пополняем окно, пока головной элемент не готов
+            while not exhausted and len(pending) < window and not (pending and pending[0][1].done()):
+                try:
+                    item = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append((item, pool.submit(func, item)))
+            if not pending:
+                return
+            item, future = pending[0]
+            while True:
+                if should_stop and should_stop():
+                    raise PipelineCancelled()
+                try:
+                    result = future.result(timeout=0.5)
+                    break
+                except FutureTimeout:
+                    continue
+            pending.popleft()
+            yield item, result
+    finally:
+        # при отмене элементы, которые еще не начали обрабатываться, не запускаются
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def stage_render(files, results):
+    """Стадия render: (номер, запись отчета, текст блока) для каждого файла"""
+    for index, (f, result) in enumerate(zip(files, results), 1):
+        if result.get("success"):
+            summary = {"file_name": f['name'], "summary": result.get("summary"), "size_mb": result.get("size_mb")}
+        else:
+            summary = {"file_name": f['name'], "error": result.get("error")}
+        entry = {"summary": summary, "cached": result.get("cached"), "tokens": result.get("tokens", 0),
+                 "resumed": result.get("resumed", False), "delivered": result.get("delivered", False)}
+        yield index, entry, render_entry(index, summary)
+
+
+def render_entry(index, s):
+    text = f"\n{index}. {s['file_name']}\n"
+    text += f"   Размер: {s.get('size_mb', 'N/A')} MB\n"
+    if 'summary' in s:
+        text += f"   Резюме: {s['summary']}\n"
+    else:
+        text += f"   Пропущен: {s.get('error', 'Unknown error')}\n"
+    return text
+
+
+def render_report(header, blocks, first_index, last_index, total, part=None):
+    title = "MCP PIPELINE REPORT" if part is None else f"MCP PIPELINE REPORT (часть {part})"
+    processed = f"{len(blocks)}" if part is None else f"{first_index}-{last_index} из {total}"
+    report = f"""{title}
+{'=' * 60}
+
+Дата выполнения: {header['started_at'].strftime('%d.%m.%Y %H:%M:%S')}
+Папка источника: {header['source_folder_id']}
+Поисковый запрос: {header['query'] or '(не указан)'}
+Обработано файлов: {processed}
+
+{'=' * 60}
+
+РЕЗУЛЬТАТЫ:
+"""
+    return report + "".join(blocks)
+
+
+_anthropic_client = None
+
+
+def get_anthropic_client():
+    """Общий клиент Anthropic для всех потоков pipeline (None без ANTHROPIC_API_KEY)"""
+    global _anthropic_client
+    if _anthropic_client is None:
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            return None
+        import anthropic
+        _anthropic_client = anthropic.Anthropic(api_key=api_key)
+    return _anthropic_client
 
 
 def register_pipeline_tools(registry, gdrive_service):
-    def search_files_in_folder(folder_id, query="", file_types=None):
+    def list_folder_files(folder_id, query="", file_types=None, max_results=20, max_depth=DEFAULT_MAX_DEPTH):
+        """Метаданные файлов папки и подпапок (до max_depth) в формате Drive API (из зеркала или живого API)"""
+        if drive_mirror.is_fresh():
+            return drive_mirror.files_in_folder(folder_id, query, file_types, max_results, max_depth)
+        q_parts = []
+        if query:
+            q_parts.append(f"name contains '{escape_query(query)}'")
+        if file_types:
+            type_conditions = " or ".join([f"mimeType='{escape_query(t)}'" for t in file_types])
+            q_parts.append(f"({type_conditions})")
+        # порядок обхода зависит от готовности страниц, поэтому дерево обходится целиком и
+        # отбираются max_results самых новых, как orderBy createdTime desc (в памяти - только они)
+        files = walk_folder(
+            gdrive_service,
+            folder_id,
+            max_depth,
+            q=" and ".join(q_parts) or None,
+            fields="id, name, mimeType, size, modifiedTime, createdTime, md5Checksum",
+            include_folders=False
+        )
+        return heapq.nlargest(max_results, files, key=lambda f: (f.get('createdTime') or '', f['id']))
+
+    def to_entry(f):
+        size_mb = int(f.get('size', 0)) / (1024 ** 2) if f.get('size') else 0
+        return {
+            "id": f.get('id'),
+            "name": f.get('name'),
+            "type": f.get('mimeType'),
+            "size_mb": round(size_mb, 2),
+            "modified": f.get('modifiedTime'),
+            "created": f.get('createdTime')
+        }
+
+    def search_files_in_folder(folder_id, query="", file_types=None, max_results=20, max_depth=DEFAULT_MAX_DEPTH):
         if not gdrive_service:
             return {"error": "Google Drive not initialized"}
         try:
-            q_parts = [f"'{folder_id}' in parents", "trashed=false"]
-            if query:
-                q_parts.append(f"name contains '{query}'")
-            if file_types:
-                type_conditions = " or ".join([f"mimeType='{t}'" for t in file_types])
-                q_parts.append(f"({type_conditions})")
-            q = " and ".join(q_parts)
-            results = gdrive_service.files().list(
-                q=q,
-                pageSize=20,
-                fields="files(id, name, mimeType, size, modifiedTime, createdTime)",
-                orderBy="createdTime desc",
-                supportsAllDrives=True
-            ).execute()
-            files = []
-            for f in results.get('files', []):
-                if f.get('mimeType') == 'application/vnd.google-apps.folder':
-                    continue
-                size_mb = int(f.get('size', 0)) / (1024 ** 2) if f.get('size') else 0
-                files.append({
-                    "id": f.get('id'),
-                    "name": f.get('name'),
-                    "type": f.get('mimeType'),
-                    "size_mb": round(size_mb, 2),
-                    "modified": f.get('modifiedTime'),
-                    "created": f.get('createdTime')
-                })
+            files = [to_entry(f) for f in list_folder_files(folder_id, query, file_types, max_results, max_depth)]
             return {
                 "success": True,
                 "count": len(files),
@@ -46,77 +169,94 @@ def register_pipeline_tools(registry, gdrive_service):
             print(f"[Pipeline] ❌ search_files_in_folder error: {e}")
             return {"error": str(e)}
 
-    def read_and_summarize(file_id, max_lines=50):
+    def fetch_for_summary(file_id, file_info=None, chunked=False):
+        """Стадия fetch: метаданные и текст файла (обрезанный до лимита) или {"error"}.
+        file_info - уже полученные метаданные (листинг, batch), тогда files().get не нужен.
+        chunked - читать до SUMMARY_MAX_CHARS для map-reduce резюме (десятки вызовов Claude на большой
+        файл, поэтому только по запросу), иначе первые SINGLE_SUMMARY_CHARS символов на один вызов"""
         if not gdrive_service:
             return {"error": "Google Drive not initialized"}
         try:
-            from googleapiclient.http import MediaIoBaseDownload
-            import io
-            file_info = gdrive_service.files().get(
-                fileId=file_id,
-                fields='name, mimeType, size',
-                supportsAllDrives=True
-            ).execute()
+            if file_info and file_info.get("error"):
+                return {"error": file_info["error"]}
+            if not file_info:
+                file_info = drive_execute(gdrive_service.files().get(
+                    fileId=file_id,
+                    fields=METADATA_FIELDS,
+                    supportsAllDrives=True
+                ))
             file_name = file_info.get('name', 'unknown')
             mime_type = file_info.get('mimeType', '')
             file_size = int(file_info.get('size', 0))
-            if file_size > 3 * 1024 * 1024:
-                return {
-                    "error": "File too large",
-                    "size_mb": round(file_size / (1024 ** 2), 2),
-                    "file_name": file_name
-                }
-            if mime_type.startswith('application/vnd.google-apps'):
-                return {
-                    "error": "Cannot process Google Docs files",
-                    "file_name": file_name,
-                    "mime_type": mime_type
-                }
-            request = gdrive_service.files().get_media(fileId=file_id)
-            file_stream = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_stream, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            file_stream.seek(0)
-            content = file_stream.read().decode('utf-8', errors='ignore')
-            if len(content) > 3000:
-                content = content[:3000] + "\n\n[... truncated]"
-            api_key = os.getenv("ANTHROPIC_API_KEY")
-            if not api_key:
-                return {"error": "ANTHROPIC_API_KEY not set"}
-            client = anthropic.Anthropic(api_key=api_key)
+            # текст скачивается только до бюджета, поэтому размер файла больше не ограничивается
+            max_chars = SUMMARY_MAX_CHARS if chunked else SINGLE_SUMMARY_CHARS
+            try:
+                content, truncated = read_text(gdrive_service, file_id, file_info, max_chars)
+            except UnsupportedFormat as e:
+                return {"error": str(e), "file_name": file_name, "mime_type": mime_type}
+            if truncated:
+                content = content + "\n\n[... truncated]"
+            return {
+                "success": True,
+                "file_name": file_name,
+                "file_id": file_id,
+                "mime_type": mime_type,
+                "size_mb": round(file_size / (1024 ** 2), 2),
+                "content": content
+            }
+        except Exception as e:
+            print(f"[Pipeline] ❌ fetch error ({file_id}): {e}")
+            return {"error": str(e)}
+
+    def summarize_fetched(fetched):
+        """Стадия summarize: резюме из кэша или от Claude (под anthropic_limiter)"""
+        if not fetched.get("success"):
+            return fetched
+        try:
+            content = fetched["content"]
             model = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
+            result = {k: v for k, v in fetched.items() if k != "content"}
+            result["content_length"] = len(content)
+            # map-reduce - только для текста, прочитанного в режиме chunked и не влезающего в одну часть
+            if len(content) > chunk_chars():
+                client = get_anthropic_client()
+                if client is None:
+                    return {"error": "ANTHROPIC_API_KEY not set"}
+                summarizer = MapReduceSummarizer(client, model, "read_and_summarize")
+                return {**result, **summarizer.summarize(content, fetched['file_name'], fetched['mime_type'])}
+            cached = get_summary(content, model, SUMMARY_PROMPT_VERSION, "read_and_summarize")
+            if cached:
+                return {**result, "summary": cached["summary"], "cached": True, "tokens": cached_tokens(cached)}
+            client = get_anthropic_client()
+            if client is None:
+                return {"error": "ANTHROPIC_API_KEY not set"}
             prompt = f"""Сделай краткое резюме этого файла (2-3 предложения на русском):
 
-Имя файла: {file_name}
-Тип: {mime_type}
+Имя файла: {fetched['file_name']}
+Тип: {fetched['mime_type']}
 
 Содержимое:
 {content}
 
 Резюме должно быть конкретным и информативным."""
-            response = client.messages.create(
-                model=model,
-                max_tokens=300,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            with anthropic_limiter, time_anthropic("read_and_summarize"):
+                response = client.messages.create(
+                    model=model,
+                    max_tokens=300,
+                    messages=[{"role": "user", "content": prompt}]
+                )
             summary = response.content[0].text if response.content else "No summary"
-            return {
-                "success": True,
-                "file_name": file_name,
-                "file_id": file_id,
-                "mime_type": mime_type,
-                "size_mb": round(file_size / (1024 ** 2), 2),
-                "content_length": len(content),
-                "summary": summary
-            }
+            tokens = save_summary(content, model, SUMMARY_PROMPT_VERSION, summary, response) if response.content else 0
+            return {**result, "summary": summary, "cached": False, "tokens": tokens}
         except Exception as e:
             print(f"[Pipeline] ❌ read_and_summarize error: {e}")
             import traceback
             traceback.print_exc()
             return {"error": str(e)}
 
+    def read_and_summarize(file_id, max_lines=50, file_info=None, chunked=False):
+        return summarize_fetched(fetch_for_summary(file_id, file_info, chunked))
+
     def save_result_to_telegram(filename, content):
         print(f"[Pipeline] 🚀 Sending file to Telegram: {filename}")
         ok = send_telegram_file(filename, content)
@@ -127,74 +267,286 @@ def register_pipeline_tools(registry, gdrive_service):
             print(f"[Pipeline] ❌ Telegram error")
             return {"error": "Failed to send via Telegram"}
 
-    def run_pipeline(source_folder_id, output_folder_id=None, query="", max_files=5):
-        print(f"\n[Pipeline] 🚀 STARTING PIPELINE")
-        print(f"[Pipeline]    Source: {source_folder_id}")
-        print(f"[Pipeline]    Query: {query or '(all files)'}")
-        print(f"[Pipeline]    Max files: {max_files}")
-        search_result = search_files_in_folder(source_folder_id, query)
-        if not search_result.get("success"):
-            print(f"[Pipeline] ❌ Search failed: {search_result}")
-            return {"error": "Search failed", "details": search_result}
-        files = search_result.get("files", [])[:max_files]
-        if not files:
-            print(f"[Pipeline] ⚠️  No files found")
-            return {"error": "No files found", "query": query}
-        print(f"[Pipeline] ✅ Found {len(files)} files")
-        print(f"\n[Pipeline] 📄 STEP 2: Summarizing files...")
-        summaries = []
-        for i, f in enumerate(files, 1):
-            print(f"[Pipeline]    {i}/{len(files)}: {f['name']}")
-            summary_result = read_and_summarize(f['id'])
-            if summary_result.get("success"):
-                summaries.append({
-                    "file_name": f['name'],
-                    "summary": summary_result.get("summary"),
-                    "size_mb": summary_result.get("size_mb")
-                })
-                print(f"[Pipeline]      ✅ Summarized")
-            else:
-                summaries.append({
-                    "file_name": f['name'],
-                    "error": summary_result.get("error")
-                })
-                print(f"[Pipeline]      ⚠️  Skipped: {summary_result.get('error')}")
-        print(f"[Pipeline] ✅ Processed {len(summaries)} files")
-        print(f"\n[Pipeline] 📝 STEP 3: Creating report...")
-        output_filename = f"Pipeline_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        report_content = f"""MCP PIPELINE REPORT
-{'=' * 60}
+    def stage_deliver(rendered, header, total, run_id, flush_every=None, flush_seconds=None,
+                      should_stop=None, prior_parts=0):
+        """Стадия deliver: копит отрендеренные файлы и отправляет отчет частями по порогу
+        количества (flush_every) или времени (flush_seconds); остаток - в конце.
+        Файлы, доставленные до возобновления запуска, повторно не отправляются"""
+        from database import mark_pipeline_run_files_delivered
 
-Дата выполнения: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}
-Папка источника: {source_folder_id}
-Поисковый запрос: {query or '(не указан)'}
-Обработано файлов: {len(summaries)}
+        base_name = f"Pipeline_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        buffer = []
+        buffer_indexes = []
+        part = prior_parts
+        last_flush = time.monotonic()
 
-{'=' * 60}
+        def flush(final):
+            nonlocal buffer, buffer_indexes, part, last_flush
+            part += 1
+            first_index, last_index = buffer_indexes[0], buffer_indexes[-1]
+            partial = not (final and part == 1)
+            filename = f"{base_name}_part{part}.txt" if partial else f"{base_name}.txt"
+            delivery = save_result_to_telegram(filename, render_report(header, buffer, first_index, last_index,
+                                                                       total, part if partial else None))
+            if delivery.get("success"):
+                mark_pipeline_run_files_delivered(run_id, [index - 1 for index in buffer_indexes])
+            event = {"event": "delivered", "part": part, "output_file": filename,
+                     "files": [first_index, last_index], "final": final,
+                     "success": bool(delivery.get("success")), "details": delivery}
+            buffer = []
+            buffer_indexes = []
+            last_flush = time.monotonic()
+            return event
 
-РЕЗУЛЬТАТЫ:
-"""
-        for i, s in enumerate(summaries, 1):
-            report_content += f"\n{i}. {s['file_name']}\n"
-            report_content += f"   Размер: {s.get('size_mb', 'N/A')} MB\n"
-            if 'summary' in s:
-                report_content += f"   Резюме: {s['summary']}\n"
-            else:
-                report_content += f"   Пропущен: {s.get('error', 'Unknown error')}\n"
-        print(f"\n[Pipeline] 📤 STEP 4: Sending report to Telegram...")
-        telegram_result = save_result_to_telegram(output_filename, report_content)
-        if telegram_result.get("success"):
-            print(f"[Pipeline] ✅ PIPELINE COMPLETE! (sent to Telegram)")
-            return {
-                "success": True,
-                "files_processed": len(summaries),
-                "destination": "telegram",
-                "output_file": output_filename,
-                "summaries": summaries
-            }
+        for index, entry, text in rendered:
+            if not entry.get("delivered"):
+                buffer.append(text)
+                buffer_indexes.append(index)
+            yield {"event": "file", "index": index, "total": total, "entry": entry}
+            if buffer and ((flush_every and len(buffer) >= flush_every) or
+                           (flush_seconds and time.monotonic() - last_flush >= flush_seconds)):
+                yield flush(final=False)
+        if buffer:
+            if should_stop and should_stop():
+                raise PipelineCancelled()
+            yield flush(final=True)
+
+    def iter_pipeline(source_folder_id=None, query="", max_files=5, should_stop=None,
+                      flush_every=None, flush_seconds=None, run_id=None, max_depth=DEFAULT_MAX_DEPTH):
+        """Потоковый pipeline: search → fetch → summarize → render → deliver.
+
+        Генератор событий: search, file (по мере готовности, в исходном порядке), delivered (для
+        каждой отправленной части отчета) и завершающее done с итоговым результатом.
+        Состояние каждого файла сохраняется в pipeline_run_files; с run_id запуск возобновляется:
+        готовые резюме берутся из БД, повторяются только ошибки и недоставленные части отчета"""
+        from database import (create_pipeline_run, get_pipeline_run, update_pipeline_run,
+                              save_pipeline_run_file)
+
+        if run_id:
+            run = get_pipeline_run(run_id)
+            if not run:
+                yield {"event": "done", "result": {"error": "Run not found", "run_id": run_id}}
+                return
+            source_folder_id, query, files = run["source_folder_id"], run["query"], run["files"]
+            states = {state["file_index"]: state for state in run["file_states"]}
+            deliveries = run.get("deliveries") or []
+            metadata = None
+            print(f"\n[Pipeline] 🔁 RESUMING PIPELINE {run_id}")
+            update_pipeline_run(run_id, status='running', error=None)
         else:
-            print(f"[Pipeline] ❌ Save failed: {telegram_result}")
-            return {"error": "Failed to send results to Telegram", "details": telegram_result}
+            print(f"\n[Pipeline] 🚀 STARTING PIPELINE")
+            print(f"[Pipeline]    Source: {source_folder_id}")
+            print(f"[Pipeline]    Query: {query or '(all files)'}")
+            print(f"[Pipeline]    Max files: {max_files}")
+            try:
+                listed = list_folder_files(source_folder_id, query, max_results=max_files, max_depth=max_depth)
+            except Exception as e:
+                print(f"[Pipeline] ❌ Search failed: {e}")
+                yield {"event": "done", "result": {"error": "Search failed", "details": {"error": str(e)}}}
+                return
+            # метаданные из листинга передаются в стадию fetch - без отдельного files().get на файл
+            metadata = {f['id']: f for f in listed}
+            files = [to_entry(f) for f in listed]
+            if not files:
+                print(f"[Pipeline] ⚠️  No files found")
+                yield {"event": "done", "result": {"error": "No files found", "query": query}}
+                return
+            print(f"[Pipeline] ✅ Found {len(files)} files")
+            run_id = f"run_{uuid.uuid4().hex[:12]}"
+            create_pipeline_run(run_id, source_folder_id, query, files)
+            states = {}
+            deliveries = []
+
+        done_indexes = {index for index, state in states.items() if state["status"] == "done"}
+        yield {"event": "search", "run_id": run_id, "total": len(files),
+               "files": [f['name'] for f in files], "resumed": len(done_indexes)}
+
+        header = {
+            "source_folder_id": source_folder_id,
+            "query": query,
+            "started_at": datetime.now()
+        }
+        todo = [f['id'] for index, f in enumerate(files) if index not in done_indexes]
+        if metadata is None and todo:
+            # при возобновлении метаданные могли измениться: один batch-запрос на 100 файлов
+            try:
+                metadata = batch_get_metadata(gdrive_service, todo)
+            except Exception as e:
+                print(f"[Pipeline] ⚠️  Batch metadata failed, falling back to per-file requests: {e}")
+        metadata = metadata or {}
+        fetched = ordered_map(lambda file_id: fetch_for_summary(file_id, metadata.get(file_id)),
+                              todo, PIPELINE_WORKERS, should_stop)
+        summarized = ordered_map(summarize_fetched, (result for _, result in fetched), PIPELINE_WORKERS, should_stop)
+
+        def checkpointed():
+            """Сохраненные резюме подставляются на свое место, остальные - из стадии summarize с чекпоинтом"""
+            for index in range(len(files)):
+                state = states.get(index)
+                if index in done_indexes:
+                    yield {**state["result"], "resumed": True, "delivered": state["delivered"]}
+                    continue
+                _, result = next(summarized)
+                save_pipeline_run_file(run_id, index, "done" if result.get("success") else "error", result)
+                yield {**result, "delivered": bool(state and state["delivered"])}
+
+        rendered = stage_render(files, checkpointed())
+
+        summaries = []
+        failed_delivery = None
+        cache_stats = {"hits": 0, "misses": 0, "tokens_saved": 0, "tokens_spent": 0, "resumed": 0}
+        try:
+            for event in stage_deliver(rendered, header, len(files), run_id, flush_every, flush_seconds,
+                                       should_stop, prior_parts=len(deliveries)):
+                if event["event"] == "file":
+                    entry = event["entry"]
+                    summaries.append(entry["summary"])
+                    if entry.get("resumed"):
+                        cache_stats["resumed"] += 1
+                    elif entry.get("cached"):
+                        cache_stats["hits"] += 1
+                        cache_stats["tokens_saved"] += entry.get("tokens", 0)
+                    elif "summary" in entry["summary"]:
+                        cache_stats["misses"] += 1
+                        cache_stats["tokens_spent"] += entry.get("tokens", 0)
+                    print(f"[Pipeline]    {event['index']}/{len(files)}: {entry['summary']['file_name']} "
+                          f"{'✅' if 'summary' in entry['summary'] else '⚠️  ' + str(entry['summary'].get('error'))}")
+                elif event["event"] == "delivered":
+                    if event["success"]:
+                        deliveries.append(event["output_file"])
+                        update_pipeline_run(run_id, deliveries=deliveries)
+                    else:
+                        failed_delivery = event
+                yield event
+        except PipelineCancelled:
+            print(f"[Pipeline] 🛑 Cancelled after {len(summaries)} files")
+            update_pipeline_run(run_id, status='cancelled')
+            yield {"event": "done", "result": {
+                "error": "Cancelled",
+                "cancelled": True,
+                "run_id": run_id,
+                "summaries": summaries,
+                "delivered_parts": deliveries
+            }}
+            return
+        except Exception as e:
+            # чекпоинты уже в БД: запуск можно продолжить через resume_pipeline
+            print(f"[Pipeline] ❌ Run {run_id} failed: {e}")
+            update_pipeline_run(run_id, status='failed', error=str(e))
+            yield {"event": "done", "result": {"error": str(e), "run_id": run_id, "resumable": True}}
+            return
+
+        looked_up = cache_stats["hits"] + cache_stats["misses"]
+        cache_stats["hit_ratio"] = round(cache_stats["hits"] / looked_up, 2) if looked_up else 0.0
+        print(f"[Pipeline] ✅ Processed {len(summaries)} files "
+              f"(summary cache: {cache_stats['hits']}/{looked_up} hits, {cache_stats['tokens_saved']} tokens saved)")
+
+        if failed_delivery:
+            print(f"[Pipeline] ❌ Save failed: {failed_delivery['details']}")
+            update_pipeline_run(run_id, status='failed', error="Failed to send results to Telegram")
+            yield {"event": "done", "result": {
+                "error": "Failed to send results to Telegram",
+                "details": failed_delivery["details"],
+                "run_id": run_id,
+                "resumable": True,
+                "delivered_parts": deliveries,
+                "summaries": summaries
+            }}
+            return
+
+        print(f"[Pipeline] ✅ PIPELINE COMPLETE! (sent to Telegram)")
+        result = {
+            "success": True,
+            "run_id": run_id,
+            "files_processed": len(summaries),
+            "destination": "telegram",
+            "output_file": deliveries[-1] if deliveries else None,
+            "summaries": summaries,
+            "summary_cache": cache_stats
+        }
+        if len(deliveries) > 1:
+            result["parts"] = deliveries
+        update_pipeline_run(run_id, status='completed', result=result)
+        yield {"event": "done", "result": result}
+
+    def consume_pipeline(events, on_progress=None, on_event=None):
+        """Прогнать события pipeline через колбэки и вернуть итоговый результат"""
+        def progress(message, current=None, total=None):
+            if on_progress:
+                on_progress(message, current, total)
+
+        for event in events:
+            if on_event:
+                on_event(event)
+            if event["event"] == "search":
+                progress(f"Found {event['total']} files", event["resumed"], event["total"])
+            elif event["event"] == "file":
+                progress(f"Summarized {event['entry']['summary']['file_name']}", event["index"], event["total"])
+            elif event["event"] == "delivered":
+                progress(f"Delivered report part {event['part']}", event["files"][1], None)
+            elif event["event"] == "done":
+                return event["result"]
+
+    def run_pipeline(source_folder_id, output_folder_id=None, query="", max_files=5,
+                     on_progress=None, should_stop=None, on_event=None, flush_every=None, flush_seconds=None,
+                     max_depth=DEFAULT_MAX_DEPTH):
+        """on_progress(message, current, total) и should_stop() передаются фоновой задачей (jobs.py);
+        on_event(event) получает все события потокового pipeline. max_depth - глубина обхода подпапок"""
+        return consume_pipeline(
+            iter_pipeline(source_folder_id, query, max_files, should_stop, flush_every, flush_seconds,
+                          max_depth=max_depth),
+            on_progress, on_event
+        )
+
+    def resume_pipeline(run_id, on_progress=None, should_stop=None, on_event=None,
+                        flush_every=None, flush_seconds=None):
+        """Продолжить запуск: завершенный запуск возвращает сохраненный результат без пересчета"""
+        from database import get_pipeline_run
+
+        run = get_pipeline_run(run_id)
+        if not run:
+            return {"error": "Run not found", "run_id": run_id}
+        if run["status"] == "completed":
+            return {**run["result"], "already_completed": True}
+        return consume_pipeline(
+            iter_pipeline(should_stop=should_stop, flush_every=flush_every, flush_seconds=flush_seconds,
+                          run_id=run_id),
+            on_progress, on_event
+        )
+
+    def get_pipeline_run_info(run_id):
+        """Результаты запуска из БД: итог (если завершен) и резюме по каждому файлу"""
+        from database import get_pipeline_run
+
+        run = get_pipeline_run(run_id)
+        if not run:
+            return {"error": "Run not found", "run_id": run_id}
+        files = []
+        for f, state in zip(run["files"], run["file_states"]):
+            result = state["result"] or {}
+            files.append({
+                "file_name": f['name'],
+                "file_id": f['id'],
+                "status": state["status"],
+                "delivered": state["delivered"],
+                "summary": result.get("summary"),
+                "error": result.get("error")
+            })
+        return {
+            "run_id": run["id"],
+            "status": run["status"],
+            "source_folder_id": run["source_folder_id"],
+            "query": run["query"],
+            "error": run["error"],
+            "created_at": run["created_at"],
+            "updated_at": run["updated_at"],
+            "delivered_parts": run.get("deliveries") or [],
+            "result": run.get("result"),
+            "files": files
+        }
+
+    def list_pipeline_runs(limit=20):
+        from database import list_pipeline_runs as list_runs
+        return {"runs": list_runs(limit)}
 
     registry.register(
         "search_files_in_folder",
@@ -209,10 +561,22 @@ def register_pipeline_tools(registry, gdrive_service):
                     "type": "array",
                     "items": {"type": "string"},
                     "description": "MIME types to filter (optional)"
+                },
+                "max_results": {"type": "integer", "default": 20, "description": "Max files to return"},
+                "max_depth": {
+                    "type": "integer",
+                    "default": DEFAULT_MAX_DEPTH,
+                    "description": "How deep to descend into subfolders (0 - only the folder itself)"
                 }
             },
             "required": ["folder_id"]
-        }
+        },
+        execution="thread",
+        timeout=30,
+        idempotent=True,
+        ttl=30,
+        backend="gdrive",
+        backend_guarded=True
     )
     registry.register(
         "read_and_summarize",
@@ -222,10 +586,23 @@ def register_pipeline_tools(registry, gdrive_service):
             "type": "object",
             "properties": {
                 "file_id": {"type": "string", "description": "Google Drive file ID"},
-                "max_lines": {"type": "integer", "default": 50, "description": "Max lines to read"}
+                "max_lines": {"type": "integer", "default": 50, "description": "Max lines to read"},
+                "chunked": {
+                    "type": "boolean",
+                    "default": False,
+                    "description": "Summarize the whole file chunk by chunk (map-reduce, many Claude calls for large files); "
+                                   "false - only the first 3000 characters in one call"
+                }
             },
             "required": ["file_id"]
-        }
+        },
+        execution="thread",
+        timeout=180,
+        idempotent=True,
+        ttl=300,
+        cache_key_fields=["file_id", "chunked"],
+        backend="gdrive",
+        backend_guarded=True
     )
     registry.register(
         "run_pipeline",
@@ -237,8 +614,56 @@ def register_pipeline_tools(registry, gdrive_service):
                 "source_folder_id": {"type": "string", "description": "Source folder ID to search files"},
                 "output_folder_id": {"type": "string", "description": "Output folder ID (ignored, for compatibility)"},
                 "query": {"type": "string", "description": "Search query (optional)"},
-                "max_files": {"type": "integer", "default": 5, "description": "Max files to process"}
+                "max_files": {"type": "integer", "default": 5, "description": "Max files to process"},
+                "flush_every": {"type": "integer", "description": "Send a partial report every N files (optional)"},
+                "flush_seconds": {"type": "number", "description": "Send a partial report every N seconds (optional)"},
+                "max_depth": {
+                    "type": "integer",
+                    "default": DEFAULT_MAX_DEPTH,
+                    "description": "How deep to descend into subfolders (0 - only the folder itself)"
+                }
             },
             "required": ["source_folder_id"]
-        }
+        },
+        execution="thread",
+        timeout=900
+    )
+    registry.register(
+        "resume_pipeline",
+        resume_pipeline,
+        "Resume an interrupted or failed pipeline run: reuses finished summaries, retries failed files and undelivered report parts",
+        {
+            "type": "object",
+            "properties": {
+                "run_id": {"type": "string", "description": "Pipeline run ID (run_...)"},
+                "flush_every": {"type": "integer", "description": "Send a partial report every N files (optional)"},
+                "flush_seconds": {"type": "number", "description": "Send a partial report every N seconds (optional)"}
+            },
+            "required": ["run_id"]
+        },
+        execution="thread",
+        timeout=900
+    )
+    registry.register(
+        "get_pipeline_run",
+        get_pipeline_run_info,
+        "Get status and stored per-file summaries of a pipeline run without recomputation",
+        {
+            "type": "object",
+            "properties": {"run_id": {"type": "string", "description": "Pipeline run ID (run_...)"}},
+            "required": ["run_id"]
+        },
+        execution="thread",
+        timeout=30
+    )
+    registry.register(
+        "list_pipeline_runs",
+        list_pipeline_runs,
+        "List recent pipeline runs with progress counters",
+        {
+            "type": "object",
+            "properties": {"limit": {"type": "integer", "default": 20, "description": "Max runs to return"}}
+        },
+        execution="thread",
+        timeout=30
     )
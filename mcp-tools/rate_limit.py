@@ -0,0 +1,57 @@
+"""Rate Limit - ограничение параллельности и частоты запросов к Claude API"""
+import os
+import time
+import threading
+
+
+class RateLimiter:
+    """Token bucket: не более rate запросов за period секунд, допускается всплеск до rate"""
+
+    def __init__(self, rate, period=60.0):
+        self.rate = rate
+        self.period = period
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.period / self.rate
+            time.sleep(wait)
+
+
+class ConcurrencyLimiter:
+    """with limiter: ... - не более max_concurrency одновременных вызовов и не более rpm в минуту"""
+
+    def __init__(self, max_concurrency, requests_per_minute=None):
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._rate = RateLimiter(requests_per_minute) if requests_per_minute else None
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        if self._rate:
+            try:
+                self._rate.acquire()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+        return False
+
+
+# Глобальный экземпляр: общий для pipeline и монитора, т.к. лимиты API общие на ключ
+anthropic_limiter = ConcurrencyLimiter(
+    int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "2")),
+    int(os.getenv("ANTHROPIC_RPM", "50")) or None
+)
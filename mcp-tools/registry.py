@@ -1,17 +1,129 @@
 """MCP Tool Registry - центральный реестр всех MCP инструментов"""
+import json
+import time
+import threading
+import importlib
+
+from mcp_tools.metrics import (
+    tool_calls, tool_errors, tool_duration, tool_result_bytes, tool_cache_hits, tool_cache_misses,
+    tool_coalesced
+)
+from mcp_tools.tool_executor import execute, ToolTimeout, EXECUTION_POLICIES
+from mcp_tools.tool_cache import ToolResultCache, SingleFlight, normalize_arguments, DEFAULT_TTL
+from mcp_tools.circuit_breaker import get_breaker
 
 
 class MCPRegistry:
     def __init__(self):
-        self.tools = {}
+        self._tools = {}
+        self._providers = []
+        self._pending_metadata = {}
+        self._load_lock = threading.RLock()
+        self._loading = False
+        self._loading_provider = None
+        self.cache = ToolResultCache()
+        self.singleflight = SingleFlight()
+
+    @property
+    def tools(self):
+        self._ensure_loaded()
+        return self._tools
+
+    def add_provider(self, import_path, *args):
+        """Отложенная регистрация: "mcp_tools.module:register_func" импортируется и вызывается
+        как register_func(registry, *args) при первом обращении к инструментам"""
+        with self._load_lock:
+            self._providers.append((import_path, args))
+
+    def pending_providers(self):
+        return [path for path, _ in self._providers]
+
+    def loaded_tools(self):
+        """Имена уже зарегистрированных инструментов без загрузки отложенных провайдеров"""
+        return list(self._tools)
+
+    def _ensure_loaded(self):
+        if not self._providers:
+            return
+        with self._load_lock:
+            # повторный вход из самого провайдера (RLock) - ничего не делать
+            if self._loading:
+                return
+            self._loading = True
+            try:
+                while self._providers:
+                    import_path, args = self._providers[0]
+                    module_name, func_name = import_path.split(":")
+                    start = time.perf_counter()
+                    # провайдер без аргументов можно повторить в дочернем процессе (политика process)
+                    self._loading_provider = None if args else import_path
+                    try:
+                        register_func = getattr(importlib.import_module(module_name), func_name)
+                        register_func(self, *args)
+                        print(f"[MCP] 📦 Loaded {import_path} in {(time.perf_counter() - start) * 1000:.0f} ms")
+                    except Exception as e:
+                        print(f"[MCP] ❌ Failed to load {import_path}: {e}")
+                    self._loading_provider = None
+                    # удаляем только после регистрации, чтобы другие потоки ждали на блокировке
+                    self._providers.pop(0)
+            finally:
+                self._loading = False
 
-    def register(self, name, func, description, input_schema):
-        """Регистрация нового инструмента"""
-        self.tools[name] = {
+    def register(self, name, func, description, input_schema, **metadata):
+        """Регистрация нового инструмента.
+
+        metadata:
+            execution - "inline" (по умолчанию), "thread" или "process"
+            timeout - предельное время выполнения в секундах
+            timeout_arg - аргумент инструмента с таймаутом вызова (ограничен timeout)
+            idempotent - результат можно кэшировать (инструмент только читает)
+            ttl - время жизни записи кэша в секундах
+            cache_key_fields - аргументы, входящие в ключ кэша (по умолчанию все)
+            invalidates - инструменты, кэш которых сбрасывается после вызова этого
+            coalesce - объединять одновременные одинаковые вызовы (по умолчанию = idempotent)
+            backend - имя circuit breaker сервиса ("gdrive", "telegram") или функция (arguments) -> имя
+                Отказом сервиса считаются таймаут, исключение инструмента (кроме ошибок аргументов),
+                error_type "connection"/"server_error" или status_code 5xx/429 в результате;
+                остальные ошибки (4xx, неверные аргументы) - ошибки запроса, breaker их не учитывает
+            backend_guarded - клиент сервиса сам учитывает вызовы через guarded(backend), реестр
+                только отклоняет вызовы при открытом breaker (иначе пробный вызов занял бы реестр)
+        """
+        self._tools[name] = {
             "func": func,
             "description": description,
-            "input_schema": input_schema
+            "input_schema": input_schema,
+            "provider": self._loading_provider,
+            "metadata": {}
         }
+        self.configure(name, **metadata)
+        # метаданные, заданные через configure до загрузки инструмента, имеют приоритет
+        pending = self._pending_metadata.pop(name, None)
+        if pending:
+            self.configure(name, **pending)
+
+    def configure(self, name, **metadata):
+        """Обновить метаданные инструмента. Для еще не загруженного - применить при регистрации"""
+        execution = metadata.get("execution")
+        if execution and execution not in EXECUTION_POLICIES:
+            raise ValueError(f"Unknown execution policy '{execution}' for tool '{name}'")
+        if name not in self._tools:
+            self._pending_metadata.setdefault(name, {}).update(metadata)
+            return False
+        self._tools[name]["metadata"].update(metadata)
+        return True
+
+    def _resolve_timeout(self, metadata, arguments, timeout):
+        if timeout is not None:
+            return timeout
+        limit = metadata.get("timeout")
+        timeout_arg = metadata.get("timeout_arg")
+        if timeout_arg and arguments.get(timeout_arg):
+            try:
+                requested = float(arguments[timeout_arg])
+                return min(requested, limit) if limit else requested
+            except (TypeError, ValueError):
+                pass
+        return limit
 
     def get_tool_definitions(self):
         """Получить список инструментов для Claude API"""
@@ -24,15 +136,123 @@ class MCPRegistry:
             for name, tool in self.tools.items()
         ]
 
-    def execute_tool(self, name, arguments):
-        """Выполнить инструмент по имени"""
+    def execute_tool(self, name, arguments, timeout=None, use_cache=True):
+        """Выполнить инструмент по имени согласно его политике выполнения.
+
+        timeout - явный таймаут вызова, заменяет значение из метаданных.
+        use_cache=False - не читать кэш (свежий результат все равно сохраняется).
+        """
         if name not in self.tools:
             return {"error": f"Tool '{name}' not found"}
 
+        metadata = self._tools[name]["metadata"]
+        cacheable = metadata.get("idempotent", False)
+        coalesce = metadata.get("coalesce", cacheable)
+        if cacheable or coalesce:
+            args_key = normalize_arguments(arguments, metadata.get("cache_key_fields"))
+        if cacheable:
+            generation = self.cache.generation(name)
+            if use_cache:
+                hit, cached = self.cache.get(name, args_key)
+                if hit:
+                    tool_cache_hits.labels(tool=name).inc()
+                    return cached
+                tool_cache_misses.labels(tool=name).inc()
+
+        if coalesce:
+            result, shared = self.singleflight.do(
+                (name, args_key), lambda: self._execute(name, arguments, timeout)
+            )
+            if shared:
+                tool_coalesced.labels(tool=name).inc()
+                return result
+        else:
+            result = self._execute(name, arguments, timeout)
+
+        if cacheable and not _is_error(result):
+            self.cache.set(name, args_key, result, metadata.get("ttl", DEFAULT_TTL), generation)
+        for target in metadata.get("invalidates", ()):
+            self.cache.invalidate(target)
+        return result
+
+    def _resolve_breaker(self, metadata, arguments):
+        backend = metadata.get("backend")
+        if callable(backend):
+            backend = backend(arguments)
+        return get_breaker(backend) if backend else None
+
+    def _execute(self, name, arguments, timeout):
+        tool = self._tools[name]
+        metadata = tool["metadata"]
+        policy = metadata.get("execution", "inline")
+        timeout = self._resolve_timeout(metadata, arguments, timeout)
+
+        # сервис деградировал - отказ сразу, без ожидания таймаута
+        breaker = self._resolve_breaker(metadata, arguments)
+        recording = breaker is not None and not metadata.get("backend_guarded", False)
+        if recording:
+            rejected = not breaker.allow()
+        else:
+            rejected = breaker is not None and breaker.rejecting(count=True)
+        if rejected:
+            tool_calls.labels(tool=name).inc()
+            tool_errors.labels(tool=name).inc()
+            return breaker.fast_fail_error()
+
+        tool_calls.labels(tool=name).inc()
+        start = time.perf_counter()
         try:
-            return self.tools[name]["func"](**arguments)
+            target = ("provider", tool["provider"], name) if tool["provider"] else None
+            result = execute(tool["func"], arguments, policy, timeout, target)
+        except ToolTimeout as e:
+            print(f"[MCP] ⏱️  Tool '{name}' timed out after {timeout}s ({policy})")
+            result = {
+                "error": f"Tool '{name}' timed out after {timeout} seconds",
+                "error_type": "timeout",
+                "tool": name,
+                "timeout": timeout,
+                # поток нельзя прервать - вызов может еще завершиться и выполнить свои действия
+                "still_running": e.still_running
+            }
         except Exception as e:
-            return {"error": str(e)}
+            result = {"error": str(e)}
+            if not isinstance(e, REQUEST_ERRORS):
+                result["error_type"] = "exception"
+        if recording:
+            # успех закрывает breaker после пробного вызова, иначе он остался бы открытым навсегда
+            if _is_backend_failure(result):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        tool_duration.labels(tool=name).observe(time.perf_counter() - start)
+
+        if _is_error(result):
+            tool_errors.labels(tool=name).inc()
+        tool_result_bytes.labels(tool=name).observe(len(json.dumps(result, ensure_ascii=False, default=str)))
+        return result
+
+
+def _is_error(result):
+    if isinstance(result, dict):
+        return "error" in result
+    if isinstance(result, list) and len(result) == 1 and isinstance(result[0], dict):
+        return "error" in result[0]
+    return False
+
+
+# Исключения из-за аргументов вызова, а не деградации сервиса
+REQUEST_ERRORS = (TypeError, ValueError, KeyError)
+BACKEND_FAILURE_TYPES = {"timeout", "exception", "connection", "server_error"}
+
+
+def _is_backend_failure(result):
+    """Отказ сервиса (открывает breaker), а не ошибка запроса вроде 4xx или неверных аргументов"""
+    if not isinstance(result, dict):
+        return False
+    if result.get("error_type") in BACKEND_FAILURE_TYPES:
+        return True
+    status = result.get("status_code")
+    return isinstance(status, int) and (status >= 500 or status == 429)
 
 
 # Глобальный экземпляр
@@ -0,0 +1,171 @@
+"""Summarizer - map-reduce резюме больших файлов: резюме частей параллельно, затем иерархическое сведение"""
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from mcp_tools.metrics import time_anthropic
+from mcp_tools.rate_limit import anthropic_limiter
+from mcp_tools.summary_cache import get_summary, save_summary, cached_tokens
+
+# Повышать при изменении промптов частей/сведения - старые записи кэша перестанут совпадать
+CHUNK_PROMPT_VERSION = "chunk-v1"
+REDUCE_PROMPT_VERSION = "reduce-v1"
+# Размер части в токенах; для русского текста ~3 символа на токен (оценка с запасом)
+CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))
+CHARS_PER_TOKEN = 3
+# Сколько символов файла читается для map-reduce резюме (ограничивает число вызовов Claude)
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "120000"))
+# Граница части после абзаца, у которого crc32 % BOUNDARY_MODULUS == 0: границы зависят от
+# содержимого, поэтому правка одного абзаца меняет только свою часть, а не сдвигает все следующие
+BOUNDARY_MODULUS = 8
+
+
+def chunk_chars():
+    return CHUNK_TOKENS * CHARS_PER_TOKEN
+
+
+def _pieces(text, max_chars):
+    """Абзацы текста; слишком длинные режутся по строкам, затем по max_chars"""
+    for paragraph in text.split("\n\n"):
+        if len(paragraph) <= max_chars:
+            yield paragraph + "\n\n"
+            continue
+        line_buffer = ""
+        for line in paragraph.split("\n"):
+            line += "\n"
+            while len(line) > max_chars:
+                if line_buffer:
+                    yield line_buffer
+                    line_buffer = ""
+                yield line[:max_chars]
+                line = line[max_chars:]
+            if len(line_buffer) + len(line) > max_chars:
+                yield line_buffer
+                line_buffer = ""
+            line_buffer += line
+        if line_buffer:
+            yield line_buffer + "\n"
+
+
+def split_chunks(text, max_chars=None):
+    """Разбить текст на части не длиннее max_chars по границам абзацев (content-defined)"""
+    max_chars = max_chars or chunk_chars()
+    min_chars = max_chars // 4
+    chunks = []
+    current = []
+    size = 0
+    for piece in _pieces(text, max_chars):
+        if current and size + len(piece) > max_chars:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece)
+        if size >= min_chars and zlib.crc32(piece.encode('utf-8')) % BOUNDARY_MODULUS == 0:
+            chunks.append("".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("".join(current))
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+class MapReduceSummarizer:
+    """Резюме одного большого текста. Каждый вызов Claude (часть или сведение) кэшируется
+    по хэшу своего входа, поэтому после правки файла пересчитываются только измененные части
+    и сведения, в которые они входят"""
+
+    def __init__(self, client, model, caller, workers=None):
+        self.client = client
+        self.model = model
+        self.caller = caller
+        self.workers = workers or anthropic_limiter.max_concurrency
+        self.calls = 0
+        self.cached_calls = 0
+        self.tokens_spent = 0
+        self.tokens_saved = 0
+
+    def _complete(self, cache_text, prompt_version, prompt, max_tokens):
+        cached = get_summary(cache_text, self.model, prompt_version, self.caller)
+        if cached:
+            self.cached_calls += 1
+            self.tokens_saved += cached_tokens(cached)
+            return cached["summary"]
+        with anthropic_limiter, time_anthropic(self.caller):
+            response = self.client.messages.create(
+                model=self.model,
+                max_tokens=max_tokens,
+                messages=[{"role": "user", "content": prompt}]
+            )
+        self.calls += 1
+        if not response.content:
+            return ""
+        summary = response.content[0].text
+        self.tokens_spent += save_summary(cache_text, self.model, prompt_version, summary, response)
+        return summary
+
+    def summarize_chunk(self, chunk, file_name, position, total):
+        prompt = f"""Это часть {position} из {total} файла "{file_name}".
+Кратко перечисли ключевые факты, цифры и выводы этой части (до 5 пунктов на русском):
+
+{chunk}"""
+        # позиция не входит в ключ кэша: вставка части в начало не должна сбрасывать остальные
+        return self._complete(chunk, CHUNK_PROMPT_VERSION, prompt, 400)
+
+    def reduce(self, summaries, file_name, mime_type, final):
+        joined = "\n\n".join(f"Часть {i}:\n{s}" for i, s in enumerate(summaries, 1))
+        if final:
+            prompt = f"""Ниже - резюме последовательных частей одного файла.
+Сделай по ним краткое резюме всего файла (2-3 предложения на русском):
+
+Имя файла: {file_name}
+Тип: {mime_type}
+
+{joined}
+
+Резюме должно быть конкретным и информативным."""
+        else:
+            prompt = f"""Объедини резюме последовательных частей файла "{file_name}" в одно
+(до 7 пунктов на русском), сохранив ключевые факты и цифры:
+
+{joined}"""
+        version = f"{REDUCE_PROMPT_VERSION}:{'final' if final else 'group'}"
+        return self._complete(joined, version, prompt, 300 if final else 500)
+
+    def _map(self, func, items):
+        if len(items) == 1 or self.workers <= 1:
+            return [func(item) for item in items]
+        # вызовы Claude ограничены anthropic_limiter, пул только держит их в очереди
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items)),
+                                thread_name_prefix="summarize") as pool:
+            return list(pool.map(func, items))
+
+    def summarize(self, content, file_name, mime_type):
+        chunks = split_chunks(content)
+        summaries = self._map(
+            lambda item: self.summarize_chunk(item[1], file_name, item[0], len(chunks)),
+            list(enumerate(chunks, 1))
+        )
+        # сведение группами, помещающимися в одну часть, пока не останется одна группа
+        level = 0
+        while True:
+            groups = []
+            for summary in summaries:
+                if groups and sum(len(s) for s in groups[-1]) + len(summary) <= chunk_chars():
+                    groups[-1].append(summary)
+                else:
+                    groups.append([summary])
+            if len(groups) == 1 or level >= 10:
+                break
+            summaries = self._map(lambda group: self.reduce(group, file_name, mime_type, final=False), groups)
+            level += 1
+        summary = self.reduce(summaries, file_name, mime_type, final=True)
+        print(f"[Summarizer] 🧩 {file_name}: {len(chunks)} chunk(s), {level + 1} reduce level(s), "
+              f"{self.cached_calls}/{self.cached_calls + self.calls} cached")
+        return {
+            "summary": summary or "No summary",
+            "chunks": len(chunks),
+            "reduce_levels": level + 1,
+            "cached": self.calls == 0,
+            "cached_calls": self.cached_calls,
+            "tokens": self.tokens_saved if self.calls == 0 else self.tokens_spent,
+            "tokens_saved": self.tokens_saved
+        }
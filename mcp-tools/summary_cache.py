@@ -0,0 +1,35 @@
+"""Summary Cache - резюме Claude по хэшу содержимого, модели и версии промпта"""
+import hashlib
+
+from mcp_tools.metrics import summary_cache_hits, summary_cache_misses
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_summary(content, model, prompt_version, caller):
+    """{"summary", "input_tokens", "output_tokens"} из кэша или None"""
+    from database import get_cached_summary
+
+    cached = get_cached_summary(content_hash(content), model, prompt_version)
+    if cached:
+        summary_cache_hits.labels(caller=caller).inc()
+    else:
+        summary_cache_misses.labels(caller=caller).inc()
+    return cached
+
+
+def save_summary(content, model, prompt_version, summary, response):
+    """Сохранить резюме; usage ответа Anthropic нужен для подсчета сэкономленных токенов"""
+    from database import save_cached_summary
+
+    usage = getattr(response, 'usage', None)
+    input_tokens = getattr(usage, 'input_tokens', 0) or 0
+    output_tokens = getattr(usage, 'output_tokens', 0) or 0
+    save_cached_summary(content_hash(content), model, prompt_version, summary, input_tokens, output_tokens)
+    return input_tokens + output_tokens
+
+
+def cached_tokens(cached):
+    return (cached.get('input_tokens') or 0) + (cached.get('output_tokens') or 0)
@@ -38,7 +38,11 @@ def register_telegram_tools(registry):
                 "caption": {"type": "string", "description": "Optional caption/title"}
             },
             "required": ["filename", "content"]
-        }
+        },
+        execution="thread",
+        timeout=120,
+        backend="telegram",
+        backend_guarded=True
     )
 
     registry.register(
@@ -52,7 +56,11 @@ def register_telegram_tools(registry):
                 "message": {"type": "string", "description": "Alert message text"}
             },
             "required": ["title", "message"]
-        }
+        },
+        execution="thread",
+        timeout=120,
+        backend="telegram",
+        backend_guarded=True
     )
 
     print("[TelegramTools] ✅ Registered 2 tools")
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""Tool Result Cache - LRU-кэш результатов идемпотентных инструментов с TTL"""
+import os
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+
+DEFAULT_TTL = 60
+
+
+def normalize_arguments(arguments, key_fields=None):
+    """Каноническое представление аргументов: только key_fields (если заданы), ключи отсортированы"""
+    if key_fields:
+        arguments = {k: arguments.get(k) for k in key_fields}
+    return json.dumps(arguments, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class ToolResultCache:
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "512"))
+        self._entries = OrderedDict()
+        # поколение инструмента растет при каждой инвалидации: результат вызова, начатого до нее,
+        # не сохраняется (иначе вернул бы в кэш данные до записи)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, name):
+        with self._lock:
+            return self._generations.get(name, 0)
+
+    def get(self, name, args_key):
+        """Вернуть (hit, value). Устаревшие записи удаляются при обращении"""
+        key = (name, args_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+        return True, copy.deepcopy(value)
+
+    def set(self, name, args_key, value, ttl=DEFAULT_TTL, generation=None):
+        """Сохранить результат. generation - поколение на момент начала вызова; если с тех пор
+        была инвалидация, результат устарел и не сохраняется (возвращается False)"""
+        key = (name, args_key)
+        with self._lock:
+            if generation is not None and self._generations.get(name, 0) != generation:
+                return False
+            self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, name):
+        """Удалить все записи инструмента name"""
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            keys = [key for key in self._entries if key[0] == name]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _InflightCall:
+    __slots__ = ('event', 'result', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых вызовов: выполняется один, остальные ждут его результат"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Вернуть (result, shared). shared=True - результат получен от чужого вызова"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _InflightCall()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            return copy.deepcopy(call.result), True
+
+        try:
+            call.result = func()
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        # ожидающие копируют call.result, поэтому вызывающему отдаем отдельную копию
+        return (copy.deepcopy(call.result) if call.waiters else call.result), False
+
+    def inflight(self):
+        return len(self._calls)
@@ -0,0 +1,141 @@
+"""Tool Executor - политики выполнения инструментов: inline, thread (таймаут), process (жесткое завершение)"""
+import os
+import threading
+import importlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+EXECUTION_POLICIES = ("inline", "thread", "process")
+# Потоки нельзя прервать: вызовы, брошенные по таймауту, дорабатывают в пуле. Пока их больше
+# лимита, новые вызовы с политикой thread отклоняются, чтобы зависший сервис не занял весь пул
+MAX_ABANDONED = int(os.getenv("TOOL_MAX_ABANDONED", "8"))
+
+_thread_pool = None
+_abandoned = set()
+_abandoned_lock = threading.Lock()
+
+
+class ToolTimeout(Exception):
+    def __init__(self, still_running=False):
+        # still_running - вызов продолжается в фоне (политика thread), его эффекты еще возможны
+        self.still_running = still_running
+        super().__init__()
+
+
+def _get_thread_pool():
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv("TOOL_THREAD_WORKERS", "16")),
+            thread_name_prefix="tool"
+        )
+    return _thread_pool
+
+
+def abandoned_calls():
+    """Сколько вызовов, брошенных по таймауту, еще выполняется"""
+    with _abandoned_lock:
+        return len(_abandoned)
+
+
+def _release_abandoned(future):
+    with _abandoned_lock:
+        _abandoned.discard(future)
+
+
+def run_in_thread(func, arguments, timeout):
+    """Выполнить в пуле потоков. По таймауту поток не прерывается: вызывающий больше не ждет,
+    а вызов учитывается как брошенный до своего завершения (ToolTimeout.still_running)"""
+    if abandoned_calls() >= MAX_ABANDONED:
+        raise RuntimeError(f"Too many timed out tool calls still running ({abandoned_calls()}), try later")
+    future = _get_thread_pool().submit(func, **arguments)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        if future.cancel():
+            raise ToolTimeout()
+        with _abandoned_lock:
+            _abandoned.add(future)
+        future.add_done_callback(_release_abandoned)
+        raise ToolTimeout(still_running=True)
+
+
+def function_target(func):
+    """("function", module, qualname) для функции уровня модуля, иначе None (замыкание, lambda)"""
+    module = getattr(func, "__module__", None)
+    qualname = getattr(func, "__qualname__", "")
+    if not module or module == "__main__" or "<" in qualname:
+        return None
+    return ("function", module, qualname)
+
+
+def _resolve_target(target):
+    """Функция инструмента в дочернем процессе - импортом по пути модуля.
+    ("provider", "module:register_func", tool_name) - регистрация во временном реестре процесса"""
+    kind, path, name = target
+    if kind == "function":
+        obj = importlib.import_module(path)
+        for part in name.split("."):
+            obj = getattr(obj, part)
+        return obj
+    from mcp_tools.registry import MCPRegistry
+    registry = MCPRegistry()
+    registry.add_provider(path)
+    if name not in registry.tools:
+        raise RuntimeError(f"Tool '{name}' not registered by {path}")
+    return registry.tools[name]["func"]
+
+
+def _process_entry(conn, target, arguments):
+    try:
+        result = _resolve_target(target)(**arguments)
+        try:
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"Result is not serializable: {e}"))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def run_in_process(func, arguments, timeout, target=None):
+    """Выполнить в отдельном процессе; по таймауту процесс убивается.
+
+    Процесс запускается через spawn: fork многопоточного процесса (Flask, планировщик, пулы) может
+    унаследовать захваченные другими потоками блокировки и зависнуть. Поэтому в процесс передается
+    не функция, а target - путь, по которому он импортирует ее сам (см. _resolve_target)"""
+    target = target or function_target(func)
+    if target is None:
+        print("[ToolExecutor] ⚠️  tool cannot be imported in a child process, falling back to thread policy")
+        return run_in_thread(func, arguments, timeout)
+
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_process_entry, args=(child_conn, target, arguments), daemon=True)
+    process.start()
+    child_conn.close()
+    try:
+        if not parent_conn.poll(timeout):
+            raise ToolTimeout()
+        try:
+            status, payload = parent_conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Tool process exited with code {process.exitcode}")
+    finally:
+        parent_conn.close()
+        if process.is_alive():
+            process.kill()
+        process.join(1)
+
+    if status == "error":
+        raise RuntimeError(payload)
+    return payload
+
+
+def execute(func, arguments, policy="inline", timeout=None, target=None):
+    if policy == "process":
+        return run_in_process(func, arguments, timeout, target)
+    if policy == "thread":
+        return run_in_thread(func, arguments, timeout)
+    return func(**arguments)
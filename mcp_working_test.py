@@ -58,6 +58,89 @@ def test_mcp_list_tools():
         traceback.print_exc()
 
 
+# Локальный stand-in MCP сервер на Python: initialize, tools/list, tools/call (echo, sleep, crash)
+STANDIN_SERVER = r"""
+import json, os, sys, time, threading
+lock = threading.Lock()
+def reply(msg):
+    with lock:
+        sys.stdout.write(json.dumps(msg) + "\n")
+        sys.stdout.flush()
+def handle(req):
+    method, params = req.get("method"), req.get("params", {})
+    if method == "initialize":
+        return {"protocolVersion": "2024-11-05", "capabilities": {"tools": {}}, "serverInfo": {"name": "standin", "version": "0.1"}}
+    if method == "tools/list":
+        return {"tools": [
+            {"name": "echo", "description": "Echo text", "inputSchema": {"type": "object", "properties": {"text": {"type": "string"}}}},
+            {"name": "sleep", "description": "Sleep seconds", "inputSchema": {"type": "object", "properties": {"seconds": {"type": "number"}}}},
+            {"name": "crash", "description": "Exit process", "inputSchema": {"type": "object", "properties": {}}}]}
+    if method == "tools/call":
+        name, args = params["name"], params.get("arguments", {})
+        if name == "crash":
+            os._exit(1)
+        if name == "sleep":
+            time.sleep(args.get("seconds", 0.1))
+        return {"content": [{"type": "text", "text": args.get("text", name)}]}
+    raise ValueError(method)
+for line in sys.stdin:
+    req = json.loads(line)
+    if "id" not in req:
+        continue
+    def work(req=req):
+        try:
+            reply({"jsonrpc": "2.0", "id": req["id"], "result": handle(req)})
+        except ValueError as e:
+            reply({"jsonrpc": "2.0", "id": req["id"], "error": {"code": -32601, "message": str(e)}})
+    threading.Thread(target=work).start()
+"""
+
+
+def test_pooled_client():
+    """Тест пула stdio-клиентов на локальном stand-in сервере: мультиплексирование, импорт, перезапуск.
+    Возвращает True, если все проверки прошли"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from mcp_tools.mcp_client import MCPClientPool
+    from mcp_tools.registry import MCPRegistry
+
+    print("🔌 Запуск stand-in MCP сервера...\n")
+    pool = MCPClientPool()
+    server = pool.add_server("standin", [sys.executable, "-c", STANDIN_SERVER], request_timeout=5)
+    server.base_backoff = 0.2
+    registry = MCPRegistry()
+    checks = []
+    try:
+        count = pool.import_tools(registry, "standin")
+        checks.append((f"импортировано инструментов: {count}", count > 0))
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(
+                lambda i: registry.execute_tool("standin_sleep", {"seconds": 0.5, "text": str(i)}), range(10)
+            ))
+        elapsed = time.time() - start
+        ordered = all(r.get("content") == str(i) for i, r in enumerate(results))
+        checks.append((f"10 параллельных вызовов за {elapsed:.2f}s, ответы сопоставлены по id", ordered))
+
+        # аргумент с именем служебного параметра обертки уходит на сервер как обычный
+        echoed = registry.execute_tool("standin_echo", {"text": "ok", "_tool": "x"})
+        checks.append((f"аргумент _tool: {echoed}", echoed.get("content") == "ok" and "error" not in echoed))
+
+        print(f"💥 Падение сервера: {registry.execute_tool('standin_crash', {})}")
+        time.sleep(1)
+        restarted = registry.execute_tool("standin_echo", {"text": "alive"})
+        checks.append((f"после перезапуска: {restarted}",
+                       restarted.get("content") == "alive" and "error" not in restarted))
+        print(f"📋 Статус: {pool.status()}")
+    finally:
+        pool.stop_all()
+
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+    return all(ok for _, ok in checks)
+
+
 def test_simple():
     """Простой тест доступности MCP"""
     print("🧪 Простая проверка MCP сервера...\n")
@@ -88,6 +171,10 @@ if __name__ == "__main__":
     print("MCP SERVER TEST")
     print("=" * 60 + "\n")
 
+    # Пул клиентов на локальном stand-in сервере (не требует npx)
+    pooled_ok = test_pooled_client()
+    print()
+
     # Сначала простой тест
     if test_simple():
         print("\n" + "=" * 60)
@@ -95,3 +182,6 @@ if __name__ == "__main__":
         print("=" * 60 + "\n")
         # Затем тест протокола
         test_mcp_list_tools()
+
+    if not pooled_ok:
+        sys.exit(1)
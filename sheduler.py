@@ -1,14 +1,23 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 import os
 import json
-import anthropic
-import io
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from mcp_tools.drive_watch import drive_watch
+from mcp_tools.drive_client import walk_folder, ChangesFeed, CHANGE_FIELDS, FOLDER_MIME, DEFAULT_MAX_DEPTH
+from mcp_tools.extractors import read_text, UnsupportedFormat
+from mcp_tools.summary_cache import get_summary, save_summary, cached_tokens
+
+# Повышать при изменении промпта анализа
+MONITOR_PROMPT_VERSION = "monitor-v1"
+# Серия push-уведомлений за это время схлопывается в один запуск монитора
+WEBHOOK_DEBOUNCE = float(os.getenv("GDRIVE_WEBHOOK_DEBOUNCE", "2"))
 
 gdrive_service = None
-previous_files = {}
 scheduler_instance = None
+# Уведомление, пришедшее во время тика, запускает еще один тик сразу после текущего
+_tick_lock = threading.Lock()
+_tick_running = False
+_rerun_pending = False
 
 def set_gdrive_service(service):
     global gdrive_service
@@ -28,39 +37,23 @@ def send_telegram_alert(title, details):
     from mcp_tools.notifications import send_telegram_alert as send_alert
     return send_alert(title, details)
 
-def read_file_content(file_id, mime_type, file_name):
+def read_file_content(file_id, mime_type, file_name, revision=None):
     if not gdrive_service:
         return None
 
     try:
-        if mime_type == 'application/vnd.google-apps.document':
-            request = gdrive_service.files().export(fileId=file_id, mimeType='text/plain')
-        elif mime_type == 'application/vnd.google-apps.spreadsheet':
-            request = gdrive_service.files().export(fileId=file_id, mimeType='text/csv')
-        elif 'text' in mime_type or mime_type in ['application/json', 'application/javascript', 'application/xml']:
-            request = gdrive_service.files().get_media(fileId=file_id)
-        else:
-            return None
-
-        file_stream = io.BytesIO()
-        from googleapiclient.http import MediaIoBaseDownload
-        downloader = MediaIoBaseDownload(file_stream, request)
-
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-
-        file_stream.seek(0)
-        content = file_stream.read().decode('utf-8', errors='ignore')
-
         max_chars = 5000
-        if len(content) > max_chars:
-            truncate_msg = f"\n\n[...truncated, total {len(content)} chars]"
-            content = content[:max_chars] + truncate_msg
+        # revision - md5 или modifiedTime из снимка, read_text берет ее через file_revision
+        file_info = {'mimeType': mime_type, 'md5Checksum': revision}
+        content, truncated = read_text(gdrive_service, file_id, file_info, max_chars)
+        if truncated:
+            content = content + f"\n\n[...truncated, first {max_chars} chars]"
 
         print(f"[Scheduler] 📖 Read {len(content)} chars from {file_name}")
         return content
 
+    except UnsupportedFormat:
+        return None
     except Exception as e:
         print(f"[Scheduler] ⚠️  Cannot read {file_name}: {e}")
         return None
@@ -70,11 +63,6 @@ def analyze_new_files_with_claude(new_files):
         return None
 
     try:
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            return None
-
-        client = anthropic.Anthropic(api_key=api_key)
         model = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
 
         files_data = []
@@ -92,7 +80,20 @@ def analyze_new_files_with_claude(new_files):
 
         all_files = "\n\n--- ФАЙЛ ---\n\n".join(files_data)
 
-        prompt = f"""Ты - умный ассистент для анализа файлов. Проанализируй новые файлы добавленные в Google Drive.
+        # тот же набор файлов с тем же содержимым уже анализировался - ответ из кэша
+        cached = get_summary(all_files, model, MONITOR_PROMPT_VERSION, "monitor")
+        if cached:
+            print(f"[Scheduler] 🤖 Claude analysis from cache ({cached_tokens(cached)} tokens saved)")
+            return cached["summary"]
+
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            return None
+
+        import anthropic
+        client = anthropic.Anthropic(api_key=api_key)
+
+        prompt = f"""Ты - умный ассистент для анализа файлов. Проанализируй новые и измененные файлы в Google Drive.
 
 {all_files}
 
@@ -103,13 +104,18 @@ def analyze_new_files_with_claude(new_files):
 
 Будь конкретен и полезен."""
 
-        response = client.messages.create(
-            model=model,
-            max_tokens=500,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        from mcp_tools.metrics import time_anthropic
+        from mcp_tools.rate_limit import anthropic_limiter
+        with anthropic_limiter, time_anthropic("monitor"):
+            response = client.messages.create(
+                model=model,
+                max_tokens=500,
+                messages=[{"role": "user", "content": prompt}]
+            )
 
         summary = response.content[0].text if response.content else None
+        if summary:
+            save_summary(all_files, model, MONITOR_PROMPT_VERSION, summary, response)
         print(f"[Scheduler] 🤖 Claude analysis complete")
         return summary
 
@@ -117,55 +123,178 @@ def analyze_new_files_with_claude(new_files):
         print(f"[Scheduler] ❌ Claude analysis error: {e}")
         return None
 
-def get_folder_files(folder_id):
+FILE_FIELDS = CHANGE_FIELDS
+
+def to_file_entry(f):
+    size_mb = int(f.get('size', 0)) / (1024**2) if f.get('size') else 0
+    return {
+        "id": f.get('id'),
+        "name": f.get('name'),
+        "type": f.get('mimeType'),
+        "size_mb": round(size_mb, 2),
+        "modified": f.get('modifiedTime'),
+        "created": f.get('createdTime'),
+        "md5": f.get('md5Checksum'),
+        "depth": f.get('depth', 0)
+    }
+
+def iter_folder_files(folder_id, exclude_ids=()):
+    """Рекурсивный листинг папки (до GDRIVE_MAX_DEPTH) - генератор, дерево не держится в памяти"""
     if not gdrive_service:
-        return []
-
-    try:
-        query = f"'{folder_id}' in parents and trashed=false"
-        results = gdrive_service.files().list(
-            q=query,
-            pageSize=100,
-            fields="files(id, name, mimeType, size, modifiedTime, createdTime)",
-            orderBy="createdTime desc",
-            supportsAllDrives=True
-        ).execute()
-
-        files = []
-        for f in results.get('files', []):
-            size_mb = int(f.get('size', 0)) / (1024**2) if f.get('size') else 0
-            files.append({
-                "id": f.get('id'),
-                "name": f.get('name'),
-                "type": f.get('mimeType'),
-                "size_mb": round(size_mb, 2),
-                "modified": f.get('modifiedTime'),
-                "created": f.get('createdTime')
-            })
-
-        return files
-    except Exception as e:
-        print(f"[Scheduler] ❌ Error getting files: {e}")
-        return []
-
-def detect_new_files(folder_id, current_files):
-    global previous_files
-
-    if folder_id not in previous_files:
-        previous_files[folder_id] = {f['id']: f for f in current_files}
-        return []
+        return
+    for f in walk_folder(gdrive_service, folder_id, DEFAULT_MAX_DEPTH, fields=FILE_FIELDS, exclude_ids=exclude_ids):
+        yield to_file_entry(f)
+
+def changes_token_key(folder_id):
+    return f"gdrive_changes_token:{folder_id}"
+
+class FolderTreeChanged(Exception):
+    """Папка появилась в дереве или ушла из него - дельта не описывает ее содержимое"""
+
+def apply_changes(folder_id, changes, exclude_ids=()):
+    """Применить изменения к снимку дерева папки в БД. Возвращает (new_files, modified_files, deleted_files).
+
+    Из снимка читаются только файлы, затронутые изменениями, и их родительские папки, поэтому
+    память не растет с размером дерева. Файл входит в дерево, если один из родителей - корень
+    или папка снимка, и глубина не больше GDRIVE_MAX_DEPTH. Если подпапка переместилась в дерево
+    или из него, поднимается FolderTreeChanged: ее содержимое не приходит в changes.list"""
+    from database import get_snapshot_files, apply_snapshot_changes
+
+    changes = [change for change in changes if change.get('fileId') not in exclude_ids]
+    changed_ids = {change.get('fileId') for change in changes}
+    parent_ids = {parent for change in changes for parent in (change.get('file') or {}).get('parents', [])}
+    stored = get_snapshot_files(folder_id, changed_ids | parent_ids)
+    # глубина детей каждой папки дерева; у детей корня - 0
+    child_depth = {file_id: entry['depth'] + 1 for file_id, entry in stored.items()
+                   if 'folder' in (entry['type'] or '')}
+    child_depth[folder_id] = 0
+    known = {file_id: entry for file_id, entry in stored.items() if file_id in changed_ids}
+    stored_ids = set(known)
+    dirty_ids = set()
+    status = {}
+
+    for change in changes:
+        file_id = change.get('fileId')
+        f = change.get('file') or {}
+        depths = [child_depth[parent] for parent in f.get('parents', []) if parent in child_depth]
+        in_tree = (not change.get('removed') and not f.get('trashed')
+                   and bool(depths) and min(depths) <= DEFAULT_MAX_DEPTH)
+        is_folder = f.get('mimeType') == FOLDER_MIME or 'folder' in (known.get(file_id, {}).get('type') or '')
+        if is_folder and in_tree != (file_id in known):
+            raise FolderTreeChanged(file_id)
+
+        if in_tree:
+            entry = to_file_entry({**f, 'depth': min(depths)})
+            previous = known.get(file_id)
+            if previous is None:
+                status[file_id] = 'new'
+            elif (previous.get('modified'), previous.get('md5')) != (entry['modified'], entry['md5']):
+                # файл, появившийся в этом же наборе изменений, остается новым
+                if status.get(file_id) != 'new':
+                    status[file_id] = 'modified'
+            known[file_id] = entry
+            dirty_ids.add(file_id)
+        elif file_id in known:
+            deleted = known.pop(file_id)
+            if status.get(file_id) == 'new':
+                del status[file_id]
+            else:
+                status[file_id] = ('deleted', deleted)
 
-    prev_ids = set(previous_files[folder_id].keys())
-    curr_ids = {f['id'] for f in current_files}
+    apply_snapshot_changes(
+        folder_id,
+        [known[file_id] for file_id in dirty_ids if file_id in known],
+        [file_id for file_id in stored_ids if file_id not in known]
+    )
 
-    new_ids = curr_ids - prev_ids
-    new_files = [f for f in current_files if f['id'] in new_ids]
+    new_files, modified_files, deleted_files = [], [], []
+    for file_id, state in status.items():
+        if state == 'new':
+            new_files.append(known[file_id])
+        elif state == 'modified':
+            modified_files.append(known[file_id])
+        else:
+            deleted_files.append(state[1])
+    return new_files, modified_files, deleted_files
+
+def sync_folder(folder_id, exclude_ids=(), feed=None):
+    """Инкрементальная синхронизация через Changes API, снимок папки хранится в SQLite.
+
+    Без токена (первый запуск или токен сброшен после ошибки) токен берется до полного листинга,
+    чтобы не пропустить изменения между ними. Если снимок уже есть, листинг сравнивается с ним,
+    и изменения за время простоя не теряются. Дальше каждый тик читает только дельту changes.list;
+    feed - ChangesFeed тика, общий с зеркалом метаданных."""
+    from database import get_setting, set_setting, replace_snapshot, diff_snapshot
+
+    token_key = changes_token_key(folder_id)
+    snapshot_key = f"gdrive_snapshot_at:{folder_id}"
+    token = get_setting(1, token_key)
+    feed = feed or ChangesFeed(gdrive_service, [token], FILE_FIELDS)
+
+    if not token:
+        token = feed.start_token()
+        listed = 0
+
+        def current_files():
+            # листинг потоком уходит в executemany, без списка всего дерева в памяти
+            nonlocal listed
+            for f in iter_folder_files(folder_id, exclude_ids):
+                listed += 1
+                yield f
+
+        if get_setting(1, snapshot_key):
+            result = diff_snapshot(folder_id, current_files())
+            print(f"[Scheduler] 🔁 Catch-up: {listed} files, "
+                  f"{len(result[0])} new, {len(result[1])} modified, {len(result[2])} deleted")
+        else:
+            replace_snapshot(folder_id, current_files())
+            result = [], [], []
+            print(f"[Scheduler] 📸 Baseline: {listed} files")
+        set_setting(1, snapshot_key, datetime.now().isoformat())
+        set_setting(1, token_key, token)
+        return result
 
-    previous_files[folder_id] = {f['id']: f for f in current_files}
+    try:
+        changes, new_token = feed.changes(token)
+    except Exception as e:
+        # недействительный токен - следующий тик сверит листинг с сохраненным снимком
+        print(f"[Scheduler] ❌ changes.list failed, resetting token: {e}")
+        set_setting(1, token_key, '')
+        return [], [], []
 
-    return new_files
+    try:
+        result = apply_changes(folder_id, changes, exclude_ids)
+    except FolderTreeChanged as e:
+        # содержимое перемещенной папки сверит полный обход на следующем тике
+        print(f"[Scheduler] 🌳 Folder {e} moved in/out of the tree, rescanning on next tick")
+        set_setting(1, token_key, '')
+        return [], [], []
+    set_setting(1, token_key, new_token)
+    print(f"[Scheduler] 🔄 {len(changes)} change(s) since last tick")
+    return result
 
 def folder_monitoring_task():
+    """Тик монитора. Если во время тика пришло push-уведомление (trigger_monitor_now), тик
+    повторяется сразу, а не ждет следующего опроса"""
+    global _tick_running, _rerun_pending
+    with _tick_lock:
+        _tick_running = True
+        _rerun_pending = False
+    try:
+        while True:
+            monitor_folder()
+            with _tick_lock:
+                if not _rerun_pending:
+                    # сброс под той же блокировкой: уведомление после него запланирует новый тик
+                    _tick_running = False
+                    return
+                _rerun_pending = False
+            print("[Scheduler] 📬 Changes notified during the check, checking again")
+    finally:
+        with _tick_lock:
+            _tick_running = False
+
+def monitor_folder():
     folder_id = os.getenv("GDRIVE_FOLDER_ID")
     output_folder_id = os.getenv("GDRIVE_OUTPUT_FOLDER_ID")
 
@@ -173,68 +302,161 @@ def folder_monitoring_task():
         print("[Scheduler] ⚠️  GDRIVE_FOLDER_ID not configured")
         return
 
+    if not gdrive_service:
+        return
+
     print(f"[Scheduler] 🔍 Checking folder: {folder_id}")
 
-    current_files = get_folder_files(folder_id)
+    # канал push-уведомлений продлевается на тиках; при действующем канале опрос редкий
+    if drive_watch.enabled:
+        try:
+            drive_watch.ensure_channel(gdrive_service)
+        except Exception as e:
+            print(f"[Scheduler] ⚠️  Drive watch renewal failed: {e}")
+        apply_polling_interval()
 
-    if output_folder_id:
-        current_files = [f for f in current_files if f['id'] != output_folder_id]
+    # зеркало метаданных для поисковых инструментов обновляется тем же тиком и той же дельтой
+    from database import get_setting
+    from mcp_tools.drive_mirror import drive_mirror
+    mirror_enabled = drive_mirror.max_age > 0
+    feed = ChangesFeed(gdrive_service, [
+        get_setting(1, changes_token_key(folder_id)),
+        drive_mirror.token() if mirror_enabled else None
+    ], FILE_FIELDS)
+    if mirror_enabled:
+        try:
+            drive_mirror.refresh(gdrive_service, feed)
+        except Exception as e:
+            print(f"[Scheduler] ⚠️  Drive mirror refresh failed: {e}")
 
-    if not current_files:
-        send_telegram_alert("📁 Google Drive Monitor", "⚠️ Папка пуста или недоступна")
+    try:
+        new_files, modified_files, deleted_files = sync_folder(
+            folder_id, exclude_ids={output_folder_id} if output_folder_id else (), feed=feed
+        )
+    except Exception as e:
+        print(f"[Scheduler] ❌ Sync error: {e}")
+        send_telegram_alert("📁 Google Drive Monitor", "⚠️ Папка недоступна")
         return
 
-    folders = sum(1 for f in current_files if 'folder' in f['type'])
-    regular_files = len(current_files) - folders
+    from database import get_snapshot_stats
+    total, folders = get_snapshot_stats(folder_id)
 
-    new_files = detect_new_files(folder_id, current_files)
+    if not total:
+        send_telegram_alert("📁 Google Drive Monitor", "⚠️ Папка пуста или недоступна")
+        return
 
-    print(f"[Scheduler] 📊 Stats: {len(current_files)} total, {len(new_files)} new")
+    regular_files = total - folders
 
-    if new_files:
+    print(f"[Scheduler] 📊 Stats: {total} total, {len(new_files)} new, "
+          f"{len(modified_files)} modified, {len(deleted_files)} deleted")
+
+    if new_files or modified_files or deleted_files:
         message_parts = []
         message_parts.append("📊 <b>Статистика:</b>")
-        message_parts.append(f"  • Всего: <b>{len(current_files)}</b> ({folders} папок, {regular_files} файлов)")
+        message_parts.append(f"  • Всего: <b>{total}</b> ({folders} папок, {regular_files} файлов)")
         message_parts.append(f"  • 🆕 Новых: <b>{len(new_files)}</b>")
-        message_parts.append("")
-        message_parts.append("📄 <b>Новые файлы:</b>")
+        message_parts.append(f"  • ✏️ Изменено: <b>{len(modified_files)}</b>")
+        message_parts.append(f"  • 🗑 Удалено: <b>{len(deleted_files)}</b>")
 
-        for f in new_files[:5]:
-            file_type = "📁" if 'folder' in f['type'] else "📄"
-            message_parts.append(f"  {file_type} <code>{f['name']}</code> ({f['size_mb']} MB)")
+        for title, files in (("📄 <b>Новые файлы:</b>", new_files), ("✏️ <b>Измененные файлы:</b>", modified_files)):
+            if not files:
+                continue
+            message_parts.append("")
+            message_parts.append(title)
 
-            if f['size_mb'] < 5 and 'folder' not in f['type']:
-                content = read_file_content(f['id'], f['type'], f['name'])
-                if content:
-                    f['content'] = content
-                    preview = content[:150].replace('\n', ' ')
-                    message_parts.append(f"    <i>{preview}...</i>")
+            for f in files[:5]:
+                file_type = "📁" if 'folder' in f['type'] else "📄"
+                message_parts.append(f"  {file_type} <code>{f['name']}</code> ({f['size_mb']} MB)")
 
-        print("[Scheduler] 🤖 Analyzing with Claude...")
-        claude_summary = analyze_new_files_with_claude(new_files)
+                if f['size_mb'] < 5 and 'folder' not in f['type']:
+                    content = read_file_content(f['id'], f['type'], f['name'], f.get('md5') or f.get('modified'))
+                    if content:
+                        f['content'] = content
+                        preview = content[:150].replace('\n', ' ')
+                        message_parts.append(f"    <i>{preview}...</i>")
 
-        if claude_summary:
+        if deleted_files:
             message_parts.append("")
-            message_parts.append("🤖 <b>Анализ Claude:</b>")
-            message_parts.append(f"<i>{claude_summary}</i>")
+            message_parts.append("🗑 <b>Удаленные файлы:</b>")
+            for f in deleted_files[:5]:
+                message_parts.append(f"  <code>{f['name']}</code>")
+
+        changed_files = new_files + modified_files
+        if changed_files:
+            print("[Scheduler] 🤖 Analyzing with Claude...")
+            claude_summary = analyze_new_files_with_claude(changed_files)
+
+            if claude_summary:
+                message_parts.append("")
+                message_parts.append("🤖 <b>Анализ Claude:</b>")
+                message_parts.append(f"<i>{claude_summary}</i>")
 
         message = "\n".join(message_parts)
-        send_telegram_alert("🆕 Новые файлы в Google Drive!", message)
+        send_telegram_alert("🆕 Изменения в Google Drive!", message)
         print("[Scheduler] ✅ Notification sent with analysis")
 
     else:
         message = f"""📊 <b>Статистика:</b>
-  • Всего: <b>{len(current_files)}</b> ({folders} папок, {regular_files} файлов)
+  • Всего: <b>{total}</b> ({folders} папок, {regular_files} файлов)
 
 ✅ Новых файлов нет"""
 
         send_telegram_alert("📁 Google Drive Monitor", message)
         print("[Scheduler] ✅ No new files")
 
+def polling_interval(interval=None):
+    """Интервал опроса: monitor_interval, а при действующем push-канале - не чаще fallback_interval"""
+    from mcp_tools.drive_mirror import drive_mirror
+    if interval is None:
+        from database import get_setting
+        interval = int(get_setting(1, 'monitor_interval', '30'))
+    if drive_watch.is_active():
+        interval = max(interval, drive_watch.fallback_interval)
+        # зеркало обновляется тиками монитора - при редком опросе оно не должно считаться устаревшим
+        drive_mirror.push_interval = interval
+    else:
+        drive_mirror.push_interval = 0
+    return interval
+
+def apply_polling_interval(interval=None):
+    if scheduler_instance is None:
+        return
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    seconds = polling_interval(interval)
+    job = scheduler_instance.get_job('gdrive_monitor')
+    if job and job.trigger.interval.total_seconds() != seconds:
+        scheduler_instance.reschedule_job('gdrive_monitor', trigger=IntervalTrigger(seconds=seconds))
+        print(f"[Scheduler] ⏱️  Polling every {seconds} seconds")
+
+def trigger_monitor_now(delay=None):
+    """Внеочередной запуск монитора по push-уведомлению. Запуск сдвигается только вперед, поэтому
+    серия уведомлений дает один запуск. Одновременно работает не больше одного тика (max_instances=1):
+    уведомление во время тика помечает повтор, который тик выполнит сам после завершения"""
+    global _rerun_pending
+    if scheduler_instance is None:
+        return False
+    job = scheduler_instance.get_job('gdrive_monitor')
+    if job is None:
+        return False
+    with _tick_lock:
+        if _tick_running:
+            _rerun_pending = True
+            print("[Scheduler] 📬 Drive notification during a check, queued a follow-up check")
+            return True
+    delay = WEBHOOK_DEBOUNCE if delay is None else delay
+    tz = job.next_run_time.tzinfo if job.next_run_time else None
+    run_at = datetime.now(tz) + timedelta(seconds=delay)
+    if job.next_run_time is None or job.next_run_time > run_at:
+        job.modify(next_run_time=run_at)
+        print(f"[Scheduler] 📬 Drive notification, checking in {delay:g}s")
+    return True
+
 def start_scheduler():
-    from database import get_setting
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
 
-    interval = int(get_setting(1, 'monitor_interval', '30'))
+    interval = polling_interval()
 
     scheduler = BackgroundScheduler()
 
@@ -256,9 +478,10 @@ def update_scheduler_interval(new_interval):
 
     if scheduler_instance:
         try:
+            from apscheduler.triggers.interval import IntervalTrigger
             scheduler_instance.reschedule_job(
                 'gdrive_monitor',
-                trigger=IntervalTrigger(seconds=new_interval)
+                trigger=IntervalTrigger(seconds=polling_interval(int(new_interval)))
             )
             print(f"[Scheduler] ✅ Interval updated to {new_interval} seconds")
         except Exception as e:
@@ -270,4 +493,4 @@ def get_scheduler():
     global scheduler_instance
     if scheduler_instance is None:
         scheduler_instance = start_scheduler()
-    return scheduler_instance
\ No newline at end of file
+    return scheduler_instance